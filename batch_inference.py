@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:31:47 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# ResidentPredictor loads a Keras model once, warms it up and then scores any
+# number of window arrays. Windows from many electrodes and seizures can be
+# passed as a stream of chunks of any size; they are regrouped into batches
+# of a fixed size so every call into Keras is large enough to keep the
+# backend busy. The batch size is picked at warm-up by timing increasing
+# batch sizes, bounded by a memory budget.
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import time
+import collections
+import numpy as np
+
+from keras.models import load_model
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+SEQUENCE_LEN = 1024
+
+MIN_BATCH_SIZE = 32
+MAX_BATCH_SIZE = 8192
+BATCH_MEMORY_BYTES = 256 * 1024 * 1024
+TUNE_MIN_GAIN = 1.1
+TUNE_REPEATS = 3
+
+
+# ------------------
+# WINDOWS
+# ------------------
+def create_windows(channel, sequence_len = SEQUENCE_LEN, step_size = STEP_SIZE):
+    """
+    Returns a read-only windows x sequence_len x 1 view of channel with
+    windows ending at range(sequence_len, len(channel), step_size), the same
+    windows as create_merge_dataset in create_predictions.py.
+    """
+    channel = np.ascontiguousarray(channel, dtype = np.float32)
+    num_windows = len(range(sequence_len, len(channel), step_size))
+    stride = channel.strides[0]
+    return np.lib.stride_tricks.as_strided(channel,
+                                           shape = (num_windows, sequence_len, 1),
+                                           strides = (step_size * stride, stride, stride),
+                                           writeable = False)
+
+def iter_merge_windows(data, split_point, sequence_len = SEQUENCE_LEN,
+                       step_size = STEP_SIZE):
+    """
+    Yields window arrays in create_merge_dataset order: for each electrode,
+    the interictal windows and then the ictal windows.
+
+    :param data: DataFrame, rows = decimated samples, columns = electrodes.
+    :param split_point: number of interictal rows at the top of data.
+    """
+    for column in data:
+        channel = np.asarray(data[column], dtype = np.float32)
+        yield create_windows(channel[: split_point], sequence_len, step_size)
+        yield create_windows(channel[split_point :], sequence_len, step_size)
+
+
+# ------------------
+# PREDICTOR
+# ------------------
+_predictors = {}
+
+def load_predictor(path, **kwargs):
+    """
+    Returns the ResidentPredictor for the model at path, loading it the first
+    time it is requested.
+    """
+    predictor = _predictors.get(path)
+    if predictor is None:
+        predictor = ResidentPredictor.from_path(path, **kwargs)
+        _predictors[path] = predictor
+    return predictor
+
+class ResidentPredictor:
+    """
+    A Keras model kept in memory for repeated batched inference.
+
+    Attributes:
+        model: The loaded keras model.
+        input_shape: The shape of one window, without the batch dimension.
+        batch_size: The number of windows passed to the model per call.
+    """
+
+    def __init__(self, model, batch_size = None, memory_bytes = BATCH_MEMORY_BYTES):
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.memory_bytes = memory_bytes
+        max_size = self.max_batch_size()
+        if batch_size is None:
+            self.batch_size = self.tune_batch_size(max_size)
+        else:
+            self.batch_size = min(batch_size, max_size)
+            self.warm_up()
+
+    @classmethod
+    def from_path(cls, path, **kwargs):
+        return cls(load_model(path), **kwargs)
+
+    def max_batch_size(self):
+        """
+        Returns the largest batch whose float32 input and layer outputs fit
+        in memory_bytes.
+        """
+        values = int(np.prod(self.input_shape))
+        for layer in self.model.layers:
+            values += int(np.prod([d for d in layer.output_shape[1:] if d]))
+        size = self.memory_bytes // (4 * values)
+        return int(max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, size)))
+
+    def warm_up(self, batch_size = None):
+        """
+        Runs the model once so graph construction is not paid by real data.
+        """
+        batch_size = batch_size or self.batch_size
+        self.model.predict_on_batch(
+            np.zeros((batch_size,) + self.input_shape, dtype = np.float32))
+
+    def tune_batch_size(self, max_size):
+        """
+        Doubles the batch size from MIN_BATCH_SIZE while throughput keeps
+        improving by at least TUNE_MIN_GAIN, and returns the best size.
+        """
+        best_size = MIN_BATCH_SIZE
+        best_rate = 0.0
+        size = MIN_BATCH_SIZE
+        while size <= max_size:
+            batch = np.zeros((size,) + self.input_shape, dtype = np.float32)
+            self.model.predict_on_batch(batch)
+            start = time.perf_counter()
+            for _ in range(TUNE_REPEATS):
+                self.model.predict_on_batch(batch)
+            rate = size * TUNE_REPEATS / (time.perf_counter() - start)
+            if rate < best_rate * TUNE_MIN_GAIN:
+                break
+            best_size, best_rate = size, rate
+            size *= 2
+        return best_size
+
+    def predict_batches(self, windows):
+        """
+        Returns model outputs for an array of windows, one batch at a time.
+        """
+        preds = np.zeros((len(windows),) + tuple(self.model.output_shape[1:]),
+                         dtype = np.float32)
+        for start in range(0, len(windows), self.batch_size):
+            batch = np.asarray(windows[start : start + self.batch_size],
+                               dtype = np.float32)
+            preds[start : start + len(batch)] = self.model.predict_on_batch(batch)
+        return preds
+
+    def predict_stream(self, chunks):
+        """
+        Yields model outputs for each array in chunks, in order.
+
+        Chunks of any size (for example the windows of one electrode) are
+        regrouped into full batches before they reach the model, so only the
+        final batch of the stream can be short.
+        """
+        sizes = collections.deque()
+        inputs = []
+        input_count = 0
+        outputs = []
+        output_count = 0
+        for chunk in chunks:
+            sizes.append(len(chunk))
+            inputs.append(chunk)
+            input_count += len(chunk)
+            if input_count >= self.batch_size:
+                windows = np.concatenate(inputs)
+                full = input_count - input_count % self.batch_size
+                outputs.append(self.predict_batches(windows[: full]))
+                output_count += full
+                inputs = [windows[full :]]
+                input_count -= full
+            while sizes and sizes[0] <= output_count:
+                size = sizes.popleft()
+                ready = np.concatenate(outputs) if outputs else self._empty_output()
+                outputs = [ready[size :]]
+                output_count -= size
+                yield ready[: size]
+
+        if input_count:
+            outputs.append(self.predict_batches(np.concatenate(inputs)))
+        for size in sizes:
+            ready = np.concatenate(outputs) if outputs else self._empty_output()
+            outputs = [ready[size :]]
+            yield ready[: size]
+
+    def _empty_output(self):
+        return np.zeros((0,) + tuple(self.model.output_shape[1:]), dtype = np.float32)
+
+    def predict(self, windows):
+        return self.predict_batches(windows)
+
+    def predict_classes(self, windows):
+        return (self.predict_batches(windows) > 0.5).astype(np.int32)
@@ -19,11 +19,9 @@ Created on Fri Aug 14 15:06:41 2020
 # ------------------
 # REGULAR IMPORTS
 # ------------------
-import pickle
 import pandas as pd
 import numpy as np
 import math
-from scipy import signal
 import matplotlib.pyplot as plt
 import argparse
 
@@ -45,6 +43,11 @@ from keras.callbacks import ModelCheckpoint
 from keras.callbacks import EarlyStopping
 from keras.wrappers.scikit_learn import KerasClassifier
 
+from wavenet_inference import DenseWaveNet
+from batch_inference import load_predictor, iter_merge_windows
+from prediction_store import PredictionStore
+from seizure_data import load_seizure
+
 # ------------------
 # ARGUMENT PARSER
 # ------------------
@@ -61,6 +64,10 @@ ap.add_argument("-i", "--dataset_id", type = str, default = 'hup172',
             help = "Dataset name.")
 ap.add_argument("-m", "--model_name", type = str, default = 'eeg-model-cnn-wavenet',
             help = "Model name.")
+ap.add_argument("-f", "--dense", action = "store_true",
+            help = "Run the WaveNet once over each channel instead of per window.")
+ap.add_argument("-s", "--store", type = str, default = None,
+            help = "Prediction store directory to save window probabilities in.")
 args = vars(ap.parse_args())
 
 
@@ -76,47 +83,10 @@ DOWN_SAMPLE_FACTOR = 10
 STEP_SIZE = 256
 SEQUENCE_LEN = 1024
 
-PATH_INTERICTAL = "../datasets/" + args['dataset_id'] + "-interictal.pickle"
-PATH_ICTAL = "../datasets/" + args['dataset_id'] + "-ictal.pickle"
 PATH_LABELS = "labels/" + args['dataset_id'] + "-labels.csv"
 PATH_MODEL = "models/" + args['model_name'] + ".pkl"
 
 
-# ------------------
-# LOAD DATA
-# ------------------
-def get_data(path):
-    with open(path, 'rb') as f: data, fs = pickle.load(f)
-    labels = pd.read_csv(PATH_LABELS, header = None)
-    labels_list = labels[0].tolist()
-    data = data[data.columns.intersection(labels_list)]
-    return data
-
-def iEEG_data_filter(data, fs, cutoff1, cutoff2, notch):
-	column_names = data.columns
-	data = np.array(data)
-	number_of_channels = data.shape[1]
-    
-    # Cut-off frequency of the filter
-	fc = np.array([cutoff1, cutoff2])
-    # Normalize the frequency
-	w = fc / np.array([(fs / 2), (fs / 2)])  
-    
-	b, a = signal.butter(4, w, 'bandpass')
-	filtered = np.zeros(data.shape)
-	for i in np.arange(0,number_of_channels):
-		filtered[:,i] = signal.filtfilt(b, a, data[:,i])
-	filtered = filtered + (data[0] - filtered[0])
-	f0 = notch
-	q = 30
-	b, a = signal.iirnotch(f0, q, fs)
-	notched = np.zeros(data.shape)
-	for i in np.arange(0, number_of_channels):
-		notched[:, i] = signal.filtfilt(b, a, filtered[:, i])
-	notched_df = pd.DataFrame(notched, columns=column_names)
-	return notched_df
-
-
 # ------------------
 # DATASET OUTLINE
 # ------------------
@@ -126,12 +96,22 @@ def create_timestamps(data):
         timestamps.append(START_TIME_ICTAL + (i * FS))
     return timestamps
 
+# window end times in create_merge_dataset order, for one electrode
+def create_merge_timestamps(num_rows, split_point):
+    timestamps = []
+    for index in range(SEQUENCE_LEN, split_point, STEP_SIZE):
+        timestamps.append(START_TIME_INTERICTAL + (index * FS * DOWN_SAMPLE_FACTOR))
+    for index in range(SEQUENCE_LEN, num_rows - split_point, STEP_SIZE):
+        timestamps.append(START_TIME_ICTAL + (index * FS * DOWN_SAMPLE_FACTOR))
+    return timestamps
+
 
 # ------------------
 # PROCESS DATA
 # ------------------
 def create_merge_dataset(data, split_point, start_time_interictal, 
-                         end_time_interictal, start_time_ictal, end_time_ictal):
+                         end_time_interictal, start_time_ictal, end_time_ictal,
+                         include_sequences = True):
     dataset = []
     dataset_targets = []
     labels = pd.read_csv(PATH_LABELS, header = None)
@@ -155,9 +135,10 @@ def create_merge_dataset(data, split_point, start_time_interictal,
             
         # first process interictal data
         for index in range(SEQUENCE_LEN, split_point, STEP_SIZE):
-            sequence = col_list[(index - SEQUENCE_LEN) : index]
-            sequence = [[i] for i in sequence]
-            dataset.append(sequence)
+            if include_sequences:
+                sequence = col_list[(index - SEQUENCE_LEN) : index]
+                sequence = [[i] for i in sequence]
+                dataset.append(sequence)
     
             sequence_end_time = start_time_interictal + (index * FS * DOWN_SAMPLE_FACTOR)
             
@@ -170,9 +151,10 @@ def create_merge_dataset(data, split_point, start_time_interictal,
         # then process ictal data
         for index in range(SEQUENCE_LEN, data.shape[0] - split_point, STEP_SIZE):
             new_index = index + split_point
-            sequence = col_list[(new_index - SEQUENCE_LEN) : new_index]
-            sequence = [[i] for i in sequence]
-            dataset.append(sequence)
+            if include_sequences:
+                sequence = col_list[(new_index - SEQUENCE_LEN) : new_index]
+                sequence = [[i] for i in sequence]
+                dataset.append(sequence)
     
             sequence_end_time = start_time_ictal + (index * FS * DOWN_SAMPLE_FACTOR)
             
@@ -234,10 +216,21 @@ def create_dataset(data, start_time, end_time):
 # ------------------
 # TEST MODEL
 # ------------------
-def model_acc(model_name, test, targets):
-    pickle_name = model_name
-    model = load_model(pickle_name)
-    preds = model.predict_classes(test)
+def stream_model_probs(model_name, data, split_point):
+    predictor = load_predictor(model_name)
+    chunks = iter_merge_windows(data, split_point, SEQUENCE_LEN, STEP_SIZE)
+    return np.concatenate(list(predictor.predict_stream(chunks))).ravel()
+
+def dense_model_probs(model_name, data, split_point):
+    dense = DenseWaveNet.from_path(model_name, 
+                                   sequence_len = SEQUENCE_LEN, 
+                                   step_size = STEP_SIZE)
+    channels = np.array(data, dtype = np.float32).T
+    probs_interictal = dense.predict(channels[:, : split_point])
+    probs_ictal = dense.predict(channels[:, split_point :])
+    return np.hstack((probs_interictal, probs_ictal)).ravel()
+
+def score_predictions(targets, preds):
     acc = accuracy_score(targets, preds)
     cm = confusion_matrix(targets, preds)
     scores = precision_recall_fscore_support(targets, preds, average = 'macro')
@@ -263,34 +256,26 @@ if __name__=="__main__":
     # --------------------
     # DATA WRANGLING
     # --------------------
-    # interictal
-    data = get_data(PATH_INTERICTAL)
-    timestamps = create_timestamps(data)
-    data_filtered = iEEG_data_filter(data, FS, 0.16, 200, 60)
-    fs_downSample = FS / DOWN_SAMPLE_FACTOR
-    data_filtered_tmp = signal.decimate(data_filtered, DOWN_SAMPLE_FACTOR, axis = 0)
-    data_filtered = pd.DataFrame(data_filtered_tmp, columns = data_filtered.columns); del data_filtered_tmp
-    data_interictal = data_filtered
-    
-    # ictal
-    data = get_data(PATH_ICTAL)
-    timestamps = create_timestamps(data)
-    data_filtered = iEEG_data_filter(data, FS, 0.16, 200, 60)
-    fs_downSample = FS / DOWN_SAMPLE_FACTOR
-    data_filtered_tmp = signal.decimate(data_filtered, DOWN_SAMPLE_FACTOR, axis = 0)
-    data_filtered = pd.DataFrame(data_filtered_tmp, columns = data_filtered.columns); del data_filtered_tmp
-    data_ictal = data_filtered
-    
-    # concatenate
-    data = pd.concat([data_interictal, data_ictal], ignore_index = True)
-    dataset, dataset_targets = create_merge_dataset(data, data_interictal.shape[0],
+    data, split_point = load_seizure(args['dataset_id'])
+    dataset, dataset_targets = create_merge_dataset(data, split_point,
                                               START_TIME_INTERICTAL, END_TIME_INTERICTAL,
-                                              START_TIME_ICTAL, END_TIME_ICTAL)
+                                              START_TIME_ICTAL, END_TIME_ICTAL,
+                                              include_sequences = False)
     
     # --------------------
     # TESTING MODEL
     # --------------------
-    cnn_acc, cnn_cm, cnn_scores = model_acc(PATH_MODEL, dataset, dataset_targets)
+    if args['dense']:
+        probs = dense_model_probs(PATH_MODEL, data, split_point)
+    else:
+        probs = stream_model_probs(PATH_MODEL, data, split_point)
+    cnn_acc, cnn_cm, cnn_scores = score_predictions(dataset_targets,
+                                                    (probs > 0.5).astype(np.int32))
+    if args['store'] is not None:
+        store = PredictionStore(args['store'])
+        store.save(args['model_name'], args['dataset_id'], list(data.columns),
+                   create_merge_timestamps(data.shape[0], split_point),
+                   probs.reshape(data.shape[1], -1))
     print("Test Set Accuracy: ")
     print("%.4f" % round(cnn_acc, 4))   
     print("Test Set Confusion Matrix: ")
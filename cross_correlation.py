@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 24 14:21:06 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# All-pairs cross-correlation lags between electrodes over sliding windows,
+# for mapping how activity spreads between contacts.
+#
+# Each window is demeaned and scaled to unit norm, transformed once per
+# electrode, and the cross-spectra of every electrode pair are inverted in
+# one batched FFT. Windows are zero-padded to at least window + max lag
+# samples, so lags up to --max_lag_ms are free of circular wrap-around.
+#
+# For electrodes i and j, lags[w, i, j] = k maximises
+# |sum_t x_i[t + k] x_j[t]| over |k| <= max lag, so a positive lag means i
+# follows j. peaks[w, i, j] is the signed correlation at that lag. Both are
+# antisymmetric/symmetric in i, j; only pairs i < j are computed.
+#
+# Output is written chunk by chunk to memory-mapped .npy files:
+# <output_dir>/<id>-lags.npy      int16 windows x electrodes x electrodes,
+#                                 in decimated samples
+# <output_dir>/<id>-peaks.npy     float16 windows x electrodes x electrodes
+# <output_dir>/<id>-times.npy     int64 window end times, as in
+#                                 create_merge_dataset
+# Datasets and labels must be laid out as described in create_predictions.py.
+#
+# Sample execution:
+# python cross_correlation.py -i hup172 -l 500 -o lags
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import os
+import time
+import argparse
+import numpy as np
+from scipy import fft
+
+from seizure_data import FS, DOWN_SAMPLE_FACTOR, SEQUENCE_LEN, STEP_SIZE
+from seizure_data import load_seizure, window_end_times
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+FS_DECIMATED = FS / float(DOWN_SAMPLE_FACTOR)
+MAX_LAG_MS = 500
+CHUNK_BYTES = 256 * 1024 * 1024
+
+
+# ------------------
+# CROSS-CORRELATION
+# ------------------
+def normalise_windows(windows):
+    """
+    Returns windows demeaned and scaled to unit norm along the last axis, so
+    correlations are coefficients in [-1, 1]. Flat windows stay zero.
+    """
+    windows = windows - windows.mean(axis = -1, keepdims = True)
+    norms = np.sqrt(np.sum(windows ** 2, axis = -1, keepdims = True))
+    return windows / np.maximum(norms, np.finfo(np.float32).tiny)
+
+def pair_lags(windows, max_lag):
+    """
+    Returns (lags, peaks) for every pair i < j of a window chunk.
+
+    :param windows: 3D array, windows x electrodes x samples.
+    :param max_lag: largest lag searched, in samples.
+    :return: int16 and float32 arrays, windows x pairs, with pairs in the
+             order of np.triu_indices(electrodes, 1).
+    """
+    num_samples = windows.shape[-1]
+    n = fft.next_fast_len(num_samples + max_lag, real = True)
+    first, second = np.triu_indices(windows.shape[1], 1)
+    spectra = fft.rfft(normalise_windows(windows.astype(np.float32)), n, axis = -1,
+                       workers = -1)
+    cross = spectra[:, first] * np.conj(spectra[:, second])
+    corr = fft.irfft(cross, n, axis = -1, workers = -1)
+    # lags -max_lag .. max_lag; negative lags wrap to the end
+    corr = np.concatenate((corr[..., n - max_lag :], corr[..., : max_lag + 1]), axis = -1)
+    best = np.argmax(np.abs(corr), axis = -1)
+    peaks = np.take_along_axis(corr, best[..., np.newaxis], axis = -1)[..., 0]
+    return (best - max_lag).astype(np.int16), peaks
+
+def chunk_windows(num_electrodes, window_len, max_lag, chunk_bytes = CHUNK_BYTES):
+    """
+    Returns how many windows fit in chunk_bytes of FFT temporaries.
+    """
+    n = fft.next_fast_len(window_len + max_lag, real = True)
+    num_pairs = num_electrodes * (num_electrodes - 1) // 2
+    # complex cross-spectra, real correlations and the lag slice per pair
+    pair_bytes = (n // 2 + 1) * 8 + n * 4 + (2 * max_lag + 1) * 4 * 2
+    return max(1, chunk_bytes // max(1, num_pairs * pair_bytes))
+
+def cross_correlation_lags(signals, window_len, ends, max_lag, lags, peaks,
+                           chunk_bytes = CHUNK_BYTES):
+    """
+    Fills lags and peaks, windows x electrodes x electrodes arrays or
+    memmaps, for the windows [end - window_len, end) of signals.
+
+    :param signals: 2D array, rows = samples, columns = electrodes.
+    """
+    signals = np.asarray(signals, dtype = np.float32)
+    num_electrodes = signals.shape[1]
+    starts = np.asarray(ends, dtype = np.int64) - window_len
+    first, second = np.triu_indices(num_electrodes, 1)
+    diagonal = np.arange(num_electrodes)
+    # samples x electrodes -> windows x electrodes x samples views
+    view = np.lib.stride_tricks.sliding_window_view(signals, window_len, axis = 0)
+    size = chunk_windows(num_electrodes, window_len, max_lag, chunk_bytes)
+    for begin in range(0, len(starts), size):
+        chunk = slice(begin, begin + size)
+        chunk_lags, chunk_peaks = pair_lags(view[starts[chunk]], max_lag)
+        block_lags = np.zeros((len(chunk_lags), num_electrodes, num_electrodes),
+                              dtype = np.int16)
+        block_peaks = np.zeros(block_lags.shape, dtype = np.float32)
+        block_lags[:, first, second] = chunk_lags
+        block_lags[:, second, first] = -chunk_lags
+        block_peaks[:, first, second] = chunk_peaks
+        block_peaks[:, second, first] = chunk_peaks
+        block_peaks[:, diagonal, diagonal] = 1.0
+        lags[chunk] = block_lags
+        peaks[chunk] = block_peaks
+
+def write_lag_tensor(output_prefix, signals, start_time, max_lag,
+                     window_len = SEQUENCE_LEN, step_size = STEP_SIZE):
+    """
+    Streams the lag and peak tensors of signals to <output_prefix>-lags.npy
+    and <output_prefix>-peaks.npy, with window end times in
+    <output_prefix>-times.npy. Returns the number of windows.
+    """
+    signals = np.asarray(signals)
+    ends = np.arange(window_len, len(signals), step_size, dtype = np.int64)
+    shape = (len(ends), signals.shape[1], signals.shape[1])
+    lags = np.lib.format.open_memmap(output_prefix + "-lags.npy", mode = 'w+',
+                                     dtype = np.int16, shape = shape)
+    peaks = np.lib.format.open_memmap(output_prefix + "-peaks.npy", mode = 'w+',
+                                      dtype = np.float16, shape = shape)
+    cross_correlation_lags(signals, window_len, ends, max_lag, lags, peaks)
+    lags.flush()
+    peaks.flush()
+    np.save(output_prefix + "-times.npy",
+            window_end_times(start_time, len(signals), window_len, step_size))
+    return len(ends)
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--start_ictal", type = int, default = 402704260829,
+                help = "Start time for ictal data.")
+    ap.add_argument("-i", "--dataset_id", type = str, default = 'hup172',
+                help = "Dataset to process.")
+    ap.add_argument("-l", "--max_lag_ms", type = float, default = MAX_LAG_MS,
+                help = "Largest lag searched, in milliseconds.")
+    ap.add_argument("-w", "--window_len", type = int, default = SEQUENCE_LEN,
+                help = "Window length in decimated samples.")
+    ap.add_argument("-s", "--step_size", type = int, default = STEP_SIZE,
+                help = "Window stride in decimated samples.")
+    ap.add_argument("-o", "--output_dir", type = str, default = "lags",
+                help = "Directory for the .npy files.")
+    args = vars(ap.parse_args())
+
+    data, split_point = load_seizure(args['dataset_id'])
+    max_lag = int(round(args['max_lag_ms'] / 1000.0 * FS_DECIMATED))
+    os.makedirs(args['output_dir'], exist_ok = True)
+    output_prefix = os.path.join(args['output_dir'], args['dataset_id'])
+
+    start = time.perf_counter()
+    num_windows = write_lag_tensor(output_prefix, np.asarray(data)[split_point :],
+                                   args['start_ictal'], max_lag,
+                                   args['window_len'], args['step_size'])
+    elapsed = time.perf_counter() - start
+    print("Wrote %d windows x %d electrodes (max lag %d samples) to %s-*.npy in %.2fs" %
+          (num_windows, data.shape[1], max_lag, output_prefix, elapsed))
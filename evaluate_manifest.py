@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 28 10:20:14 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Evaluates many (seizure, model) pairs in one command and writes a single
+# metrics table.
+#
+# The manifest is a csv file with a header row and the columns:
+#   dataset_id, model_name[, start_interictal, start_ictal]
+# Start times left out or blank default to seizure_data.SEIZURES. Datasets
+# and labels must be laid out as described in create_predictions.py.
+#
+# Rows are grouped by seizure and the seizures are shared between --workers
+# processes. A worker loads each model once and keeps it for every seizure it
+# evaluates, and preprocessed seizures are cached in --cache_dir so later
+# runs skip filtering and decimation.
+#
+# Sample execution:
+# python evaluate_manifest.py -f manifest.csv -j 2 -o metrics.csv
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from seizure_data import SEIZURES, CACHE_DIR, get_paths, load_seizure_cached
+from seizure_data import create_merge_targets
+from batch_inference import load_predictor, iter_merge_windows
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+NUM_WORKERS = 2
+METRIC_COLUMNS = ['dataset_id', 'model_name', 'windows', 'seizing_windows',
+                  'accuracy', 'precision', 'recall', 'f1',
+                  'tp', 'fp', 'tn', 'fn', 'seconds']
+
+
+# ------------------
+# MANIFEST
+# ------------------
+def read_manifest(path):
+    """
+    Returns the manifest rows with start times filled in.
+    """
+    manifest = pd.read_csv(path, skipinitialspace = True)
+    for column, index in (('start_interictal', 0), ('start_ictal', 2)):
+        defaults = manifest['dataset_id'].map(
+            lambda dataset_id: SEIZURES.get(dataset_id, (None,) * 4)[index])
+        if column in manifest:
+            manifest[column] = manifest[column].fillna(defaults)
+        else:
+            manifest[column] = defaults
+        if manifest[column].isnull().any():
+            missing = manifest.loc[manifest[column].isnull(), 'dataset_id']
+            raise ValueError("No " + column + " for " + ", ".join(missing))
+        manifest[column] = manifest[column].astype(np.int64)
+    return manifest
+
+def group_seizures(manifest):
+    """
+    Returns one job per seizure: (dataset_id, start_interictal, start_ictal,
+    (manifest row, model name) pairs).
+    """
+    jobs = []
+    keys = ['dataset_id', 'start_interictal', 'start_ictal']
+    manifest = manifest.reset_index(drop = True)
+    for (dataset_id, start_interictal, start_ictal), rows in manifest.groupby(keys, sort = False):
+        jobs.append((dataset_id, int(start_interictal), int(start_ictal),
+                     list(zip(rows.index, rows['model_name']))))
+    return jobs
+
+
+# ------------------
+# METRICS
+# ------------------
+def binary_metrics(targets, preds):
+    """
+    Returns accuracy, macro-averaged precision, recall and f1 as in
+    create_predictions.py, and the confusion counts. As in sklearn, the
+    averages are over the classes present in targets or preds.
+    """
+    tp = int(np.count_nonzero((targets == 1) & (preds == 1)))
+    fp = int(np.count_nonzero((targets == 0) & (preds == 1)))
+    tn = int(np.count_nonzero((targets == 0) & (preds == 0)))
+    fn = int(np.count_nonzero((targets == 1) & (preds == 0)))
+
+    def ratio(numerator, denominator):
+        return numerator / float(denominator) if denominator else 0.0
+
+    def mean(scores):
+        return float(np.mean(scores)) if scores else 0.0
+
+    # per-class scores for the seizing and non-seizing class, then averaged
+    present = [tp + fp + fn > 0, tn + fp + fn > 0]
+    precision = [ratio(tp, tp + fp), ratio(tn, tn + fn)]
+    recall = [ratio(tp, tp + fn), ratio(tn, tn + fp)]
+    f1 = [ratio(2 * p * r, p + r) for p, r in zip(precision, recall)]
+    precision, recall, f1 = ([score for score, used in zip(scores, present) if used]
+                             for scores in (precision, recall, f1))
+    return {'accuracy': ratio(tp + tn, len(targets)),
+            'precision': mean(precision), 'recall': mean(recall),
+            'f1': mean(f1), 'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn}
+
+
+# ------------------
+# EVALUATION
+# ------------------
+def evaluate_seizure(job, cache_dir = CACHE_DIR):
+    """
+    Returns one metrics row per model for a seizure, with its manifest row
+    index. Runs in a worker process, where load_predictor keeps models loaded
+    between seizures.
+    """
+    dataset_id, start_interictal, start_ictal, models = job
+    data, split_point = load_seizure_cached(dataset_id, cache_dir)
+    path_labels = get_paths(dataset_id)[2]
+    rows = []
+    targets = {}
+    for manifest_row, model_name in models:
+        start = time.perf_counter()
+        predictor = load_predictor("models/" + model_name + ".pkl")
+        sequence_len = predictor.input_shape[0]
+        if sequence_len not in targets:
+            targets[sequence_len] = create_merge_targets(data, split_point, path_labels,
+                                                         start_interictal, start_ictal,
+                                                         sequence_len, STEP_SIZE)
+        chunks = iter_merge_windows(data, split_point, sequence_len, STEP_SIZE)
+        probs = np.concatenate(list(predictor.predict_stream(chunks))).ravel()
+        row = binary_metrics(targets[sequence_len], (probs > 0.5).astype(np.int64))
+        row.update({'manifest_row': manifest_row,
+                    'dataset_id': dataset_id, 'model_name': model_name,
+                    'windows': len(probs),
+                    'seizing_windows': int(np.sum(targets[sequence_len])),
+                    'seconds': time.perf_counter() - start})
+        rows.append(row)
+    return rows
+
+def _evaluate_seizure(args):
+    return evaluate_seizure(*args)
+
+def evaluate_manifest(manifest, workers = NUM_WORKERS, cache_dir = CACHE_DIR):
+    """
+    Returns a DataFrame with the METRIC_COLUMNS of every manifest row.
+    """
+    jobs = group_seizures(manifest)
+    rows = []
+    if workers <= 1:
+        for job in jobs:
+            rows += evaluate_seizure(job, cache_dir)
+    else:
+        # spawn, so workers do not inherit a TensorFlow runtime
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes = min(workers, len(jobs))) as pool:
+            for seizure_rows in pool.imap_unordered(_evaluate_seizure,
+                                                    [(job, cache_dir) for job in jobs]):
+                rows += seizure_rows
+                print("Evaluated " + seizure_rows[0]['dataset_id'])
+    table = pd.DataFrame(rows, columns = ['manifest_row'] + METRIC_COLUMNS)
+    table = table.sort_values('manifest_row').drop(columns = 'manifest_row')
+    return table.reset_index(drop = True)
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--manifest", type = str, required = True,
+                help = "Manifest csv file of seizures and models.")
+    ap.add_argument("-j", "--workers", type = int, default = NUM_WORKERS,
+                help = "Number of worker processes.")
+    ap.add_argument("-c", "--cache_dir", type = str, default = CACHE_DIR,
+                help = "Directory for preprocessed seizures.")
+    ap.add_argument("-o", "--output", type = str, default = "metrics.csv",
+                help = "Consolidated metrics table.")
+    args = vars(ap.parse_args())
+
+    start = time.perf_counter()
+    manifest = read_manifest(args['manifest'])
+    table = evaluate_manifest(manifest, args['workers'], args['cache_dir'])
+    table.to_csv(args['output'], index = False)
+    print(table.to_string(index = False, float_format = lambda value: "%.4f" % value))
+    print("Evaluated %d rows in %.1fs, written to %s" %
+          (len(table), time.perf_counter() - start, args['output']))
@@ -24,6 +24,7 @@ from ieeg.auth import Session
 from ieeg.dataset import Annotation
 from ieeg.ieeg_api import IeegServiceError
 from ieeg.annotation_processing import SlidingWindowAnnotator
+from ieeg.local_provenance import SqliteProvConnection
 
 
 def negative_mean_annotator(window, annotation_layer):
@@ -79,6 +80,8 @@ def main():
     parser.add_argument('--mprov_user', help='MProv username')
     parser.add_argument('--mprov_password',
                         help='MProv password (will be prompted if missing)')
+    parser.add_argument('--prov_db',
+                        help='SQLite file to write provenance to instead of an MProv server')
 
     parser.add_argument('dataset_name',
                         help="""A dataset to which you have write access.
@@ -98,6 +101,9 @@ def main():
         MProvConnection.graph_name = dataset_name
         mprov_connection = MProvConnection(
             args.mprov_user, mprov_password, mprov_url)
+    elif args.prov_db:
+        MProvConnection.graph_name = dataset_name
+        mprov_connection = SqliteProvConnection(args.prov_db)
     with Session(args.user, args.password) as session:
         tool_name = parser.prog
         dataset = open_or_create_dataset(session, dataset_name, tool_name)
@@ -120,7 +126,7 @@ def main():
                       dataset.name,
                       start_time_usec,
                       slide_usec))
-        if mprov_connection:
+        if args.mprov_user:
             print("Provenance graph '{}' will be viewable at {}/viz/.".format(
                 mprov_connection.get_graph(),
                 mprov_connection.configuration.host))
@@ -136,6 +142,8 @@ def main():
             print("Wrote provenance of annotations to graph '{}'.".format(
                 mprov_connection.get_graph()))
         session.close_dataset(dataset)
+    if args.prov_db and mprov_connection:
+        mprov_connection.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 27 11:05:48 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Writes predicted seizure intervals back to an iEEG.org dataset as
+# annotations, one per electrode interval rather than one per window.
+#
+# Intervals come from runs saved in a prediction store (see
+# prediction_store.py), where contiguous windows above --threshold are
+# merged per electrode, or from the detections.csv of scan_recording.py.
+# Each model gets its own layer, <layer_prefix>-<model_name>.
+#
+# Annotations are uploaded through Dataset.add_annotations in batches of at
+# most --max_batch_annotations annotations and --max_batch_kb of request
+# body, never mixing layers. --concurrency batches are in flight at once.
+# add_annotations is not idempotent, so a batch is only retried, --retries
+# times with exponential backoff, when its connection could not be
+# established; any other failure may have reached the server and is reported
+# instead of risking duplicate annotations.
+#
+# Sample execution:
+# python export_annotations.py -u <username> -w <password> -d HUP172_phaseII -r predictions -i hup172 -m eeg-model-cnn-wavenet eeg-model-lstm
+# python export_annotations.py -u <username> -w <password> -d HUP172_phaseII -f scans/hup172/detections.csv -m eeg-model-cnn-wavenet --dry_run
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import json
+import time
+import argparse
+import collections
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from ieeg.auth import Session
+from ieeg.dataset import Annotation
+from requests.exceptions import ConnectTimeout, ConnectionError as RequestsConnectionError
+from urllib3.exceptions import NewConnectionError
+
+from prediction_store import PredictionStore, detect_intervals, model_sequence_len
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+ANNOTATOR = 'measuring-seizure-spread'
+ANNOTATION_TYPE = 'Seizure'
+LAYER_PREFIX = 'predicted-seizures'
+THRESHOLD = 0.5
+MERGE_GAP_WINDOWS = 4
+MAX_BATCH_ANNOTATIONS = 500
+MAX_BATCH_KB = 512
+CONCURRENCY = 4
+RETRIES = 3
+BACKOFF_SECONDS = 1.0
+
+
+# ------------------
+# INTERVALS
+# ------------------
+def store_intervals(store, model_name, seizure, threshold = THRESHOLD,
+                    gap = MERGE_GAP_WINDOWS):
+    """
+    Returns the merged per-electrode intervals of one prediction store run,
+    in the format of prediction_store.detect_intervals. Like the store's own
+    intervals, they are split where the run's window times jump, such as
+    between its interictal and ictal segments.
+    """
+    electrodes, times, probs = store.load(model_name, seizure)
+    sequence_len = model_sequence_len("models/" + model_name + ".pkl")
+    return detect_intervals(probs, times, electrodes, sequence_len, threshold, gap)
+
+def create_annotations(dataset, intervals, layer, annotator = ANNOTATOR,
+                       annotation_type = ANNOTATION_TYPE):
+    """
+    Returns one Annotation per row of intervals, on the row's electrode.
+    """
+    annotations = []
+    for electrode, start, end, max_prob in zip(intervals['electrode'], intervals['start'],
+                                               intervals['end'], intervals['max_prob']):
+        description = "max probability %.2f" % max_prob
+        annotations.append(Annotation(dataset, annotator, annotation_type, description,
+                                      layer, int(start), int(end),
+                                      annotated_labels = str(electrode)))
+    return annotations
+
+
+# ------------------
+# BATCHES
+# ------------------
+def annotation_bytes(annotation):
+    """
+    Returns the size of annotation in the JSON body built by
+    IeegApi.add_annotations, counting its channels once each.
+    """
+    revids = [detail.portal_id for detail in annotation.annotated]
+    body = {'timeseriesRevIds': {'timeseriesRevId': revids},
+            'annotator': annotation.annotator,
+            'type': annotation.type,
+            'description': annotation.description,
+            'layer': annotation.layer,
+            'startTimeUutc': annotation.start_time_offset_usec,
+            'endTimeUutc': annotation.end_time_offset_usec}
+    channels = [{'revId': detail.portal_id, 'label': detail.channel_label}
+                for detail in annotation.annotated]
+    return len(json.dumps(body)) + len(json.dumps(channels))
+
+def create_batches(annotations, max_count = MAX_BATCH_ANNOTATIONS,
+                   max_bytes = MAX_BATCH_KB * 1024):
+    """
+    Returns annotations grouped per layer and split into batches within
+    max_count annotations and roughly max_bytes of request body.
+    """
+    layers = collections.OrderedDict()
+    for annotation in annotations:
+        layers.setdefault(annotation.layer, []).append(annotation)
+    batches = []
+    for layer_annotations in layers.values():
+        batch = []
+        size = 0
+        for annotation in layer_annotations:
+            annotation_size = annotation_bytes(annotation)
+            if batch and (len(batch) >= max_count or size + annotation_size > max_bytes):
+                batches.append(batch)
+                batch = []
+                size = 0
+            batch.append(annotation)
+            size += annotation_size
+        if batch:
+            batches.append(batch)
+    return batches
+
+
+# ------------------
+# UPLOAD
+# ------------------
+def is_retryable(error):
+    """
+    Returns whether the request failed before a connection was established,
+    so the server can not have received it.
+    """
+    if isinstance(error, ConnectTimeout):
+        return True
+    if isinstance(error, RequestsConnectionError) and error.args:
+        # requests wraps urllib3's MaxRetryError, whose reason is the cause
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+def upload_batch(dataset, batch, retries = RETRIES, backoff = BACKOFF_SECONDS):
+    """
+    Uploads one batch, retrying failures to connect. Returns the number of
+    retries used.
+    """
+    for attempt in range(retries + 1):
+        try:
+            dataset.add_annotations(batch)
+            return attempt
+        except Exception as error:
+            if attempt == retries or not is_retryable(error):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def upload_annotations(dataset, annotations, max_count = MAX_BATCH_ANNOTATIONS,
+                       max_bytes = MAX_BATCH_KB * 1024, concurrency = CONCURRENCY,
+                       retries = RETRIES, backoff = BACKOFF_SECONDS):
+    """
+    Uploads annotations in bounded batches with at most concurrency requests
+    in flight. Returns upload statistics, including the batches that still
+    failed after retrying.
+    """
+    batches = create_batches(annotations, max_count, max_bytes)
+    stats = {'annotations': len(annotations), 'batches': len(batches),
+             'retries': 0, 'failed_batches': []}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        futures = [pool.submit(upload_batch, dataset, batch, retries, backoff)
+                   for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                stats['retries'] += future.result()
+            except Exception as error:
+                stats['failed_batches'].append((batch, error))
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-u", "--username", type = str, required = True,
+                help = "iEEG.org username.")
+    ap.add_argument("-w", "--password", type = str, required = True,
+                help = "iEEG.org password.")
+    ap.add_argument("-d", "--dataset_name", type = str, required = True,
+                help = "iEEG.org dataset to annotate.")
+    ap.add_argument("-r", "--root", type = str, default = "predictions",
+                help = "Prediction store directory.")
+    ap.add_argument("-i", "--dataset_id", type = str, default = 'hup172',
+                help = "Seizure whose stored predictions are exported.")
+    ap.add_argument("-f", "--detections", type = str, default = None,
+                help = "Export a scan_recording.py detections.csv instead of the store.")
+    ap.add_argument("-m", "--model_names", type = str, nargs = '+',
+                default = ['eeg-model-cnn-wavenet'],
+                help = "Models to export, one layer each.")
+    ap.add_argument("-t", "--threshold", type = float, default = THRESHOLD,
+                help = "Probability above which a window is seizing.")
+    ap.add_argument("-g", "--gap_windows", type = int, default = MERGE_GAP_WINDOWS,
+                help = "Merge runs of seizing windows separated by at most this many windows.")
+    ap.add_argument("-l", "--layer_prefix", type = str, default = LAYER_PREFIX,
+                help = "Layer name prefix.")
+    ap.add_argument("-b", "--max_batch_annotations", type = int, default = MAX_BATCH_ANNOTATIONS,
+                help = "Most annotations per request.")
+    ap.add_argument("-s", "--max_batch_kb", type = int, default = MAX_BATCH_KB,
+                help = "Largest request body in KB.")
+    ap.add_argument("-j", "--concurrency", type = int, default = CONCURRENCY,
+                help = "Requests in flight at once.")
+    ap.add_argument("-n", "--retries", type = int, default = RETRIES,
+                help = "Retries per failed batch.")
+    ap.add_argument("--dry_run", action = "store_true",
+                help = "Build the batches without uploading them.")
+    args = vars(ap.parse_args())
+
+    session = Session(args['username'], args['password'])
+    dataset = session.open_dataset(args['dataset_name'])
+    annotations = []
+    if args['detections'] is not None:
+        intervals = pd.read_csv(args['detections'])
+        annotations += create_annotations(dataset, intervals, args['layer_prefix'] + "-" +
+                                          args['model_names'][0])
+    else:
+        store = PredictionStore(args['root'])
+        for model_name in args['model_names']:
+            intervals = store_intervals(store, model_name, args['dataset_id'],
+                                        args['threshold'], args['gap_windows'])
+            annotations += create_annotations(dataset, intervals,
+                                              args['layer_prefix'] + "-" + model_name)
+
+    if args['dry_run']:
+        batches = create_batches(annotations, args['max_batch_annotations'],
+                                 args['max_batch_kb'] * 1024)
+        print("%d annotations in %d batches (not uploaded)" % (len(annotations), len(batches)))
+    else:
+        stats = upload_annotations(dataset, annotations, args['max_batch_annotations'],
+                                   args['max_batch_kb'] * 1024, args['concurrency'],
+                                   args['retries'])
+        print("Uploaded %d annotations in %d batches in %.1fs (%d retries)" %
+              (stats['annotations'] - sum(len(batch) for batch, _ in stats['failed_batches']),
+               stats['batches'], stats['seconds'], stats['retries']))
+        for batch, error in stats['failed_batches']:
+            print("Failed batch of %d annotations on layer %s: %s" %
+                  (len(batch), batch[0].layer, error))
+    session.close()
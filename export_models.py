@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 11:02:40 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Converts trained models in models/ to TensorFlow Lite with post-training
+# int8 quantization. Calibration and evaluation windows are cut from the
+# preprocessed interictal and ictal data of one dataset, so the datasets and
+# labels must be laid out as described in create_predictions.py.
+# Models whose layers have no int8 kernel (the LSTM, depending on the
+# TensorFlow version) fall back to dynamic range quantization of the weights.
+# Output is stored as: models/<model_name>-int8.tflite
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from keras.models import load_model
+
+from seizure_data import load_seizure, get_paths, create_merge_targets
+from batch_inference import ResidentPredictor, create_windows
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+CALIBRATION_WINDOWS = 500
+EVAL_WINDOWS = 5000
+BENCHMARK_SECONDS = 5.0
+MODEL_NAMES = ['eeg-model-cnn-wavenet', 'eeg-model-cnn', 'eeg-model-lstm']
+
+
+# ------------------
+# WINDOWS
+# ------------------
+def sample_windows(data, split_point, targets, sequence_len, counts, rng):
+    """
+    Returns a (windows, targets) pair per entry of counts, drawn without
+    overlap from one random permutation of all windows, so each sample is
+    spread over every electrode and segment. Each sample is then put in
+    create_merge_dataset order. Later samples are cut short if there are too
+    few windows.
+    """
+    views = []
+    for column in data:
+        channel = np.asarray(data[column], dtype = np.float32)
+        views.append(create_windows(channel[: split_point], sequence_len, STEP_SIZE))
+        views.append(create_windows(channel[split_point :], sequence_len, STEP_SIZE))
+    offsets = np.cumsum([0] + [len(view) for view in views])
+    order = rng.permutation(offsets[-1])
+    samples = []
+    for chosen in np.split(order, np.cumsum(counts)[: -1]):
+        chosen = np.sort(chosen[: counts[len(samples)]])
+        view_index = np.searchsorted(offsets, chosen, side = 'right') - 1
+        windows = np.zeros((len(chosen), sequence_len, 1), dtype = np.float32)
+        for row, (v, i) in enumerate(zip(view_index, chosen)):
+            windows[row] = views[v][i - offsets[v]]
+        samples.append((windows, targets[chosen]))
+    return samples
+
+
+# ------------------
+# CONVERSION
+# ------------------
+def convert_model(path_model, calibration):
+    """
+    Returns (tflite flatbuffer, quantization mode) for the Keras model at
+    path_model, calibrated on the given windows.
+
+    Full int8 is tried first. If the converter rejects it, weights only are
+    quantized, and as a last resort ops with no TFLite kernel (the LSTM's
+    tensor lists) are kept as TensorFlow ops.
+    """
+    def representative_dataset():
+        for window in calibration:
+            yield [window[np.newaxis].astype(np.float32)]
+
+    def int8(converter):
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    def dynamic_range(converter):
+        pass
+
+    def select_tf_ops(converter):
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS,
+                                               tf.lite.OpsSet.SELECT_TF_OPS]
+        converter._experimental_lower_tensor_list_ops = False
+
+    attempts = [('int8', int8),
+                ('dynamic-range', dynamic_range),
+                ('dynamic-range+select-tf-ops', select_tf_ops)]
+    for mode, configure in attempts:
+        converter = tf.compat.v1.lite.TFLiteConverter.from_keras_model_file(path_model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        configure(converter)
+        try:
+            return converter.convert(), mode
+        except Exception as error:
+            print("Conversion to " + mode + " failed: " + str(error).splitlines()[0])
+    raise ValueError("Could not convert " + path_model)
+
+
+class TFLitePredictor:
+    """
+    Batched inference through the TensorFlow Lite interpreter.
+    """
+
+    def __init__(self, model_content, batch_size, num_threads = None):
+        self.interpreter = tf.lite.Interpreter(model_content = model_content,
+                                               num_threads = num_threads or os.cpu_count())
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = batch_size
+        self.resize(batch_size)
+
+    def resize(self, batch_size):
+        shape = [batch_size] + list(self.input['shape'][1:])
+        self.interpreter.resize_tensor_input(self.input['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.current_size = batch_size
+
+    def predict_on_batch(self, batch):
+        if len(batch) != self.current_size:
+            self.resize(len(batch))
+        scale, zero_point = self.input['quantization']
+        if self.input['dtype'] != np.float32:
+            batch = np.round(batch / scale + zero_point)
+        self.interpreter.set_tensor(self.input['index'],
+                                    batch.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        preds = self.interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if self.output['dtype'] != np.float32:
+            preds = (preds.astype(np.float32) - zero_point) * scale
+        return preds
+
+    def predict(self, windows):
+        preds = [np.zeros((0,) + tuple(self.output['shape'][1:]), dtype = np.float32)]
+        for start in range(0, len(windows), self.batch_size):
+            preds.append(self.predict_on_batch(windows[start : start + self.batch_size]))
+        return np.concatenate(preds)
+
+
+# ------------------
+# EVALUATION
+# ------------------
+def accuracy_report(keras_probs, tflite_probs, targets):
+    keras_preds = (keras_probs.ravel() > 0.5).astype(np.int64)
+    tflite_preds = (tflite_probs.ravel() > 0.5).astype(np.int64)
+    diff = np.abs(keras_probs.ravel() - tflite_probs.ravel())
+    return {
+        'keras_accuracy': np.mean(keras_preds == targets),
+        'tflite_accuracy': np.mean(tflite_preds == targets),
+        'agreement': np.mean(keras_preds == tflite_preds),
+        'mean_abs_prob_diff': np.mean(diff),
+        'max_abs_prob_diff': np.max(diff)
+    }
+
+def throughput(predict_on_batch, windows, batch_size, seconds = BENCHMARK_SECONDS):
+    """
+    Returns windows per second for repeated calls on one batch.
+    """
+    batch = np.ascontiguousarray(windows[: batch_size], dtype = np.float32)
+    predict_on_batch(batch)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        predict_on_batch(batch)
+        count += len(batch)
+    return count / (time.perf_counter() - start)
+
+def export_model(model_name, data, split_point, path_labels, start_interictal,
+                 start_ictal, calibration_count, eval_count, output_dir, rng):
+    path_model = "models/" + model_name + ".pkl"
+    keras_predictor = ResidentPredictor(load_model(path_model))
+    sequence_len = keras_predictor.input_shape[0]
+
+    targets = create_merge_targets(data, split_point, path_labels,
+                                   start_interictal, start_ictal,
+                                   sequence_len, STEP_SIZE)
+    (calibration, _), (evaluation, eval_targets) = sample_windows(
+        data, split_point, targets, sequence_len, [calibration_count, eval_count], rng)
+
+    print("Converting " + model_name + " with " + str(len(calibration)) +
+          " calibration windows")
+    content, mode = convert_model(path_model, calibration)
+    path_tflite = os.path.join(output_dir, model_name + "-int8.tflite")
+    with open(path_tflite, 'wb') as f: f.write(content)
+
+    tflite_predictor = TFLitePredictor(content, keras_predictor.batch_size)
+    report = accuracy_report(keras_predictor.predict(evaluation),
+                             tflite_predictor.predict(evaluation),
+                             eval_targets)
+    report['model'] = model_name
+    report['quantization'] = mode
+    report['keras_size_kb'] = os.path.getsize(path_model) / 1024
+    report['tflite_size_kb'] = len(content) / 1024
+    report['batch_size'] = keras_predictor.batch_size
+    report['keras_windows_per_sec'] = throughput(keras_predictor.model.predict_on_batch,
+                                                 evaluation, keras_predictor.batch_size)
+    report['tflite_windows_per_sec'] = throughput(tflite_predictor.predict_on_batch,
+                                                  evaluation, keras_predictor.batch_size)
+    return report
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-a", "--start_interictal", type = int, default = 356850680000,
+                help = "Start time for interictal data.")
+    ap.add_argument("-c", "--start_ictal", type = int, default = 402704260829,
+                help = "Start time for ictal data.")
+    ap.add_argument("-i", "--dataset_id", type = str, default = 'hup172',
+                help = "Dataset used for calibration and evaluation.")
+    ap.add_argument("-m", "--model_names", type = str, nargs = '+', default = MODEL_NAMES,
+                help = "Models to export.")
+    ap.add_argument("-n", "--calibration_windows", type = int, default = CALIBRATION_WINDOWS,
+                help = "Number of windows used to calibrate quantization.")
+    ap.add_argument("-e", "--eval_windows", type = int, default = EVAL_WINDOWS,
+                help = "Number of held-out windows used for the accuracy report.")
+    ap.add_argument("-o", "--output_dir", type = str, default = "models",
+                help = "Directory for the .tflite files.")
+    args = vars(ap.parse_args())
+
+    rng = np.random.RandomState(0)
+    data, split_point = load_seizure(args['dataset_id'])
+    path_labels = get_paths(args['dataset_id'])[2]
+
+    for model_name in args['model_names']:
+        report = export_model(model_name, data, split_point, path_labels,
+                              args['start_interictal'], args['start_ictal'],
+                              args['calibration_windows'], args['eval_windows'],
+                              args['output_dir'], rng)
+        print("Model: " + report['model'] + " (" + report['quantization'] + ")")
+        print("Size: %.1f KB -> %.1f KB" % (report['keras_size_kb'],
+                                            report['tflite_size_kb']))
+        print("Accuracy: %.4f (Keras) vs %.4f (TFLite), agreement %.4f" %
+              (report['keras_accuracy'], report['tflite_accuracy'],
+               report['agreement']))
+        print("Probability difference: mean %.4f, max %.4f" %
+              (report['mean_abs_prob_diff'], report['max_abs_prob_diff']))
+        print("Throughput at batch size %d: %.0f (Keras) vs %.0f (TFLite) windows/sec" %
+              (report['batch_size'], report['keras_windows_per_sec'],
+               report['tflite_windows_per_sec']))
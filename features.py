@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 10:05:31 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Classical per-window iEEG features computed as array operations over many
+# windows at once. Windows are passed as a windows x samples array, usually
+# a strided view from batch_inference.create_windows, and are processed in
+# chunks so temporaries stay small.
+#
+# sliding_window_features computes line length, mean absolute amplitude,
+# variance and zero crossings for every window of whole signals from prefix
+# sums, so the cost is linear in signal length whatever the window overlap.
+#
+# band_powers computes iEEG band powers for every window with one batched
+# real FFT per chunk of windows, and window_features uses the same code for
+# its gating band power. The taper and the bins-to-bands matrix are
+# built once per window length and rate by SpectralPlan. High gamma lies
+# above the Nyquist rate of the decimated data, so merge_band_powers works on
+# the filtered 1024 Hz data by default.
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import numpy as np
+from scipy import fft, signal
+
+from seizure_data import FS, SEQUENCE_LEN, STEP_SIZE, DOWN_SAMPLE_FACTOR
+from seizure_data import window_end_times
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+FS_DECIMATED = 102.4
+GATE_BANDS = ['beta', 'low_gamma']
+CHUNK_WINDOWS = 4096
+WINDOW_FEATURES = ['line_length', 'energy', 'band_power']
+SLIDING_FEATURES = ['line_length', 'mean_abs', 'variance', 'zero_crossings']
+CHUNK_ELECTRODES = 16
+SPECTRAL_CHUNK_SAMPLES = 2 ** 22
+BANDS = [('delta', 1, 4), ('theta', 4, 8), ('alpha', 8, 13), ('beta', 13, 30),
+         ('low_gamma', 30, 70), ('high_gamma', 70, 150)]
+
+
+# ------------------
+# WINDOW FEATURES
+# ------------------
+def line_length(windows):
+    return np.abs(np.diff(windows, axis = -1)).sum(axis = -1)
+
+def energy(windows):
+    # variance rather than mean square, so the DC offset left by
+    # iEEG_data_filter does not count as energy
+    return windows.var(axis = -1)
+
+def window_features(windows, fs = FS_DECIMATED, bands = GATE_BANDS,
+                    chunk_windows = CHUNK_WINDOWS):
+    """
+    Returns a windows x 3 float32 array of line length, energy and band
+    power, in the order of WINDOW_FEATURES. Band power is the total power in
+    the named BANDS, up to the Nyquist rate (beta and low gamma: 13 to
+    51.2 Hz for the decimated data), from a SpectralPlan.
+    """
+    windows = np.asarray(windows)
+    if windows.ndim == 3:
+        windows = windows[..., 0]
+    plan = SpectralPlan(windows.shape[-1], fs, [band for band in BANDS if band[0] in bands])
+    features = np.zeros((len(windows), len(WINDOW_FEATURES)), dtype = np.float32)
+    for start in range(0, len(windows), chunk_windows):
+        chunk = np.asarray(windows[start : start + chunk_windows], dtype = np.float64)
+        features[start : start + len(chunk), 0] = line_length(chunk)
+        features[start : start + len(chunk), 1] = energy(chunk)
+        features[start : start + len(chunk), 2] = plan.band_powers(chunk).sum(axis = -1)
+    return features
+
+
+# ------------------
+# GATING
+# ------------------
+def gate_windows(features, threshold, baseline = None):
+    """
+    Returns a boolean mask of windows worth sending to the deep model.
+
+    A window passes if any feature is more than threshold times the
+    electrode's baseline for that feature. The baseline defaults to the
+    median over the given windows, which is robust to the minority of
+    seizing windows.
+    """
+    if baseline is None:
+        baseline = np.median(features, axis = 0)
+    ratio = features / np.maximum(baseline, np.finfo(np.float32).tiny)
+    return np.any(ratio > threshold, axis = -1)
+
+
+# ------------------
+# SLIDING WINDOW FEATURES
+# ------------------
+def prefix_sums(signals):
+    """
+    Returns cumulative sums, with a leading row of zeros, of the per-sample
+    terms of SLIDING_FEATURES.
+
+    :param signals: 2D array, rows = samples, columns = electrodes.
+    :return: 3D float64 array, 5 x (samples + 1) x electrodes, holding sums
+             of |diff|, |x|, x, x^2 and sign changes. Terms for differences
+             are stored at the index of their later sample.
+    """
+    signals = np.asarray(signals, dtype = np.float64)
+    num_samples, num_electrodes = signals.shape
+    # centre each electrode so the sums of x and x^2 do not cancel badly
+    # and zero crossings are counted about the electrode's mean
+    centred = signals - signals.mean(axis = 0)
+    terms = np.zeros((5, num_samples + 1, num_electrodes))
+    terms[0, 2 :] = np.abs(np.diff(centred, axis = 0))
+    terms[1, 1 :] = np.abs(centred)
+    terms[2, 1 :] = centred
+    terms[3, 1 :] = centred ** 2
+    terms[4, 2 :] = np.signbit(centred[1 :]) != np.signbit(centred[: -1])
+    return np.cumsum(terms, axis = 1, out = terms)
+
+def sliding_window_features(signals, window_len, ends,
+                            chunk_electrodes = CHUNK_ELECTRODES):
+    """
+    Returns SLIDING_FEATURES for the windows [end - window_len, end) of every
+    electrode.
+
+    :param signals: 2D array, rows = samples, columns = electrodes.
+    :param window_len: window length in samples.
+    :param ends: 1D array of exclusive window end indices.
+    :param chunk_electrodes: electrodes whose prefix sums are held at once.
+    :return: 3D float32 array, electrodes x windows x features.
+    """
+    signals = np.asarray(signals)
+    ends = np.asarray(ends, dtype = np.int64)
+    starts = ends - window_len
+    features = np.empty((signals.shape[1], len(ends), len(SLIDING_FEATURES)),
+                        dtype = np.float32)
+    for first in range(0, signals.shape[1], chunk_electrodes):
+        sums = prefix_sums(signals[:, first : first + chunk_electrodes])
+        # differences only count when both samples are inside the window
+        pair_sums = sums[[0, 4]][:, ends] - sums[[0, 4]][:, starts + 1]
+        point_sums = sums[1 : 4][:, ends] - sums[1 : 4][:, starts]
+        mean = point_sums[1] / window_len
+        chunk = np.stack((pair_sums[0],
+                          point_sums[0] / window_len,
+                          point_sums[2] / window_len - mean ** 2,
+                          pair_sums[1]), axis = -1)
+        features[first : first + chunk.shape[1]] = np.transpose(chunk, (1, 0, 2))
+    return features
+
+def merge_window_features(interictal, ictal, start_time_interictal, start_time_ictal,
+                          factor = 1):
+    """
+    Returns (features, end_times) for the windows of create_merge_dataset.
+
+    With factor 1 the signals are the decimated data; with factor
+    DOWN_SAMPLE_FACTOR they are the filtered data at the native 1024 Hz and
+    windows cover the same stretch of signal at the higher rate.
+
+    :param interictal: 2D array, rows = samples, columns = electrodes.
+    :param ictal: 2D array, rows = samples, columns = electrodes.
+    :return: features, electrodes x windows x features, with interictal
+             windows followed by ictal windows, and the matching window end
+             times in usec as computed by create_merge_dataset.
+    """
+    features = []
+    end_times = []
+    for signals, start_time in ((interictal, start_time_interictal),
+                                (ictal, start_time_ictal)):
+        signals = np.asarray(signals)
+        num_decimated = -(-len(signals) // factor)
+        ends = np.arange(SEQUENCE_LEN, num_decimated, STEP_SIZE, dtype = np.int64)
+        features.append(sliding_window_features(signals, SEQUENCE_LEN * factor,
+                                                ends * factor))
+        end_times.append(window_end_times(start_time, num_decimated))
+    return np.concatenate(features, axis = 1), np.concatenate(end_times)
+
+
+# ------------------
+# SPECTRAL FEATURES
+# ------------------
+class SpectralPlan:
+    """
+    Taper and band weights shared by every window of one length and rate.
+
+    Band power is the sum of the Hann-tapered periodogram density over the
+    band's bins times the bin width, matching scipy.signal.periodogram with
+    detrend = 'constant'. The density scaling is folded into band_matrix, so
+    band powers are one matrix product of the squared FFT magnitudes.
+
+    Attributes:
+        window_len: samples per window.
+        fs: sampling rate in Hz.
+        bands: list of (name, low Hz, high Hz).
+        taper: float32 window function.
+        band_matrix: float32 array, frequency bins x bands.
+    """
+
+    def __init__(self, window_len, fs, bands = BANDS):
+        self.window_len = window_len
+        self.fs = fs
+        self.bands = bands
+        self.taper = signal.get_window('hann', window_len).astype(np.float32)
+        freqs = fft.rfftfreq(window_len, 1.0 / fs)
+        # one-sided density, doubled except at DC and Nyquist
+        weights = np.full(len(freqs), 2.0 / (fs * np.sum(self.taper.astype(np.float64) ** 2)))
+        weights[0] /= 2
+        if window_len % 2 == 0:
+            weights[-1] /= 2
+        weights *= fs / float(window_len)
+        self.band_matrix = np.zeros((len(freqs), len(bands)), dtype = np.float32)
+        for i, (name, low, high) in enumerate(bands):
+            in_band = (freqs >= low) & (freqs < high)
+            if not np.any(in_band):
+                raise ValueError("Band " + name + " has no frequency bins at " +
+                                 str(fs) + " Hz")
+            self.band_matrix[in_band, i] = weights[in_band]
+
+    def band_powers(self, windows):
+        """
+        Returns a windows x bands float32 array for a windows x samples array.
+        """
+        windows = np.asarray(windows, dtype = np.float32)
+        windows = windows - windows.mean(axis = -1, keepdims = True)
+        spectrum = fft.rfft(windows * self.taper, axis = -1, workers = -1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        return power @ self.band_matrix
+
+def band_powers(signals, window_len, ends, fs, bands = BANDS,
+                chunk_samples = SPECTRAL_CHUNK_SAMPLES):
+    """
+    Returns the band powers of the windows [end - window_len, end) of every
+    electrode.
+
+    :param signals: 2D array, rows = samples, columns = electrodes.
+    :param window_len: window length in samples.
+    :param ends: 1D array of exclusive window end indices.
+    :param fs: sampling rate of signals in Hz.
+    :param chunk_samples: window samples transformed per FFT call.
+    :return: 3D float32 array, electrodes x windows x bands.
+    """
+    signals = np.asarray(signals, dtype = np.float32)
+    starts = np.asarray(ends, dtype = np.int64) - window_len
+    plan = SpectralPlan(window_len, fs, bands)
+    chunk_windows = max(1, chunk_samples // window_len)
+    powers = np.empty((signals.shape[1], len(starts), len(bands)), dtype = np.float32)
+    for electrode in range(signals.shape[1]):
+        view = np.lib.stride_tricks.sliding_window_view(signals[:, electrode], window_len)
+        for first in range(0, len(starts), chunk_windows):
+            chunk = starts[first : first + chunk_windows]
+            powers[electrode, first : first + len(chunk)] = plan.band_powers(view[chunk])
+    return powers
+
+def merge_band_powers(interictal, ictal, start_time_interictal, start_time_ictal,
+                      factor = DOWN_SAMPLE_FACTOR, bands = BANDS):
+    """
+    Returns (powers, end_times) for the windows of create_merge_dataset,
+    laid out as in merge_window_features.
+
+    The default factor expects the filtered data at the native 1024 Hz; pass
+    factor 1 and bands below 51.2 Hz to use the decimated data.
+    """
+    powers = []
+    end_times = []
+    for signals, start_time in ((interictal, start_time_interictal),
+                                (ictal, start_time_ictal)):
+        signals = np.asarray(signals)
+        num_decimated = -(-len(signals) // factor)
+        ends = np.arange(SEQUENCE_LEN, num_decimated, STEP_SIZE, dtype = np.int64)
+        powers.append(band_powers(signals, SEQUENCE_LEN * factor, ends * factor,
+                                  FS * factor / float(DOWN_SAMPLE_FACTOR), bands))
+        end_times.append(window_end_times(start_time, num_decimated))
+    return np.concatenate(powers, axis = 1), np.concatenate(end_times)
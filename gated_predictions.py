@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 11:40:12 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Two-stage detection. Line length, energy and band power are computed for
+# every window; windows where none of them rises above --threshold times the
+# electrode's median are treated as non-seizing without running the model.
+# The remaining windows are scored by the Keras model.
+#
+# The report times the model on all windows, then the cascade (features plus
+# the model on surviving windows) at each threshold, and compares their
+# recall against the labels. Datasets and labels must be laid out as
+# described in create_predictions.py.
+#
+# Sample execution:
+# python gated_predictions.py -i hup138 hup172 -t 1.0 1.5 2.0 3.0
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import time
+import argparse
+import numpy as np
+
+from seizure_data import SEIZURES, load_seizure, get_paths, create_merge_targets
+from batch_inference import load_predictor, create_windows
+from features import window_features, gate_windows
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+THRESHOLDS = [1.0, 1.5, 2.0, 3.0]
+
+
+# ------------------
+# CASCADE
+# ------------------
+def electrode_windows(data, split_point, sequence_len):
+    """
+    Yields (interictal windows, ictal windows) views for each electrode.
+    """
+    for column in data:
+        channel = np.asarray(data[column], dtype = np.float32)
+        yield (create_windows(channel[: split_point], sequence_len, STEP_SIZE),
+               create_windows(channel[split_point :], sequence_len, STEP_SIZE))
+
+def compute_features(data, split_point, sequence_len):
+    """
+    Returns the features of every window in create_merge_dataset order, and
+    a list of the per-electrode slices into them.
+    """
+    features = []
+    slices = []
+    offset = 0
+    for interictal, ictal in electrode_windows(data, split_point, sequence_len):
+        electrode = np.vstack((window_features(interictal), window_features(ictal)))
+        features.append(electrode)
+        slices.append(slice(offset, offset + len(electrode)))
+        offset += len(electrode)
+    return np.vstack(features), slices
+
+def compute_gate(features, slices, threshold):
+    gate = np.zeros(len(features), dtype = bool)
+    for electrode in slices:
+        gate[electrode] = gate_windows(features[electrode], threshold)
+    return gate
+
+def predict_cascade(predictor, data, split_point, gate):
+    """
+    Returns 0/1 predictions for every window, running the model only on
+    windows where gate is set.
+    """
+    sequence_len = predictor.input_shape[0]
+    chunks = []
+    offset = 0
+    for pair in electrode_windows(data, split_point, sequence_len):
+        for windows in pair:
+            mask = gate[offset : offset + len(windows)]
+            chunks.append(windows[mask])
+            offset += len(windows)
+    preds = np.zeros(len(gate), dtype = np.int64)
+    probs = np.concatenate(list(predictor.predict_stream(iter(chunks)))).ravel()
+    preds[gate] = (probs > 0.5).astype(np.int64)
+    return preds
+
+def recall(targets, preds):
+    positives = np.count_nonzero(targets == 1)
+    if positives == 0:
+        return float('nan')
+    return np.count_nonzero((targets == 1) & (preds == 1)) / float(positives)
+
+def evaluate_dataset(dataset_id, model_path, thresholds):
+    start_interictal, _, start_ictal, _ = SEIZURES[dataset_id]
+    data, split_point = load_seizure(dataset_id)
+    predictor = load_predictor(model_path)
+    sequence_len = predictor.input_shape[0]
+    targets = create_merge_targets(data, split_point, get_paths(dataset_id)[2],
+                                   start_interictal, start_ictal,
+                                   sequence_len, STEP_SIZE)
+
+    start = time.perf_counter()
+    features, slices = compute_features(data, split_point, sequence_len)
+    feature_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preds = predict_cascade(predictor, data, split_point,
+                            np.ones(len(features), dtype = bool))
+    model_time = time.perf_counter() - start
+    full_recall = recall(targets, preds)
+
+    rows = []
+    for threshold in thresholds:
+        gate = compute_gate(features, slices, threshold)
+        start = time.perf_counter()
+        cascade_preds = predict_cascade(predictor, data, split_point, gate)
+        cascade_time = feature_time + time.perf_counter() - start
+        cascade_recall = recall(targets, cascade_preds)
+        rows.append({'dataset': dataset_id,
+                     'threshold': threshold,
+                     'windows': len(gate),
+                     'passed_fraction': np.mean(gate),
+                     'compute_saved': 1.0 - cascade_time / model_time,
+                     'gate_recall': recall(targets, gate.astype(np.int64)),
+                     'model_recall': full_recall,
+                     'cascade_recall': cascade_recall,
+                     'recall_lost': full_recall - cascade_recall,
+                     'cascade_accuracy': np.mean(cascade_preds == targets)})
+    return rows, feature_time, model_time
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--dataset_ids", type = str, nargs = '+',
+                default = ['hup138', 'hup172'],
+                help = "Datasets to evaluate.")
+    ap.add_argument("-m", "--model_name", type = str, default = 'eeg-model-cnn-wavenet',
+                help = "Model name.")
+    ap.add_argument("-t", "--thresholds", type = float, nargs = '+', default = THRESHOLDS,
+                help = "Gate thresholds, as multiples of each electrode's median feature.")
+    args = vars(ap.parse_args())
+
+    model_path = "models/" + args['model_name'] + ".pkl"
+    for dataset_id in args['dataset_ids']:
+        rows, feature_time, model_time = evaluate_dataset(dataset_id, model_path,
+                                                          args['thresholds'])
+        print("Dataset: " + dataset_id)
+        print("Feature time: %.2fs, model time on all windows: %.2fs" %
+              (feature_time, model_time))
+        print("threshold  passed  compute_saved  gate_recall  model_recall  cascade_recall  recall_lost")
+        for row in rows:
+            print("%9.2f  %6.3f  %13.3f  %11.3f  %12.3f  %14.3f  %11.3f" %
+                  (row['threshold'], row['passed_fraction'], row['compute_saved'],
+                   row['gate_recall'], row['model_recall'], row['cascade_recall'],
+                   row['recall_lost']))
@@ -15,9 +15,77 @@
 '''
 import math as m
 import datetime
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 
-from ieeg.mprov_listener import MProvWriter, AnnotationActivity
-from ieeg.processing import Window
+from ieeg.mprov_listener import MProvWriter, AnnotationActivity, AnnotationRangeActivity
+from ieeg.processing import Window, BlockReader
+
+
+def stack_windows(windows):
+    """
+    Returns the data blocks of windows, which must all have the same shape, as one
+    windows x samples x channels array. For batch annotator functions.
+    """
+    return np.stack([window.view() for window in windows])
+
+
+class DatasetDetails:
+    """
+    The parts of a Dataset needed to create Annotations, sent to process pool workers in
+    place of the Dataset, which holds a session and would be copied into each worker.
+
+    Attributes:
+        name: The name of the dataset.
+        snap_id: The snapshot id of the dataset.
+        ch_labels: The channel labels of the dataset.
+        ts_details: The dataset's TimeSeriesDetails by channel label.
+        ts_details_by_id: The dataset's TimeSeriesDetails by portal_id.
+        start_time: The dataset's start time in microseconds.
+        end_time: The dataset's end time in microseconds.
+    """
+
+    def __init__(self, dataset):
+        self.name = dataset.name
+        self.snap_id = dataset.snap_id
+        self.ch_labels = dataset.ch_labels
+        self.ts_details = dataset.ts_details
+        self.ts_details_by_id = dataset.ts_details_by_id
+        self.start_time = dataset.start_time
+        self.end_time = dataset.end_time
+
+    def get_channel_labels(self):
+        return self.ch_labels
+
+
+def _detach_windows(windows, dataset_details):
+    """
+    Returns copies of windows that refer to dataset_details instead of their Dataset, so
+    that only their samples and metadata are pickled.
+    """
+    return [Window(dataset_details, window.input_channel_labels, window.view(),
+                   window.window_index, window.window_start_usec, window.window_size_usec)
+            for window in windows]
+
+
+def _timed_annotations(annotator_function, windows, annotation_layer, batched):
+    """
+    Runs annotator_function on a list of windows, as one call if batched and one call
+    per window otherwise, and returns the list of annotations with the activity's start
+    and end times. Module level so that it can run in a process pool.
+    """
+    activity_start_time = datetime.datetime.now(datetime.timezone.utc)
+    if batched:
+        new_annotations = list(annotator_function(windows, annotation_layer))
+        if len(new_annotations) != len(windows):
+            raise ValueError('batch annotator returned {} annotations for {} windows'.format(
+                len(new_annotations), len(windows)))
+    else:
+        new_annotations = [annotator_function(window, annotation_layer) for window in windows]
+    activity_end_time = datetime.datetime.now(datetime.timezone.utc)
+    return new_annotations, activity_start_time, activity_end_time
 
 
 class SlidingWindowAnnotator:
@@ -35,18 +103,115 @@ class SlidingWindowAnnotator:
                             which any created annotation should belong.
         mprov_connection: An optional pennprov.connection.mprov_connection.MProvConnection
                           if provenance tracking is desired.
+        buffered_provenance: If True, window provenance is written in batches from a
+                             background thread, see ieeg.mprov_listener.BufferedProvWriter.
+                             annotate_dataset returns once it has all been written. The
+                             thread runs until close() is called or the annotator, used as
+                             a context manager, exits.
+        prov_token_cache: An optional ieeg.mprov_listener.ProvTokenCache recording the
+                          dataset and channel entities already in the provenance graph.
+        provenance_segment_windows: The number of consecutive windows recorded together in
+                                    provenance. Default is 1, a window, activity and channel
+                                    memberships per window. With more, each segment is
+                                    recorded as one window range and one activity, see
+                                    ieeg.mprov_listener.MProvWriter.write_range_prov.
+        prefetch_windows: The number of upcoming windows fetched in the background while
+                          earlier windows are annotated. Default is 0, fetching each window
+                          when it is needed.
+        annotator_workers: The number of windows annotated in parallel. Default is 1.
+        annotator_pool: 'thread' or 'process', the kind of pool annotator_function runs in
+                        when annotator_workers is more than 1. With 'process',
+                        annotator_function and annotations must be picklable, and the
+                        windows' dataset is a DatasetDetails with no session. Returned
+                        annotations are given the dataset as their parent.
+        batch_size: If set, annotator_function follows the batch protocol: it is passed a
+                    list of up to batch_size consecutive windows and the annotation_layer,
+                    and returns a list with an ieeg.dataset.Annotation or None per window.
+                    stack_windows gives the windows' data as one array. Default is None,
+                    one call per window.
+        block_size_usec: If set, windows are read by an ieeg.processing.BlockReader in blocks
+                         of this length, and the windows of a block share its samples.
+                         prefetch_windows is not used, as the reader fetches the next block
+                         in the background. Default is None, one get_data call per window.
     """
 
     def __init__(self,
                  window_size_usec,
                  slide_usec,
                  annotator_function,
-                 mprov_connection=None):
+                 mprov_connection=None,
+                 buffered_provenance=False,
+                 prov_token_cache=None,
+                 provenance_segment_windows=1,
+                 prefetch_windows=0,
+                 annotator_workers=1,
+                 annotator_pool='thread',
+                 batch_size=None,
+                 block_size_usec=None):
+        if annotator_pool not in ('thread', 'process'):
+            raise ValueError("annotator_pool must be 'thread' or 'process'")
         self.window_size_usec = window_size_usec
         self.slide_usec = slide_usec
         self.annotator_function = annotator_function
         self.mprov_writer = MProvWriter(
-            mprov_connection) if mprov_connection else None
+            mprov_connection, buffered=buffered_provenance,
+            token_cache=prov_token_cache) if mprov_connection else None
+        self.provenance_segment_windows = provenance_segment_windows
+        self.prefetch_windows = prefetch_windows
+        self.annotator_workers = annotator_workers
+        self.annotator_pool = annotator_pool
+        self.batch_size = batch_size
+        self.block_size_usec = block_size_usec
+
+    def _batches(self, dataset, input_channel_labels, input_channel_indices,
+                 start_time_usec, num_windows, fetch_pool):
+        """
+        Yields the lists of Windows to annotate together, in order. With a fetch_pool,
+        up to prefetch_windows windows after the last one yielded are being fetched.
+        """
+        def fetch(window_index):
+            window_start_usec = start_time_usec + window_index * self.slide_usec
+            data_block = dataset.get_data(window_start_usec,
+                                          self.window_size_usec,
+                                          input_channel_indices)
+            return Window(dataset, input_channel_labels, data_block,
+                          window_index, window_start_usec, self.window_size_usec)
+
+        def windows():
+            if self.block_size_usec:
+                reader = BlockReader(dataset, input_channel_indices, start_time_usec,
+                                     self.window_size_usec, self.slide_usec, num_windows,
+                                     self.block_size_usec)
+                yield from reader.iter_windows(input_channel_labels)
+                return
+            if fetch_pool is None:
+                for window_index in range(num_windows):
+                    yield fetch(window_index)
+                return
+            pending = collections.deque()
+            for window_index in range(num_windows):
+                pending.append(fetch_pool.submit(fetch, window_index))
+                if len(pending) > self.prefetch_windows:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+        batch = []
+        for window in windows():
+            batch.append(window)
+            if len(batch) >= (self.batch_size or 1):
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _annotator_pool(self):
+        if self.annotator_workers <= 1:
+            return None
+        if self.annotator_pool == 'process':
+            return ProcessPoolExecutor(max_workers=self.annotator_workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.annotator_workers)
 
     def annotate_dataset(self,
                          dataset,
@@ -58,6 +223,10 @@ class SlidingWindowAnnotator:
         Runs annotator_function over the given dataset a window at a time and returns a list of
         annotations that were written to dataset.
 
+        Windows are fetched ahead and annotated in parallel as set by prefetch_windows,
+        annotator_workers and annotator_pool. Annotations and provenance are always
+        recorded in window order.
+
         Arguments:
             dataset: The ieeg.dataset.Dataset to annotate
             annotation_layer: The annotation layer to write to. A string.
@@ -81,25 +250,90 @@ class SlidingWindowAnnotator:
 
         annotations = []
 
-        for window_index in range(0, int(m.ceil(duration_usec / self.slide_usec))):
-            window_start_usec = start_time_usec + window_index * self.slide_usec
-            data_block = dataset.get_data(window_start_usec,
-                                          self.window_size_usec,
-                                          input_channel_indices)
-            window = Window(dataset, input_channel_labels, data_block,
-                            window_index, window_start_usec, self.window_size_usec)
-            activity_start_time = datetime.datetime.now(datetime.timezone.utc)
-            new_annotation = self.annotator_function(
-                window, annotation_layer)
-            activity_end_time = datetime.datetime.now(datetime.timezone.utc)
-            if new_annotation:
-                annotations.append(new_annotation)
-            if self.mprov_writer:
-                activity = AnnotationActivity(
-                    self.annotator_function.__name__, annotation_layer, window_index,
-                    activity_start_time, activity_end_time)
-                self.mprov_writer.write_widow_prov(
-                    window, activity, new_annotation)
+        segment = []
+
+        def write_segment():
+            windows = [window for window, _, _, _ in segment]
+            activity = AnnotationRangeActivity(
+                self.annotator_function.__name__, annotation_layer, windows[0].window_index,
+                len(windows), segment[0][2], segment[-1][3])
+            self.mprov_writer.write_range_prov(
+                windows, activity, [new_annotation for _, new_annotation, _, _ in segment])
+            segment.clear()
 
+        def record(batch, new_annotations, activity_start_time, activity_end_time):
+            for window, new_annotation in zip(batch, new_annotations):
+                if new_annotation:
+                    annotations.append(new_annotation)
+                if self.mprov_writer and self.provenance_segment_windows > 1:
+                    segment.append((window, new_annotation,
+                                    activity_start_time, activity_end_time))
+                    if len(segment) >= self.provenance_segment_windows:
+                        write_segment()
+                elif self.mprov_writer:
+                    activity = AnnotationActivity(
+                        self.annotator_function.__name__, annotation_layer, window.window_index,
+                        activity_start_time, activity_end_time)
+                    self.mprov_writer.write_widow_prov(
+                        window, activity, new_annotation)
+
+        num_windows = int(m.ceil(duration_usec / self.slide_usec))
+        batched = self.batch_size is not None
+        fetch_pool = (ThreadPoolExecutor(max_workers=1)
+                      if self.prefetch_windows > 0 and not self.block_size_usec else None)
+        annotator_pool = self._annotator_pool()
+        try:
+            batches = self._batches(dataset, input_channel_labels, input_channel_indices,
+                                    start_time_usec, num_windows, fetch_pool)
+            if annotator_pool is None:
+                for batch in batches:
+                    record(batch, *_timed_annotations(
+                        self.annotator_function, batch, annotation_layer, batched))
+            else:
+                # annotations are recorded in window order as the oldest batch finishes
+                dataset_details = (DatasetDetails(dataset)
+                                   if self.annotator_pool == 'process' else None)
+
+                def finish(batch, future):
+                    new_annotations, activity_start_time, activity_end_time = future.result()
+                    if dataset_details:
+                        for new_annotation in new_annotations:
+                            if new_annotation:
+                                new_annotation.parent = dataset
+                    record(batch, new_annotations, activity_start_time, activity_end_time)
+
+                in_flight = collections.deque()
+                for batch in batches:
+                    in_flight.append((batch, annotator_pool.submit(
+                        _timed_annotations, self.annotator_function,
+                        _detach_windows(batch, dataset_details) if dataset_details else batch,
+                        annotation_layer, batched)))
+                    if len(in_flight) >= self.annotator_workers:
+                        finish(*in_flight.popleft())
+                while in_flight:
+                    finish(*in_flight.popleft())
+        finally:
+            if fetch_pool:
+                fetch_pool.shutdown(cancel_futures=True)
+            if annotator_pool:
+                annotator_pool.shutdown(cancel_futures=True)
+
+        if segment:
+            write_segment()
+        if self.mprov_writer:
+            self.mprov_writer.flush()
         dataset.add_annotations(annotations)
         return annotations
+
+    def close(self):
+        """
+        Closes the provenance writer, stopping its background thread if buffered.
+        """
+        if self.mprov_writer:
+            self.mprov_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
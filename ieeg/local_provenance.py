@@ -0,0 +1,176 @@
+'''
+ Copyright 2019 Trustees of the University of Pennsylvania
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+import json
+import sqlite3
+import threading
+import pennprov
+from pennprov.connection.mprov_connection import MProvConnection
+
+
+class SqliteProvStore:
+    """
+    A local stand-in for the pennprov ProvDmApi and ProvenanceApi calls made by
+    ieeg.mprov_listener and ieeg.processing, backed by a SQLite file.
+
+    Nodes and relations are buffered and written with one executemany per table once
+    batch_size rows are pending, and before any read, flush() or close(). Node and
+    relation bodies are kept as the JSON of their to_dict().
+
+    Attributes:
+        path: The SQLite database file, or ':memory:'.
+        batch_size: The most rows buffered before they are written.
+    """
+    batch_size = 1000
+
+    def __init__(self, path, batch_size=None):
+        self.path = path
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._nodes = []
+        self._relations = []
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                graph TEXT, namespace TEXT, local_part TEXT, type TEXT, body TEXT,
+                PRIMARY KEY (graph, namespace, local_part));
+            CREATE TABLE IF NOT EXISTS relations (
+                graph TEXT, label TEXT, type TEXT,
+                subject_namespace TEXT, subject_local_part TEXT,
+                object_namespace TEXT, object_local_part TEXT, body TEXT);
+            CREATE INDEX IF NOT EXISTS relations_subject
+                ON relations (graph, subject_namespace, subject_local_part);
+            CREATE TABLE IF NOT EXISTS subgraph_templates (
+                graph TEXT PRIMARY KEY, body TEXT);
+        ''')
+
+    @staticmethod
+    def _json(model):
+        return json.dumps(model.to_dict() if hasattr(model, 'to_dict') else model, default=str)
+
+    def store_node(self, resource, token, body, **kwargs):
+        with self._lock:
+            self._nodes.append((resource, token.namespace, token.local_part, body.type,
+                                self._json(body)))
+            self._flush_if_full()
+
+    def store_relation(self, resource, body, label, **kwargs):
+        with self._lock:
+            self._relations.append((resource, label, body.type,
+                                    body.subject_id.namespace, body.subject_id.local_part,
+                                    body.object_id.namespace, body.object_id.local_part,
+                                    self._json(body)))
+            self._flush_if_full()
+
+    def store_subgraph_template(self, resource, body, **kwargs):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO subgraph_templates VALUES (?, ?)',
+                             (resource, self._json(body)))
+            self._db.commit()
+
+    def get_provenance_data(self, resource, token, **kwargs):
+        """
+        Returns the stored node body as a dict, or raises a pennprov.rest.ApiException
+        with status 404, as the server does, if there is no such node.
+        """
+        with self._lock:
+            self.flush()
+            row = self._db.execute(
+                'SELECT body FROM nodes WHERE graph = ? AND namespace = ? AND local_part = ?',
+                (resource, token.namespace, token.local_part)).fetchone()
+        if row is None:
+            raise pennprov.rest.ApiException(status=404, reason='Not Found')
+        return json.loads(row[0])
+
+    def create_or_reset_provenance_graph(self, resource, **kwargs):
+        with self._lock:
+            self.flush()
+            for table in ('nodes', 'relations', 'subgraph_templates'):
+                self._db.execute('DELETE FROM {0} WHERE graph = ?'.format(table), (resource,))
+            self._db.commit()
+
+    def _flush_if_full(self):
+        if len(self._nodes) + len(self._relations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered nodes and relations.
+        """
+        with self._lock:
+            if self._nodes:
+                self._db.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)',
+                                     self._nodes)
+            if self._relations:
+                self._db.executemany('INSERT INTO relations VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     self._relations)
+            self._nodes = []
+            self._relations = []
+            self._db.commit()
+
+    def counts(self, resource):
+        """
+        Returns (nodes, relations) stored in the graph resource.
+        """
+        with self._lock:
+            self.flush()
+            return tuple(self._db.execute(
+                'SELECT COUNT(*) FROM {0} WHERE graph = ?'.format(table),
+                (resource,)).fetchone()[0] for table in ('nodes', 'relations'))
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+
+class SqliteProvConnection(MProvConnection):
+    """
+    An MProvConnection that writes to a local SqliteProvStore instead of an MProv server,
+    for runs without a server and for measuring provenance overhead. It can be passed
+    wherever ieeg takes an mprov_connection, and inherits store_windowed_result and the
+    other high-level MProvConnection methods.
+
+    Like MProvConnection, it resets its graph when created unless reset is False.
+    """
+
+    def __init__(self, path, graph_name=None, reset=True, batch_size=None):
+        # no server to log in to, so MProvConnection.__init__ is not called
+        # pylint: disable=super-init-not-called
+        if graph_name:
+            self.graph_name = graph_name
+        self.configuration = pennprov.configuration.Configuration()
+        self.configuration.host = 'sqlite:///' + path
+        self.username = None
+        self.token = None
+        self.auth_api = None
+        self.store = SqliteProvStore(path, batch_size)
+        self.prov_api = self.store
+        self.prov_dm_api = self.store
+        if reset:
+            self.store.create_or_reset_provenance_graph(self.get_graph())
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
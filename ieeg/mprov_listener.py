@@ -13,7 +13,18 @@
  See the License for the specific language governing permissions and
  limitations under the License.
 '''
+import os
+import json
 import uuid
+import tempfile
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Windows, where the token file is not locked
+    fcntl = None
 from pennprov.connection.mprov_connection import MProvConnection
 import pennprov.models
 from pennprov.models.subgraph_template import SubgraphTemplate
@@ -63,15 +74,352 @@ class AnnotationActivity:
         return activity
 
 
+class AnnotationRangeActivity(AnnotationActivity):
+    """
+    Represents a ProvDM Activity for the runs of an annotator function over a range of
+    consecutive windows.
+
+    Attributes:
+        activity_count: The number of windows, and of annotator runs, in the range.
+        name: The name of this Activity, '<annotator_name>.<first index>+<count>'.
+    """
+
+    def __init__(self, annotator_name, annotation_layer, activity_index, activity_count,
+                 start_time_utc, end_time_utc):
+        super().__init__(annotator_name, annotation_layer, activity_index,
+                         start_time_utc, end_time_utc)
+        self.activity_count = activity_count
+        self.name = '{0}.{1}+{2}'.format(self.annotator_name, self.activity_index,
+                                         self.activity_count)
+
+
+class ProvTokenCache:
+    """
+    A persistent record of the provenance tokens known to exist in each MProv graph, so
+    that later runs can skip probing the server for them.
+
+    The record is a JSON file, {graph: [[namespace, local_part], ...]}, rewritten
+    whenever a token is added. Each rewrite holds a lock on path + '.lock' and applies
+    this process's change to the file's current contents, so processes sharing the
+    file do not lose each other's tokens. MProvConnection may reset a graph when it
+    connects, so the first lookup in a graph in each process probes one recorded token,
+    and drops the graph's record if the server no longer has it. invalidate() drops
+    records explicitly.
+
+    Attributes:
+        path: The JSON file. Default is ~/.ieeg/prov_tokens.json.
+    """
+    default_path = os.path.join(os.path.expanduser('~'), '.ieeg', 'prov_tokens.json')
+
+    def __init__(self, path=None):
+        self.path = path if path else self.default_path
+        self._lock = threading.Lock()
+        self._validated = set()
+        self._graphs = self._load()
+
+    @staticmethod
+    def _key(token):
+        return token.namespace, token.local_part
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as cache_file:
+            return {graph: set(tuple(token) for token in tokens)
+                    for graph, tokens in json.load(cache_file).items()}
+
+    def _save(self, graph, added=None):
+        """
+        Records added in graph, or drops graph's record if added is None, or every
+        graph's if graph is also None. The file is reread under the lock, changed and
+        written to a temporary file of this process, which then replaces it.
+        """
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            graphs = self._load()
+            if added is not None:
+                graphs.setdefault(graph, set()).add(added)
+            elif graph is None:
+                graphs = {}
+            else:
+                graphs.pop(graph, None)
+            with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp',
+                                             prefix=os.path.basename(self.path) + '.',
+                                             delete=False) as cache_file:
+                json.dump({name: sorted(tokens) for name, tokens in graphs.items()},
+                          cache_file)
+            try:
+                os.replace(cache_file.name, self.path)
+            except OSError:
+                os.remove(cache_file.name)
+                raise
+        # tokens recorded by other processes are picked up too
+        self._graphs = graphs
+
+    def contains(self, mprov_connection, token):
+        """
+        Returns True if token is recorded as existing in the connection's graph.
+        """
+        graph = mprov_connection.get_graph()
+        with self._lock:
+            tokens = self._graphs.get(graph)
+            if not tokens:
+                return False
+            if graph not in self._validated:
+                namespace, local_part = next(iter(tokens))
+                try:
+                    mprov_connection.get_low_level_api().get_provenance_data(
+                        resource=graph, token=pennprov.QualifiedName(namespace, local_part))
+                except pennprov.rest.ApiException as api_error:
+                    if api_error.status != 404:
+                        raise api_error
+                    # the graph was reset since the tokens were recorded
+                    self._save(graph)
+                    return False
+                self._validated.add(graph)
+            return self._key(token) in tokens
+
+    def add(self, graph, token):
+        """
+        Records that token exists in graph.
+        """
+        with self._lock:
+            if self._key(token) not in self._graphs.get(graph, ()):
+                self._validated.add(graph)
+                self._save(graph, self._key(token))
+
+    def invalidate(self, graph=None):
+        """
+        Drops the record of graph, or of every graph if graph is None.
+        """
+        with self._lock:
+            self._save(graph)
+
+
+def _token_exists(mprov_connection, token, token_cache=None):
+    """
+    Returns True if token exists in the connection's graph, probing the server only if
+    token_cache does not record it.
+    """
+    if token_cache and token_cache.contains(mprov_connection, token):
+        return True
+    graph = mprov_connection.get_graph()
+    try:
+        mprov_connection.get_low_level_api().get_provenance_data(
+            resource=graph, token=token)
+    except pennprov.rest.ApiException as api_error:
+        if api_error.status != 404:
+            raise api_error
+        return False
+    if token_cache:
+        token_cache.add(graph, token)
+    return True
+
+
+class BufferedProvWriter:
+    """
+    Queues store_node and store_relation calls to an MProv graph and sends them in
+    batches from a background thread.
+
+    The MProv REST API stores one node or relation per request, so a batch is sent as
+    up to concurrency requests in flight at once: first the batch's nodes, then its
+    relations, so that relations only refer to nodes already stored. A batch is
+    complete before the next one is sent.
+
+    At most max_pending calls are queued. Once the queue is full, store_node and
+    store_relation block until the background thread catches up; stats() reports how
+    often and for how long they were blocked. An error in the background thread is
+    raised by every later call, flush() and close(). Nothing is sent after it, so the
+    graph has no gaps: calls still queued are discarded, which also releases callers
+    blocked on a full queue.
+
+    Attributes:
+        mprov_connection: The pennprov.connection.mprov_connection.MProvConnection to write to.
+        batch_size: The most calls sent in one batch.
+        max_pending: The most calls queued and not yet sent.
+        concurrency: The most requests in flight at once.
+        flush_interval: Seconds a partial batch waits for more calls before it is sent.
+    """
+    batch_size = 256
+    max_pending = 4096
+    concurrency = 8
+    flush_interval = 0.5
+
+    def __init__(self, mprov_connection, batch_size=None, max_pending=None,
+                 concurrency=None, flush_interval=None):
+        self.mprov_connection = mprov_connection
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._error = None
+        self._closed = False
+        self._stats = {'nodes': 0, 'relations': 0, 'batches': 0, 'blocked_calls': 0,
+                       'blocked_seconds': 0.0, 'max_pending': 0}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def store_node(self, token, body):
+        self._put(('node', token, body))
+
+    def store_relation(self, body, label):
+        self._put(('relation', body, label))
+
+    def _put(self, call):
+        self._raise_error()
+        if self._closed:
+            raise ValueError('BufferedProvWriter is closed')
+        try:
+            self._queue.put_nowait(call)
+        except queue.Full:
+            start = time.perf_counter()
+            self._queue.put(call)
+            with self._lock:
+                self._stats['blocked_calls'] += 1
+                self._stats['blocked_seconds'] += time.perf_counter() - start
+        with self._lock:
+            self._stats['max_pending'] = max(self._stats['max_pending'], self._queue.qsize())
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                call = self._queue.get()
+                if call is None:
+                    self._queue.task_done()
+                    return
+                if self._error is not None:
+                    # discarded, nothing is sent after an error
+                    self._queue.task_done()
+                    continue
+                batch = [call]
+                deadline = time.monotonic() + self.flush_interval
+                stop = False
+                while len(batch) < self.batch_size:
+                    try:
+                        call = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if call is None:
+                        stop = True
+                        break
+                    batch.append(call)
+                try:
+                    self._send(pool, batch)
+                except Exception as error:  # pylint: disable=broad-except
+                    self._error = error
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+                if stop:
+                    return
+
+    def _send(self, pool, batch):
+        mprov = self.mprov_connection
+        graph = mprov.get_graph()
+        nodes = [call for call in batch if call[0] == 'node']
+        relations = [call for call in batch if call[0] == 'relation']
+        list(pool.map(lambda call: mprov.prov_dm_api.store_node(
+            resource=graph, token=call[1], body=call[2]), nodes))
+        list(pool.map(lambda call: mprov.prov_dm_api.store_relation(
+            resource=graph, body=call[1], label=call[2]), relations))
+        with self._lock:
+            self._stats['nodes'] += len(nodes)
+            self._stats['relations'] += len(relations)
+            self._stats['batches'] += 1
+
+    def flush(self):
+        """
+        Waits until every queued call has been sent.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Sends the queued calls and stops the background thread. Raises the background
+        thread's error, if any, however many times it is called.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def stats(self):
+        """
+        Returns a dict of the nodes, relations and batches sent, the calls still pending,
+        the largest number pending, and the number of calls and seconds blocked on a full
+        queue.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class MProvWriter:
     """
     Writes provenance to the MProv system.
+
+    If buffered, the nodes and relations of windows, activities and annotations are
+    written through a BufferedProvWriter, and are only certain to be stored after
+    flush() or close(). With a ProvTokenCache, dataset and time series entities
+    recorded by earlier runs are not probed for again.
     """
 
-    def __init__(self, mprov_connection):
+    def __init__(self, mprov_connection, buffered=False, token_cache=None):
         self.mprov_connection = mprov_connection
         self.dataset_name_to_token = {}
         self.timeseries_id_to_token = {}
+        self.buffer = BufferedProvWriter(mprov_connection) if buffered else None
+        self.token_cache = token_cache
+
+    def _store_node(self, token, body):
+        if self.buffer:
+            self.buffer.store_node(token, body)
+        else:
+            self.mprov_connection.prov_dm_api.store_node(
+                resource=self.mprov_connection.get_graph(), token=token, body=body)
+
+    def _store_relation(self, body, label):
+        if self.buffer:
+            self.buffer.store_relation(body, label)
+        else:
+            self.mprov_connection.prov_dm_api.store_relation(
+                resource=self.mprov_connection.get_graph(), body=body, label=label)
+
+    def flush(self):
+        """
+        Waits until buffered provenance has been written.
+        """
+        if self.buffer:
+            self.buffer.flush()
+
+    def close(self):
+        """
+        Writes buffered provenance and stops buffering.
+        """
+        if self.buffer:
+            self.buffer.close()
+            self.buffer = None
 
     def write_input_channel_entities(self, dataset, input_channel_labels):
         """
@@ -96,12 +444,7 @@ class MProvWriter:
         graph = mprov.get_graph()
         dataset_token = pennprov.QualifiedName(
             MProvListener.dataset_namespace, dataset.name)
-        try:
-            self.mprov_connection.get_low_level_api().get_provenance_data(
-                resource=graph, token=dataset_token)
-        except pennprov.rest.ApiException as api_error:
-            if api_error.status != 404:
-                raise api_error
+        if not _token_exists(mprov, dataset_token, self.token_cache):
             attributes = [pennprov.models.Attribute(
                 name=MProvListener.dataset_attr_name, value=dataset.name, type='STRING')]
             entity = pennprov.NodeModel(
@@ -115,6 +458,8 @@ class MProvWriter:
                     type='MEMBERSHIP', subject_id=dataset_token, object_id=ts_token, attributes=[])
                 mprov.prov_dm_api.store_relation(
                     resource=graph, body=membership, label='hadMember')
+            if self.token_cache:
+                self.token_cache.add(graph, dataset_token)
         self.dataset_name_to_token[dataset.name] = dataset_token
         return dataset_token
 
@@ -127,15 +472,9 @@ class MProvWriter:
             return ts_token
         mprov = self.mprov_connection
         graph = mprov.get_graph()
-        prov_api = mprov.get_low_level_api()
         token = token = pennprov.QualifiedName(
             MProvListener.timeseries_namespace, ts_details.portal_id)
-        try:
-            prov_api.get_provenance_data(
-                resource=graph, token=token)
-        except pennprov.rest.ApiException as api_error:
-            if api_error.status != 404:
-                raise api_error
+        if not _token_exists(mprov, token, self.token_cache):
             attributes = [pennprov.models.Attribute(
                 name=MProvListener.timeseries_attr_name,
                 value=ts_details.channel_label,
@@ -144,6 +483,8 @@ class MProvWriter:
                 type='ENTITY', attributes=attributes)
             mprov.prov_dm_api.store_node(resource=graph,
                                          token=token, body=entity)
+            if self.token_cache:
+                self.token_cache.add(graph, token)
         self.timeseries_id_to_token[ts_details.portal_id] = token
         return token
 
@@ -158,8 +499,6 @@ class MProvWriter:
                          that used the window as input.
         :param annotation: The ieeg.dataset.Annotation output by the activity.
         """
-        mprov = self.mprov_connection
-        graph = mprov.get_graph()
         window_name = self._get_window_name(window, activity)
         window_token = pennprov.QualifiedName(MProvListener.window_namespace,
                                               window_name)
@@ -173,59 +512,95 @@ class MProvWriter:
         ]
         window_entity = pennprov.NodeModel(
             type='COLLECTION', attributes=window_attributes)
-        mprov.prov_dm_api.store_node(resource=graph,
-                                     token=window_token, body=window_entity)
+        self._store_node(window_token, window_entity)
         for input_channel_label in window.input_channel_labels:
             tsd = window.dataset.get_time_series_details(input_channel_label)
             ts_token = self._ensure_timeseries_entity(tsd)
             membership = pennprov.RelationModel(
                 type='MEMBERSHIP', subject_id=window_token, object_id=ts_token, attributes=[])
-            mprov.prov_dm_api.store_relation(
-                resource=graph, body=membership, label='hadMember')
+            self._store_relation(membership, 'hadMember')
 
         self._store_activity(window_token, activity)
         if annotation:
             self._store_annotation(activity, annotation)
 
+    def write_range_prov(self, windows, activity, annotations):
+        """
+        Writes the provenance of a range of consecutive windows as one window range, one
+        activity and the annotations, so that the nodes and relations written grow with
+        the number of ranges and annotations rather than windows times channels.
+        Window i of the range starts at the range's start_time_offset_usec plus
+        i times its stride_usec.
+        :param windows: The consecutive ieeg.processing.Windows of the range, all with
+                        the same input channels.
+        :param activity: The AnnotationRangeActivity that used the windows as input.
+        :param annotations: The ieeg.dataset.Annotation or None output for each window.
+        """
+        first = windows[0]
+        last = windows[-1]
+        stride_usec = (windows[1].window_start_usec - first.window_start_usec
+                       if len(windows) > 1 else first.window_size_usec)
+        range_name = '{0}.w.{1}+{2}'.format(activity.annotator_name, first.window_index,
+                                            len(windows))
+        range_token = pennprov.QualifiedName(MProvListener.window_namespace, range_name)
+        range_attributes = [
+            pennprov.models.Attribute(
+                name=MProvListener.window_start_time_name,
+                value=first.window_start_usec, type='LONG'),
+            pennprov.models.Attribute(
+                name=MProvListener.window_end_time_name,
+                value=(last.window_start_usec + last.window_size_usec), type='LONG'),
+            pennprov.models.Attribute(
+                name=MProvListener.window_stride_name, value=stride_usec, type='LONG'),
+            pennprov.models.Attribute(
+                name=MProvListener.window_count_name, value=len(windows), type='LONG')
+        ]
+        range_entity = pennprov.NodeModel(
+            type='COLLECTION', attributes=range_attributes)
+        self._store_node(range_token, range_entity)
+        for input_channel_label in first.input_channel_labels:
+            tsd = first.dataset.get_time_series_details(input_channel_label)
+            ts_token = self._ensure_timeseries_entity(tsd)
+            membership = pennprov.RelationModel(
+                type='MEMBERSHIP', subject_id=range_token, object_id=ts_token, attributes=[])
+            self._store_relation(membership, 'hadMember')
+
+        self._store_activity(range_token, activity)
+        for window, annotation in zip(windows, annotations):
+            if annotation:
+                self._store_annotation(activity, annotation, '{0}.{1}.ann.0'.format(
+                    activity.annotator_name, window.window_index))
+
     def _store_activity(self, window_token, activity):
         """
         Stores an Activity if necessary
         """
-        mprov = self.mprov_connection
-        graph = mprov.get_graph()
         activity_token = activity.get_token()
         activity_node = activity.get_node()
-        mprov.prov_dm_api.store_node(resource=graph,
-                                     token=activity_token, body=activity_node)
+        self._store_node(activity_token, activity_node)
         usage = pennprov.RelationModel(
             type='USAGE', subject_id=activity_token, object_id=window_token, attributes=[])
-        mprov.prov_dm_api.store_relation(
-            resource=graph, body=usage, label='used'
-        )
+        self._store_relation(usage, 'used')
         return activity_token
 
-    def _store_annotation(self, activity, annotation):
+    def _store_annotation(self, activity, annotation, annotation_id=None):
         """
         Stores the given annotation in the ProvDm store.
         """
-        mprov = self.mprov_connection
-        graph = mprov.get_graph()
-        annotation_id = '{0}.ann.0'.format(activity.name)
+        if annotation_id is None:
+            annotation_id = '{0}.ann.0'.format(activity.name)
 
         ann_token = pennprov.QualifiedName(MProvListener.annotation_namespace,
                                            annotation_id)
 
         attributes = self._get_annotation_attributes(annotation)
         ann_entity = pennprov.NodeModel(type='ENTITY', attributes=attributes)
-        mprov.prov_dm_api.store_node(resource=graph,
-                                     token=ann_token, body=ann_entity)
+        self._store_node(ann_token, ann_entity)
 
         activity_token = activity.get_token()
         generation = pennprov.RelationModel(
             type='GENERATION', subject_id=ann_token, object_id=activity_token, attributes=[])
-        mprov.prov_dm_api.store_relation(
-            resource=graph, body=generation, label='wasGeneratedBy'
-        )
+        self._store_relation(generation, 'wasGeneratedBy')
 
         return ann_token
 
@@ -304,6 +679,9 @@ class MProvListener:
     A hook into the MProv system. If an instance is passed to ieeg.Session() through
     the mprov_listener keyword arg its methods will be called when the appropriate
     ieeg.Dataset method is called.
+
+    With a ProvTokenCache, dataset, time series and activity entities recorded by
+    earlier runs are not probed for again.
     """
     dataset_namespace = MProvConnection.namespace + '/dataset#'
     dataset_attr_name = pennprov.QualifiedName(
@@ -338,9 +716,14 @@ class MProvListener:
         namespace=window_namespace, local_part='start_time_offset_usec')
     window_end_time_name = pennprov.QualifiedName(
         namespace=window_namespace, local_part='end_time_offset_usec')
+    window_stride_name = pennprov.QualifiedName(
+        namespace=window_namespace, local_part='stride_usec')
+    window_count_name = pennprov.QualifiedName(
+        namespace=window_namespace, local_part='count')
 
-    def __init__(self, mprov_connection):
+    def __init__(self, mprov_connection, token_cache=None):
         self.mprov_connection = mprov_connection
+        self.token_cache = token_cache
         self.dataset_id_to_token = {}
         self.timeseries_id_to_token = {}
         self.activity_name_to_token = {}
@@ -384,15 +767,9 @@ class MProvListener:
         """
         mprov = self.mprov_connection
         graph = mprov.get_graph()
-        prov_api = mprov.get_low_level_api()
         token = token = pennprov.QualifiedName(
             self.dataset_namespace, dataset.snap_id)
-        try:
-            prov_api.get_provenance_data(
-                resource=graph, token=token)
-        except pennprov.rest.ApiException as api_error:
-            if api_error.status != 404:
-                raise api_error
+        if not _token_exists(mprov, token, self.token_cache):
             attributes = [pennprov.models.Attribute(
                 name=self.dataset_attr_name, value=dataset_name, type='STRING')]
             entity = pennprov.NodeModel(
@@ -408,6 +785,8 @@ class MProvListener:
                     type='MEMBERSHIP', subject_id=token, object_id=ts_token, attributes=[])
                 mprov.prov_dm_api.store_relation(
                     resource=graph, body=membership, label='hadMember')
+            if self.token_cache:
+                self.token_cache.add(graph, token)
         return token
 
     def ensure_timeseries_entity(self, ts_details):
@@ -416,21 +795,17 @@ class MProvListener:
         """
         mprov = self.mprov_connection
         graph = mprov.get_graph()
-        prov_api = mprov.get_low_level_api()
         token = token = pennprov.QualifiedName(
             self.timeseries_namespace, ts_details.portal_id)
-        try:
-            prov_api.get_provenance_data(
-                resource=graph, token=token)
-        except pennprov.rest.ApiException as api_error:
-            if api_error.status != 404:
-                raise api_error
+        if not _token_exists(mprov, token, self.token_cache):
             attributes = [pennprov.models.Attribute(
                 name=self.timeseries_attr_name, value=ts_details.channel_label, type='STRING')]
             entity = pennprov.NodeModel(
                 type='ENTITY', attributes=attributes)
             mprov.prov_dm_api.store_node(resource=graph,
                                          token=token, body=entity)
+            if self.token_cache:
+                self.token_cache.add(graph, token)
         return token
 
     def ensure_activity(self, annotation):
@@ -439,16 +814,10 @@ class MProvListener:
         """
         mprov = self.mprov_connection
         graph = mprov.get_graph()
-        prov_api = mprov.get_low_level_api()
         annotator = annotation.annotator
         activity_token = activity_token = pennprov.QualifiedName(
             self.activity_namespace, annotator)
-        try:
-            prov_api.get_provenance_data(
-                resource=graph, token=activity_token)
-        except pennprov.rest.ApiException as api_error:
-            if api_error.status != 404:
-                raise api_error
+        if not _token_exists(mprov, activity_token, self.token_cache):
             attributes = [pennprov.models.Attribute(
                 name=self.activity_attr_name, value=annotator, type='STRING')]
             activity = pennprov.NodeModel(
@@ -462,6 +831,8 @@ class MProvListener:
             mprov.prov_dm_api.store_relation(
                 resource=graph, body=usage, label='used'
             )
+            if self.token_cache:
+                self.token_cache.add(graph, activity_token)
         return activity_token
 
     def store_annotation(self, annotation):
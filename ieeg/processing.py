@@ -14,13 +14,22 @@
  limitations under the License.
 '''
 import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pennprov.metadata.stream_metadata import BasicTuple, BasicSchema
 
+# Default span of samples fetched per get_data call by BlockReader
+BLOCK_SIZE_USEC = 60 * 1000000
+
 class Window:
     """
     A processing window over a Dataset.
 
+    A window references a block of samples, which may be shared by many overlapping
+    windows, through an offset and a length. The first access to data_block copies the
+    window's samples out of a shared block, so the array it returns is the window's own
+    and can be modified, as one from a get_data call.
+
     Attributes:
         dataset: The ieeg.dataset.Dataset of this window.
         input_channel_labels: The list of input channel labels of this window.
@@ -30,22 +39,386 @@ class Window:
         window_index: The index of this window in the stream of windows to which it belongs.
         window_start_usec: The microsecond offset into dataset of this window.
         window_size_usec: The length of this window in microseconds.
+        block: The array of samples holding data_block.
+        offset: The row of block at which data_block starts.
+        length: The number of rows of data_block, or None for the rest of block.
     """
 
+    __slots__ = ('dataset', 'input_channel_labels', 'block', 'offset', 'length',
+                 'window_index', 'window_start_usec', 'window_size_usec')
+
     def __init__(self,
                  dataset,
                  input_channel_labels,
                  data_block,
                  window_index,
                  window_start_usec,
-                 window_size_usec):
+                 window_size_usec,
+                 offset=0,
+                 length=None):
         self.dataset = dataset
         self.input_channel_labels = input_channel_labels
-        self.data_block = data_block
+        self.block = data_block
+        self.offset = offset
+        self.length = length
         self.window_index = window_index
         self.window_start_usec = window_start_usec
         self.window_size_usec = window_size_usec
 
+    @property
+    def data_block(self):
+        if self.offset != 0 or self.length is not None:
+            self.data_block = np.array(self.view())
+        return self.block
+
+    def view(self):
+        """
+        Returns this window's samples without copying them, a read-only view when the
+        block is shared.
+        """
+        if self.offset == 0 and self.length is None:
+            return self.block
+        end = None if self.length is None else self.offset + self.length
+        return self.block[self.offset:end]
+
+    @data_block.setter
+    def data_block(self, data_block):
+        self.block = data_block
+        self.offset = 0
+        self.length = None
+
+    def __reduce__(self):
+        # pickle only this window's samples, not the whole shared block
+        return (Window, (self.dataset, self.input_channel_labels, np.array(self.view()),
+                         self.window_index, self.window_start_usec, self.window_size_usec))
+
+
+class BlockReader:
+    """
+    Reads the windows of a sliding window over a Dataset from large contiguous blocks.
+
+    Each block is fetched with one dataset.get_data call and every window in it is a
+    read-only view of the block. Samples shared by the last windows of one block and
+    the first windows of the next are carried over instead of being fetched again, and
+    the next block is fetched on a background thread while the current one is used.
+
+    Blocks are only used when the window size and slide are whole numbers of samples at
+    a single sample rate, and when the first window and every block come back with the
+    expected number of samples. Otherwise windows are fetched one get_data call each,
+    so the samples of every window are those of a direct get_data call.
+
+    Attributes:
+        dataset: The ieeg.dataset.Dataset to read.
+        channel_indices: The channel indices passed to dataset.get_data.
+        start_time_usec: The start of the first window.
+        window_size_usec: The length of each window in microseconds.
+        slide_usec: The distance between window starts in microseconds.
+        num_windows: The number of windows to read.
+        block_size_usec: The span of samples fetched per block. None reads each window
+                         separately.
+    """
+
+    def __init__(self, dataset, channel_indices, start_time_usec, window_size_usec,
+                 slide_usec, num_windows, block_size_usec=BLOCK_SIZE_USEC):
+        self.dataset = dataset
+        self.channel_indices = channel_indices
+        self.start_time_usec = start_time_usec
+        self.window_size_usec = window_size_usec
+        self.slide_usec = slide_usec
+        self.num_windows = num_windows
+        self.block_size_usec = block_size_usec
+
+    def window_start_usec(self, window_index):
+        return self.start_time_usec + window_index * self.slide_usec
+
+    def _sample_rate(self):
+        """
+        Returns the common sample rate of the channels read, or None if they differ.
+        """
+        if self.dataset.current_montage is None:
+            details = [self.dataset.ts_details[self.dataset.ch_labels[index]]
+                       for index in self.channel_indices]
+        else:
+            details = list(self.dataset.ts_details.values())
+        rates = set(detail.sample_rate for detail in details)
+        return rates.pop() if len(rates) == 1 else None
+
+    @staticmethod
+    def _to_samples(usec, sample_rate):
+        """
+        Returns usec as a whole number of samples, or None if it is not one.
+        """
+        samples = usec * sample_rate / 1e6
+        rounded = int(round(samples))
+        return rounded if abs(samples - rounded) < 1e-6 else None
+
+    def _read_window(self, window_index):
+        return self.dataset.get_data(self.window_start_usec(window_index),
+                                     self.window_size_usec, self.channel_indices)
+
+    def __iter__(self):
+        """
+        Yields (window_index, window_start_usec, data_block) for each window in order.
+        """
+        for first, windows in self.iter_batches():
+            for offset, data_block in enumerate(windows):
+                yield first + offset, self.window_start_usec(first + offset), data_block
+
+    def iter_batches(self):
+        """
+        Yields (first_window_index, windows) in order, where windows is a read-only
+        windows x samples x channels view of consecutive windows. Windows read with
+        their own get_data call come one per batch.
+        """
+        for first, block, slide_samples, window_samples in self.iter_blocks():
+            if slide_samples is None:
+                yield first, block[np.newaxis]
+            else:
+                # samples x channels -> windows x samples x channels, without copying
+                windows = np.lib.stride_tricks.sliding_window_view(block, window_samples, axis=0)
+                yield first, windows[::slide_samples].transpose(0, 2, 1)
+
+    def iter_windows(self, input_channel_labels):
+        """
+        Yields a Window for each window in order. The windows of a block share it.
+        """
+        for first, block, slide_samples, window_samples in self.iter_blocks():
+            if slide_samples is None:
+                yield Window(self.dataset, input_channel_labels, block, first,
+                             self.window_start_usec(first), self.window_size_usec)
+                continue
+            for offset in range((len(block) - window_samples) // slide_samples + 1):
+                yield Window(self.dataset, input_channel_labels, block, first + offset,
+                             self.window_start_usec(first + offset), self.window_size_usec,
+                             offset * slide_samples, window_samples)
+
+    def iter_blocks(self):
+        """
+        Yields (first_window_index, block, slide_samples, window_samples) in order, where
+        window first_window_index + i is block[i * slide_samples:][:window_samples]. A
+        window read with its own get_data call is a block of its own, with slide_samples
+        and window_samples None.
+        """
+        sample_rate = self._sample_rate()
+        window_samples = slide_samples = block_samples = None
+        if self.block_size_usec and sample_rate:
+            window_samples = self._to_samples(self.window_size_usec, sample_rate)
+            slide_samples = self._to_samples(self.slide_usec, sample_rate)
+            block_samples = int(self.block_size_usec * sample_rate / 1e6)
+        if not (window_samples and slide_samples) or self.num_windows < 2:
+            for window_index in range(self.num_windows):
+                yield window_index, self._read_window(window_index), None, None
+            return
+
+        per_block = max(1, (block_samples - window_samples) // slide_samples + 1)
+        blocks = [(first, min(first + per_block, self.num_windows))
+                  for first in range(0, self.num_windows, per_block)]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            def fetch(first, last):
+                # only the samples past the last window of the previous block are requested
+                start = self.window_start_usec(first)
+                if first > 0:
+                    start = max(start, self.window_start_usec(first - 1) + self.window_size_usec)
+                end = self.window_start_usec(last - 1) + self.window_size_usec
+                return start, end, executor.submit(self.dataset.get_data, start, end - start,
+                                                   self.channel_indices)
+
+            first_window = self._read_window(0)
+            pending = fetch(*blocks[0])
+            carry = None
+            for block_number, (first, last) in enumerate(blocks):
+                fetch_start, fetch_end, future = pending
+                if block_number + 1 < len(blocks):
+                    pending = fetch(*blocks[block_number + 1])
+                block_start = self.window_start_usec(first)
+                if fetch_start > block_start and carry is None:
+                    carry = self.dataset.get_data(block_start, fetch_start - block_start,
+                                                  self.channel_indices)
+                    if len(carry) != self._to_samples(fetch_start - block_start, sample_rate):
+                        carry = None
+                fetched = future.result()
+                block = None
+                if len(fetched) == self._to_samples(fetch_end - fetch_start, sample_rate):
+                    if fetch_start == block_start:
+                        block = fetched
+                    elif carry is not None:
+                        block = np.concatenate((carry, fetched))
+                if block is not None and first == 0 and not np.array_equal(
+                        block[:len(first_window)], first_window, equal_nan=True):
+                    block = None
+                carry = None
+                if block is None:
+                    # unexpected samples: fall back to a get_data call per window
+                    for window_index in range(first, last):
+                        yield window_index, (first_window if window_index == 0 else
+                                             self._read_window(window_index)), None, None
+                    continue
+                block.setflags(write=False)
+                yield first, block, slide_samples, window_samples
+                carry_offset = self._to_samples(self.window_start_usec(last) - block_start,
+                                                sample_rate)
+                if carry_offset < len(block):
+                    carry = block[carry_offset:]
+
+
+class ResultBuffer:
+    """
+    Collects one result per window into an array allocated once for all windows.
+
+    The array is allocated from the shape and dtype of the first result, with the
+    window axis at axis, and promoted if a later result needs a wider dtype, so the
+    result matches stacking the per-window results. If results differ in shape they
+    are kept in a list and returned as np.array(results), as before.
+
+    Attributes:
+        num_windows: The number of windows.
+        axis: The window axis of the result, 0 or -1.
+        out_path: If given, the array is a .npy memmap at this path rather than held in
+                  memory.
+    """
+
+    def __init__(self, num_windows, axis=0, out_path=None):
+        self.num_windows = num_windows
+        self.axis = axis
+        self.out_path = out_path
+        self.array = None
+        self.results = None
+        self.count = 0
+
+    def _allocate(self, shape, dtype):
+        if self.axis == 0:
+            shape = (self.num_windows,) + shape
+        else:
+            shape = shape + (self.num_windows,)
+        if self.out_path is None:
+            return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(self.out_path, mode='w+', dtype=dtype, shape=shape)
+
+    def _index(self, index):
+        return (index,) if self.axis == 0 else (Ellipsis, index)
+
+    def _slice(self, count):
+        return self._index(slice(0, count))
+
+    def append(self, value):
+        """
+        Stores the result of the next window and returns its index.
+        """
+        value = np.asarray(value)
+        index = self.count
+        if self.results is not None:
+            self.results.append(value)
+        elif self.array is None:
+            self.array = self._allocate(value.shape, value.dtype)
+        elif value.shape != self.array[self._index(index)].shape:
+            # differently shaped results can not share an array
+            self.results = [self.array[self._index(i)] for i in range(index)] + [value]
+            self.array = None
+        elif not np.can_cast(value.dtype, self.array.dtype, casting='safe'):
+            filled = self._slice(index)
+            previous = np.array(self.array[filled],
+                                dtype=np.result_type(self.array.dtype, value.dtype))
+            self.array = None
+            self.array = self._allocate(value.shape, previous.dtype)
+            self.array[filled] = previous
+        if self.array is not None:
+            self.array[self._index(index)] = value
+        self.count += 1
+        return index
+
+    def extend(self, values):
+        """
+        Stores the results of the next windows, stacked along axis, and returns the
+        index of the first.
+        """
+        values = np.asarray(values)
+        first = self.count
+        count = values.shape[self.axis]
+        if count and self.array is not None and \
+                np.can_cast(values.dtype, self.array.dtype, casting='safe') and \
+                values[self._index(0)].shape == self.array[self._index(0)].shape:
+            self.array[self._index(slice(first, first + count))] = values
+            self.count += count
+            return first
+        for value in np.moveaxis(values, self.axis, 0):
+            self.append(value)
+        return first
+
+    def result(self):
+        """
+        Returns the results of the windows stored so far.
+        """
+        if self.results is not None:
+            if self.axis == 0:
+                return np.array(self.results)
+            return np.stack(self.results, axis=self.axis)
+        if self.array is None:
+            return np.array([])
+        if self.count < self.num_windows:
+            return self.array[self._slice(self.count)]
+        if self.out_path is not None:
+            self.array.flush()
+        return self.array
+
+
+class ProvenanceRecorder:
+    """
+    Writes the provenance of a sliding window computation, one record per window or,
+    for long runs, one record per segment of consecutive windows.
+
+    Attributes:
+        mprov_connection: The pennprov.connection.mprov_connection.MProvConnection to write to.
+        input_name: The name of the input stream.
+        output_name: The name of the output stream and operation.
+        start_time_usec: The start of window 0.
+        window_size_usec: The length of each window in microseconds.
+        slide_usec: The distance between window starts in microseconds.
+        segment_windows: The number of windows per record. 1 writes a record per window
+                         with ProcessSlidingWindowPerChannel.write_window_annot, more
+                         writes ProcessSlidingWindowPerChannel.write_range_annot records.
+    """
+
+    def __init__(self, mprov_connection, input_name, output_name, start_time_usec,
+                 window_size_usec, slide_usec, segment_windows=1):
+        self.mprov_connection = mprov_connection
+        self.input_name = input_name
+        self.output_name = output_name
+        self.start_time_usec = start_time_usec
+        self.window_size_usec = window_size_usec
+        self.slide_usec = slide_usec
+        self.segment_windows = segment_windows
+        self._segment = None
+
+    def add(self, window_index, output_index):
+        """
+        Records that window window_index produced output output_index. Windows must be
+        added in order.
+        """
+        if not self.mprov_connection:
+            return
+        if self.segment_windows <= 1:
+            ProcessSlidingWindowPerChannel.write_window_annot(self.mprov_connection, self.input_name, window_index, self.window_size_usec,
+                                    self.output_name, output_index, '')
+            return
+        if self._segment is None:
+            self._segment = [window_index, output_index, 0]
+        self._segment[2] += 1
+        if self._segment[2] >= self.segment_windows:
+            self.close()
+
+    def close(self):
+        """
+        Writes the record of the last, partial segment.
+        """
+        if self._segment is not None:
+            window_index, output_index, count = self._segment
+            ProcessSlidingWindowPerChannel.write_range_annot(
+                self.mprov_connection, self.input_name, window_index, count,
+                self.window_size_usec, self.start_time_usec + window_index * self.slide_usec,
+                self.slide_usec, self.output_name, output_index)
+            self._segment = None
+
+
 class ProcessSlidingWindowPerChannel:
     """
     Methods to process a sliding window per channel.
@@ -67,52 +440,125 @@ class ProcessSlidingWindowPerChannel:
                                                input_start,
                                                input_start + input_duration)
 
+    @staticmethod
+    def write_range_annot(mprov_connection, input_name, input_start, input_count, input_duration,
+                          input_start_usec, input_stride_usec, output_name, output_index):
+        """
+        Writes one provenance record for input_count consecutive windows, the first being
+        window input_start, starting at input_start_usec, with output output_index. Window
+        input_start + i starts at input_start_usec + i * input_stride_usec, lasts
+        input_duration and has output output_index + i.
+        """
+        basic_schema = BasicSchema(output_name, {'input': 'string',
+                                                 'start': 'double',
+                                                 'count': 'double',
+                                                 'duration': 'double',
+                                                 'start_usec': 'double',
+                                                 'stride_usec': 'double'})
+        end_usec = input_start_usec + (input_count - 1) * input_stride_usec + input_duration
+        mprov_connection.store_windowed_result(output_name, output_index,
+                                               BasicTuple(basic_schema,
+                                                          {'input': input_name,
+                                                           'start': input_start,
+                                                           'count': input_count,
+                                                           'duration': input_duration,
+                                                           'start_usec': input_start_usec,
+                                                           'stride_usec': input_stride_usec}),
+                                               [input_start],
+                                               output_name,
+                                               input_start_usec,
+                                               end_usec)
 
+    @staticmethod
+    def vectorize(per_channel_computation):
+        """
+        Returns a window computation, as taken by execute_windows, that applies
+        per_channel_computation to each channel of each window.
+        """
+        def window_computation(windows):
+            # each channel is copied, as windows are read-only views of a block
+            return np.array([[per_channel_computation(np.array(channel)) for channel in window.T]
+                             for window in windows])
+        return window_computation
 
     @staticmethod
     def execute(dataset, channel_list,
                 start_time_usec, window_size_usec, slide_usec, duration_usec,
-                per_channel_computation):
+                per_channel_computation, block_size_usec=BLOCK_SIZE_USEC, out_path=None):
         """
         Access a sliding window over a subset of channels, do a single computation
         over each channel separately, and repeat for the duration
 
+        Windows are read from blocks of block_size_usec by a BlockReader, or one
+        get_data call each if block_size_usec is None. Results are written to an array
+        allocated once, a .npy memmap at out_path if given.
+
         Returns a 2D matrix
         """
         return ProcessSlidingWindowPerChannel.execute_with_provenance(dataset, channel_list, start_time_usec, window_size_usec, slide_usec,
-                                            duration_usec, per_channel_computation, None, None, None)
+                                            duration_usec, per_channel_computation, None, None, None,
+                                            block_size_usec, out_path)
 
     @staticmethod
     def execute_with_provenance(dataset, channel_list,
                                 start_time_usec, window_size_usec, slide_usec, duration_usec,
-                                per_channel_computation, mprov_connection, op_name, in_name):
-        channel_indices = dataset.get_channel_indices(channel_list)
+                                per_channel_computation, mprov_connection, op_name, in_name,
+                                block_size_usec=BLOCK_SIZE_USEC, out_path=None,
+                                provenance_segment_windows=1):
+        """
+        As execute, writing provenance to mprov_connection. With
+        provenance_segment_windows above 1, provenance is written per segment of that
+        many windows rather than per window, see ProvenanceRecorder.
+        """
+        return ProcessSlidingWindowPerChannel.execute_windows_with_provenance(
+            dataset, channel_list, start_time_usec, window_size_usec, slide_usec, duration_usec,
+            ProcessSlidingWindowPerChannel.vectorize(per_channel_computation),
+            mprov_connection, op_name, in_name, block_size_usec, out_path,
+            provenance_segment_windows)
 
-        # 0th window
-        start_index = start_time_usec
+    @staticmethod
+    def execute_windows(dataset, channel_list,
+                        start_time_usec, window_size_usec, slide_usec, duration_usec,
+                        window_computation, block_size_usec=BLOCK_SIZE_USEC, out_path=None):
+        """
+        Access a sliding window over a subset of channels, do a single computation
+        over many windows at once, and repeat for the duration
 
-        matrix = dataset.get_data(start_index, window_size_usec, channel_indices)
-        ret = np.reshape(np.array([per_channel_computation(channel) for channel in matrix.T]),
-                         (len(channel_indices), 1))
+        window_computation takes a windows x samples x channels array, a read-only view of a
+        block for block reads, and returns a windows x channels array, e.g.
+        lambda windows: np.mean(windows, axis=1).
 
-        if mprov_connection:
-            ProcessSlidingWindowPerChannel.write_window_annot(mprov_connection, in_name, 0, window_size_usec,
-                                    op_name, ret.shape[1] - 1, '')
+        Returns a 2D matrix, channels x windows, as execute
+        """
+        return ProcessSlidingWindowPerChannel.execute_windows_with_provenance(
+            dataset, channel_list, start_time_usec, window_size_usec, slide_usec, duration_usec,
+            window_computation, None, None, None, block_size_usec, out_path)
 
-        for window in range(1, int(math.ceil(duration_usec / slide_usec))):
-            start_index = start_time_usec + window * slide_usec
+    @staticmethod
+    def execute_windows_with_provenance(dataset, channel_list,
+                                        start_time_usec, window_size_usec, slide_usec, duration_usec,
+                                        window_computation, mprov_connection, op_name, in_name,
+                                        block_size_usec=BLOCK_SIZE_USEC, out_path=None,
+                                        provenance_segment_windows=1):
+        channel_indices = dataset.get_channel_indices(channel_list)
+        provenance = ProvenanceRecorder(mprov_connection, in_name, op_name, start_time_usec,
+                                        window_size_usec, slide_usec, provenance_segment_windows)
 
-            matrix = dataset.get_data(start_index, window_size_usec, channel_indices)
-            x = np.reshape(np.array([per_channel_computation(channel) for channel in matrix.T]),
-                           (len(channel_indices), 1))
+        # the 0th window is always computed
+        num_windows = max(1, int(math.ceil(duration_usec / slide_usec)))
+        reader = BlockReader(dataset, channel_indices, start_time_usec, window_size_usec,
+                             slide_usec, num_windows, block_size_usec)
+        ret = ResultBuffer(num_windows, axis=-1, out_path=out_path)
+        for first, windows in reader.iter_batches():
+            x = np.reshape(window_computation(windows), (len(windows), len(channel_indices)))
 
-            ret = np.hstack((ret, x))
+            first_index = ret.extend(x.T)
 
-            if mprov_connection:
-                ProcessSlidingWindowPerChannel.write_window_annot(mprov_connection, in_name, window, window_size_usec,
-                                        op_name, ret.shape[1] - 1, '')
+            for offset in range(len(windows)):
+                provenance.add(first + offset, first_index + offset)
 
-        return ret
+        provenance.close()
+        return ret.result()
 
 
 class ProcessSlidingWindowAcrossChannels:
@@ -123,32 +569,46 @@ class ProcessSlidingWindowAcrossChannels:
 
     @staticmethod
     def execute(dataset, channel_subset_list, start_time_usec, window_size_usec, slide_usec, duration_usec,
-                per_block_computation):
+                per_block_computation, block_size_usec=BLOCK_SIZE_USEC, out_path=None):
         """
         Access a sliding window over a subset of channels, do a single computation
         over the 2D matrix, and repeat for the duration
 
+        Windows are read from blocks of block_size_usec by a BlockReader, or one
+        get_data call each if block_size_usec is None. Results are written to an array
+        allocated once, a .npy memmap at out_path if given.
+
         Returns an array
         """
         return ProcessSlidingWindowAcrossChannels.execute_with_provenance(dataset, channel_subset_list, start_time_usec, window_size_usec, slide_usec,
                                             duration_usec,
-                                            per_block_computation, None, None, None)
+                                            per_block_computation, None, None, None,
+                                            block_size_usec, out_path)
 
     @staticmethod
     def execute_with_provenance(dataset, channel_subset_list, start_time_usec, window_size_usec, slide_usec,
-                                duration_usec, per_block_computation, mprov_connection, op_name, in_name):
+                                duration_usec, per_block_computation, mprov_connection, op_name, in_name,
+                                block_size_usec=BLOCK_SIZE_USEC, out_path=None,
+                                provenance_segment_windows=1):
+        """
+        As execute, writing provenance to mprov_connection. With
+        provenance_segment_windows above 1, provenance is written per segment of that
+        many windows rather than per window, see ProvenanceRecorder.
+        """
         channel_indices = dataset.get_channel_indices(channel_subset_list)
-        ret = []
-
-        for window in range(0, int(math.ceil(duration_usec / slide_usec))):
-            start_index = start_time_usec + window * slide_usec
+        provenance = ProvenanceRecorder(mprov_connection, in_name, op_name, start_time_usec,
+                                        window_size_usec, slide_usec, provenance_segment_windows)
+        num_windows = int(math.ceil(duration_usec / slide_usec))
+        ret = ResultBuffer(num_windows, axis=0, out_path=out_path)
 
-            matrix = dataset.get_data(start_index, window_size_usec, channel_indices)
-            x = per_block_computation(matrix)
+        reader = BlockReader(dataset, channel_indices, start_time_usec, window_size_usec,
+                             slide_usec, num_windows, block_size_usec)
+        for window, _, matrix in reader:
+            # a writable copy, as from get_data, rather than a view of a shared block
+            x = per_block_computation(np.array(matrix))
 
-            ret = ret + [x]
-            if mprov_connection:
-                ProcessSlidingWindowPerChannel.write_window_annot(mprov_connection, in_name, window, window_size_usec,
-                                        op_name, len(ret) - 1, '')
+            output_index = ret.append(x)
+            provenance.add(window, output_index)
 
-        return np.array(ret)
+        provenance.close()
+        return ret.result()
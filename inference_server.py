@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:26:13 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# A long-running local HTTP server that scores iEEG windows with models from
+# models/ kept in memory. Concurrent requests for the same model are
+# coalesced into micro-batches: a batch is sent to the model once it reaches
+# --max_batch_size windows or once its oldest request has waited
+# --max_wait_ms, whichever comes first.
+#
+# Endpoints:
+#   POST /predict/<model_name>  body: {"windows": [[x0, x1, ...], ...]}
+#                               or raw little-endian float32 samples with
+#                               Content-Type: application/octet-stream
+#                               returns: {"probabilities": [...]}
+#   GET  /stats                 queue depth, batch and latency statistics
+#   GET  /models                loaded models and their window lengths
+#
+# Sample execution:
+# python inference_server.py -m eeg-model-cnn-wavenet eeg-model-lstm -p 8765
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_inference import load_predictor
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_BATCH_SIZE = 1024
+MAX_WAIT_MS = 10.0
+LATENCY_HISTORY = 10000
+
+
+# ------------------
+# MICRO-BATCHING
+# ------------------
+class MicroBatcher:
+    """
+    Collects prediction requests for one model and scores them in batches
+    on a single worker thread.
+    """
+
+    def __init__(self, predictor, max_batch_size = MAX_BATCH_SIZE,
+                 max_wait_ms = MAX_WAIT_MS):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen = LATENCY_HISTORY)
+        self.batch_sizes = collections.deque(maxlen = LATENCY_HISTORY)
+        self.lock = threading.Lock()
+        self.served = 0
+        self.worker = threading.Thread(target = self._run, daemon = True)
+        self.worker.start()
+
+    def submit(self, windows):
+        """
+        Queues windows for scoring and returns a Future for their outputs.
+        """
+        windows = np.asarray(windows, dtype = np.float32).reshape(
+            (-1,) + self.predictor.input_shape)
+        future = Future()
+        self.requests.put((time.perf_counter(), windows, future))
+        return future
+
+    def _collect(self):
+        """
+        Blocks for one request, then gathers more until the batch is full or
+        the first request has waited max_wait. Requests already queued are
+        always taken, so a backlog is served in full batches.
+        """
+        first = self.requests.get()
+        batch = [first]
+        count = len(first[1])
+        deadline = first[0] + self.max_wait
+        while count < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    request = self.requests.get(timeout = timeout)
+                else:
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request[1])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._score(batch)
+            except Exception as error:
+                # every request of a failed batch gets the error, so no
+                # client is left waiting
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _score(self, batch):
+        windows = np.concatenate([windows for _, windows, _ in batch])
+        preds = self.predictor.predict_batches(windows)
+        if len(preds) != len(windows):
+            raise ValueError("Model returned %d outputs for %d windows" %
+                             (len(preds), len(windows)))
+        done = time.perf_counter()
+        with self.lock:
+            self.latencies.extend(done - received for received, _, _ in batch)
+            self.batch_sizes.append(len(preds))
+            self.served += len(batch)
+        offset = 0
+        for _, request_windows, future in batch:
+            future.set_result(preds[offset : offset + len(request_windows)])
+            offset += len(request_windows)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.0
+            batch_sizes = np.array(self.batch_sizes)
+            served = self.served
+        stats = {'queue_depth': self.requests.qsize(),
+                 'requests_served': served,
+                 'batches': len(batch_sizes)}
+        if len(latencies):
+            stats['latency_p50_ms'] = float(np.percentile(latencies, 50))
+            stats['latency_p99_ms'] = float(np.percentile(latencies, 99))
+            stats['mean_batch_windows'] = float(np.mean(batch_sizes))
+        return stats
+
+
+# ------------------
+# HTTP SERVER
+# ------------------
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    Routes HTTP requests to the server's MicroBatchers.
+    """
+
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        batchers = self.server.batchers
+        if self.path == '/stats':
+            self._send_json(200, {name: batcher.stats()
+                                  for name, batcher in batchers.items()})
+        elif self.path == '/models':
+            self._send_json(200, {name: list(batcher.predictor.input_shape)
+                                  for name, batcher in batchers.items()})
+        else:
+            self._send_json(404, {'error': 'Unknown path ' + self.path})
+
+    def do_POST(self):
+        prefix = '/predict/'
+        model_name = self.path[len(prefix):] if self.path.startswith(prefix) else None
+        batcher = self.server.batchers.get(model_name)
+        if batcher is None:
+            self._send_json(404, {'error': 'Unknown model ' + str(model_name)})
+            return
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Type') == 'application/octet-stream':
+                windows = np.frombuffer(content, dtype = '<f4')
+            else:
+                windows = json.loads(content.decode('utf-8'))['windows']
+            future = batcher.submit(windows)
+        except (ValueError, KeyError, TypeError) as error:
+            self._send_json(400, {'error': str(error)})
+            return
+        try:
+            preds = future.result()
+        except Exception as error:
+            self._send_json(500, {'error': str(error)})
+            return
+        self._send_json(200, {'probabilities': preds.ravel().tolist()})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server holding one MicroBatcher per model.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def create_server(model_names, host = HOST, port = PORT,
+                  max_batch_size = MAX_BATCH_SIZE, max_wait_ms = MAX_WAIT_MS):
+    server = InferenceServer((host, port), InferenceHandler)
+    server.batchers = {}
+    for model_name in model_names:
+        predictor = load_predictor("models/" + model_name + ".pkl")
+        server.batchers[model_name] = MicroBatcher(predictor, max_batch_size,
+                                                   max_wait_ms)
+    return server
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-m", "--model_names", type = str, nargs = '+',
+                default = ['eeg-model-cnn-wavenet'],
+                help = "Models to serve.")
+    ap.add_argument("-H", "--host", type = str, default = HOST,
+                help = "Address to listen on.")
+    ap.add_argument("-p", "--port", type = int, default = PORT,
+                help = "Port to listen on.")
+    ap.add_argument("-b", "--max_batch_size", type = int, default = MAX_BATCH_SIZE,
+                help = "Maximum number of windows per micro-batch.")
+    ap.add_argument("-w", "--max_wait_ms", type = float, default = MAX_WAIT_MS,
+                help = "Longest a request waits for its batch to fill.")
+    args = vars(ap.parse_args())
+
+    server = create_server(args['model_names'], args['host'], args['port'],
+                           args['max_batch_size'], args['max_wait_ms'])
+    print("Serving " + ", ".join(args['model_names']) + " on http://" +
+          args['host'] + ":" + str(args['port']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
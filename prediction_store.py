@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 26 09:31:20 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# A directory of saved model predictions, so window probabilities outlive
+# the metrics printed by create_predictions.py.
+#
+# Each (model, seizure) run is stored as <root>/runs/<model>--<seizure>.npz:
+#   electrodes   electrode labels
+#   times        int64 window end times in usec
+#   probs        electrodes x windows, uint8 (probability * 255) or float16
+# Windows above the run's threshold are also kept as run-length intervals,
+# (electrode, first window end, last window end), in one table for the whole
+# store, <root>/intervals.npz. Runs never span a gap in the window times,
+# such as the one between the interictal and ictal segments of a seizure. The table is sorted by start time with a
+# running maximum of end times, so the intervals overlapping [t0, t1] are
+# found with two binary searches and a scan of the candidates in between.
+#
+# Sample execution:
+# python prediction_store.py -r predictions -s 402704260829 -e 402756680000
+# python prediction_store.py -r predictions -s 402704260829 -e 402756680000 -m eeg-model-cnn-wavenet
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import h5py
+
+from seizure_data import FS, DOWN_SAMPLE_FACTOR, write_atomic
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+THRESHOLD = 0.5
+MERGE_GAP_WINDOWS = 4
+INTERVAL_COLUMNS = ['model', 'seizure', 'electrode', 'start', 'end']
+
+
+# ------------------
+# ENCODING
+# ------------------
+def encode_probs(probs, dtype):
+    probs = np.asarray(probs, dtype = np.float32)
+    if dtype == 'uint8':
+        return np.round(np.clip(probs, 0.0, 1.0) * 255).astype(np.uint8)
+    if dtype == 'float16':
+        return probs.astype(np.float16)
+    raise ValueError("Unknown probability dtype " + str(dtype))
+
+def decode_probs(probs):
+    if probs.dtype == np.uint8:
+        return probs.astype(np.float32) / 255
+    return probs.astype(np.float32)
+
+def segment_breaks(times):
+    """
+    Returns the indices of the windows that start a new contiguous segment,
+    where the step from the previous window end time is not the smallest
+    positive step.
+    """
+    steps = np.diff(np.asarray(times, dtype = np.int64))
+    if not np.any(steps > 0):
+        return np.zeros(0, dtype = np.int64)
+    return np.flatnonzero(steps != steps[steps > 0].min()) + 1
+
+def positive_runs(mask, breaks = None):
+    """
+    Returns (starts, ends) index arrays of the runs of True in a 1D mask,
+    with exclusive ends. Runs are split at breaks, see segment_breaks.
+    """
+    mask = np.asarray(mask, dtype = bool)
+    padded = np.concatenate(([False], mask, [False]))
+    changes = np.flatnonzero(padded[1 :] != padded[: -1])
+    if breaks is not None and len(breaks):
+        # a run through a break ends and restarts there
+        cuts = breaks[mask[breaks - 1] & mask[breaks]]
+        changes = np.sort(np.concatenate((changes, cuts, cuts)))
+    return changes[0 : : 2], changes[1 : : 2]
+
+def merge_runs(starts, ends, gap, breaks = None):
+    """
+    Merges runs separated by at most gap positions and no break.
+    """
+    if len(starts) == 0:
+        return starts, ends
+    separate = starts[1 :] - ends[: -1] > gap
+    if breaks is not None and len(breaks):
+        # some break b with ends[i - 1] <= b <= starts[i]
+        separate |= (np.searchsorted(breaks, starts[1 :], side = 'right') >
+                     np.searchsorted(breaks, ends[: -1], side = 'left'))
+    keep = np.concatenate(([True], separate))
+    return starts[keep], ends[np.concatenate((keep[1 :], [True]))]
+
+def interval_table(electrodes, times, probs, threshold):
+    """
+    Returns (electrode, start, end) arrays of the runs of windows above
+    threshold, with start and end the end times of the first and last window
+    of each run.
+    """
+    breaks = segment_breaks(times)
+    rows = []
+    for electrode, label in enumerate(electrodes):
+        starts, ends = positive_runs(probs[electrode] > threshold, breaks)
+        rows.append((np.full(len(starts), label, dtype = object),
+                     times[starts], times[ends - 1]))
+    if not rows:
+        return (np.zeros(0, dtype = object), np.zeros(0, dtype = np.int64),
+                np.zeros(0, dtype = np.int64))
+    return tuple(np.concatenate(column) for column in zip(*rows))
+
+
+
+# ------------------
+# DETECTIONS
+# ------------------
+def model_sequence_len(path_model):
+    """
+    Returns the window length of a saved Keras model without loading it, so
+    the caller does not initialise TensorFlow.
+    """
+    with h5py.File(path_model, 'r') as f:
+        config = f.attrs['model_config']
+    config = json.loads(config if isinstance(config, str) else config.decode('utf-8'))
+    return config['config']['layers'][0]['config']['batch_input_shape'][1]
+
+def detect_intervals(probs, times, channel_labels, sequence_len, threshold = THRESHOLD,
+                     gap = MERGE_GAP_WINDOWS):
+    """
+    Returns a DataFrame of per-electrode seizure intervals. An interval runs
+    from the start of its first positive window to the end of its last, and
+    runs are neither extended nor merged across gaps in times.
+    """
+    window_usec = int(sequence_len * DOWN_SAMPLE_FACTOR * 1e6 / FS)
+    breaks = segment_breaks(times)
+    rows = []
+    for electrode, label in enumerate(channel_labels):
+        starts, ends = merge_runs(*positive_runs(probs[electrode] > threshold, breaks),
+                                  gap, breaks)
+        for start, end in zip(starts, ends):
+            rows.append((label, int(times[start]) - window_usec, int(times[end - 1]),
+                         int(end - start), float(probs[electrode, start : end].max())))
+    return pd.DataFrame(rows, columns = ['electrode', 'start', 'end', 'windows', 'max_prob'])
+
+
+# ------------------
+# STORE
+# ------------------
+class PredictionStore:
+    """
+    Window probabilities and seizure intervals for many seizures and models.
+
+    Attributes:
+        root: The store directory.
+        intervals: DataFrame of every interval, sorted by start, with the
+                   columns of INTERVAL_COLUMNS.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "runs"), exist_ok = True)
+        self.intervals = self._load_intervals()
+        self._index()
+
+    def _run_path(self, model, seizure):
+        return os.path.join(self.root, "runs", model + "--" + seizure + ".npz")
+
+    def _load_intervals(self):
+        path = os.path.join(self.root, "intervals.npz")
+        if not os.path.exists(path):
+            return pd.DataFrame({column: np.zeros(0, dtype = np.int64 if column in
+                                                  ('start', 'end') else object)
+                                 for column in INTERVAL_COLUMNS})
+        with np.load(path, allow_pickle = False) as f:
+            return pd.DataFrame({column: f[column] for column in INTERVAL_COLUMNS})
+
+    def _save_intervals(self):
+        path = os.path.join(self.root, "intervals.npz")
+        columns = {column: (self.intervals[column].to_numpy(dtype = np.int64)
+                            if column in ('start', 'end') else
+                            self.intervals[column].to_numpy(dtype = str))
+                   for column in INTERVAL_COLUMNS}
+        write_atomic(path, lambda f: np.savez(f, **columns))
+
+    def _index(self):
+        self.intervals = self.intervals.sort_values(['start', 'end'], kind = 'stable')
+        self.intervals = self.intervals.reset_index(drop = True)
+        self._starts = self.intervals['start'].to_numpy(dtype = np.int64)
+        self._ends = self.intervals['end'].to_numpy(dtype = np.int64)
+        self._max_ends = np.maximum.accumulate(self._ends) if len(self._ends) else self._ends
+
+    def save(self, model, seizure, electrodes, times, probs, threshold = THRESHOLD,
+             dtype = 'uint8'):
+        """
+        Saves one run, replacing any earlier run of the same model and
+        seizure.
+
+        :param electrodes: list of electrode labels.
+        :param times: 1D array of window end times in usec.
+        :param probs: 2D array, electrodes x windows.
+        """
+        times = np.asarray(times, dtype = np.int64)
+        probs = np.asarray(probs).reshape(len(electrodes), len(times))
+        encoded = encode_probs(probs, dtype)
+        path = self._run_path(model, seizure)
+        write_atomic(path, lambda f: np.savez(
+            f, electrodes = np.asarray(electrodes, dtype = str), times = times,
+            probs = encoded, threshold = threshold))
+
+        # intervals come from the stored probabilities, so a reloaded run
+        # thresholds to the same intervals
+        electrode, start, end = interval_table(electrodes, times, decode_probs(encoded),
+                                               threshold)
+        keep = ~((self.intervals['model'] == model) & (self.intervals['seizure'] == seizure))
+        run = pd.DataFrame({'model': model, 'seizure': seizure, 'electrode': electrode,
+                            'start': start, 'end': end})
+        self.intervals = pd.concat([self.intervals[keep], run], ignore_index = True)
+        self._index()
+        self._save_intervals()
+
+    def load(self, model, seizure):
+        """
+        Returns (electrodes, times, float32 probabilities) of one run.
+        """
+        with np.load(self._run_path(model, seizure), allow_pickle = False) as f:
+            return list(f['electrodes']), f['times'], decode_probs(f['probs'])
+
+    def runs(self):
+        """
+        Returns (model, seizure) pairs of every stored run.
+        """
+        names = sorted(os.listdir(os.path.join(self.root, "runs")))
+        return [tuple(name[: -len(".npz")].split("--", 1)) for name in names
+                if name.endswith(".npz")]
+
+    def query(self, t0, t1, models = None, seizures = None):
+        """
+        Returns the intervals overlapping [t0, t1], optionally restricted to
+        some models and seizures.
+        """
+        # intervals starting after t1 are past stop; those before first can
+        # not reach t0 because no earlier interval ends at or after t0
+        stop = np.searchsorted(self._starts, t1, side = 'right')
+        first = np.searchsorted(self._max_ends, t0, side = 'left')
+        candidates = np.arange(first, max(first, stop))
+        candidates = candidates[self._ends[candidates] >= t0]
+        found = self.intervals.iloc[candidates]
+        if models is not None:
+            found = found[found['model'].isin(models)]
+        if seizures is not None:
+            found = found[found['seizure'].isin(seizures)]
+        return found
+
+    def seizing_electrodes(self, t0, t1, models = None, seizures = None):
+        """
+        Returns a DataFrame of the electrodes seizing at some point between t0
+        and t1, one row per model and seizure.
+        """
+        found = self.query(t0, t1, models, seizures)
+        grouped = found.groupby(['model', 'seizure'])['electrode']
+        return grouped.agg(lambda electrodes: sorted(set(electrodes))).reset_index()
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--root", type = str, default = "predictions",
+                help = "Prediction store directory.")
+    ap.add_argument("-s", "--start_time", type = int, required = True,
+                help = "Start of the queried range in usec.")
+    ap.add_argument("-e", "--end_time", type = int, required = True,
+                help = "End of the queried range in usec.")
+    ap.add_argument("-m", "--model_names", type = str, nargs = '+', default = None,
+                help = "Only report these models.")
+    ap.add_argument("-i", "--dataset_ids", type = str, nargs = '+', default = None,
+                help = "Only report these seizures.")
+    args = vars(ap.parse_args())
+
+    store = PredictionStore(args['root'])
+    print("Runs: %d, intervals: %d" % (len(store.runs()), len(store.intervals)))
+    seizing = store.seizing_electrodes(args['start_time'], args['end_time'],
+                                       args['model_names'], args['dataset_ids'])
+    for model, seizure, electrodes in zip(seizing['model'], seizing['seizure'],
+                                          seizing['electrode']):
+        print(model + " / " + seizure + ": " + ", ".join(electrodes))
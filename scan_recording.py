@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 25 10:12:37 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Scans a whole recording for candidate seizures instead of hand-picked
+# interictal and ictal ranges.
+#
+# The windows of the scanned range are split into --num_shards contiguous
+# shards, and --workers processes each fetch, preprocess and score one shard
+# at a time. A shard is read in blocks sized to --worker_memory_mb; every
+# block is fetched with PAD_SAMPLES extra samples on both sides so the
+# zero-phase filters of seizure_data.preprocess settle before the samples
+# that are kept, and windows crossing block or shard edges are scored once.
+#
+# Each finished shard is saved as <output_dir>/shard-<index>.npz. Running the
+# same command again skips shards already saved, so an interrupted scan
+# resumes where it stopped. Once all shards exist, window probabilities are
+# thresholded and merged into:
+# <output_dir>/detections.csv   electrode, start, end (usec), windows, max_prob
+# <output_dir>/candidates.csv   start, end (usec), electrodes
+# Window end times are the true sample times of the scanned range.
+#
+# Sample execution:
+# python scan_recording.py -u <username> -w <password> -d HUP172_phaseII -l labels/hup172-labels.csv -n 64 -j 4 -o scans/hup172
+# python scan_recording.py -f ../datasets/hup172-ictal.pickle -l labels/hup172-labels.csv -n 8 -j 2 -o scans/hup172-ictal
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import os
+import json
+import time
+import pickle
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from seizure_data import FS, DOWN_SAMPLE_FACTOR, get_labels, preprocess
+from batch_inference import load_predictor, create_windows
+from prediction_store import detect_intervals, model_sequence_len
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+NUM_SHARDS = 16
+NUM_WORKERS = 4
+WORKER_MEMORY_MB = 2048
+PAD_SAMPLES = 20 * FS
+# raw float64 samples held per block, relative to the fetched block itself:
+# filtfilt and decimate temporaries, the DataFrame copies and float32 windows
+MEMORY_OVERHEAD = 8
+THRESHOLD = 0.5
+MIN_ELECTRODES = 1
+
+
+# ------------------
+# SOURCES
+# ------------------
+def select_channels(channel_labels, path_labels):
+    """
+    Returns the channel labels kept for scanning: those in the labels csv
+    file, as in seizure_data.get_data, or all of them.
+    """
+    if path_labels is None:
+        return list(channel_labels)
+    labels_list = get_labels(path_labels)[0].tolist()
+    return [label for label in channel_labels if label in labels_list]
+
+class PickleSource:
+    """
+    Reads samples from a pickle saved by get_seizure_data.py.
+    """
+
+    def __init__(self, path, path_labels = None, start_time_usec = 0):
+        with open(path, 'rb') as f: data, fs = pickle.load(f)
+        self.channel_labels = select_channels(data.columns, path_labels)
+        self.data = np.asarray(data[self.channel_labels], dtype = np.float64)
+        self.fs = fs
+        self.start_time_usec = start_time_usec
+        self.num_samples = len(self.data)
+
+    def read(self, start, count):
+        return np.nan_to_num(self.data[start : start + count])
+
+class IeegSource:
+    """
+    Reads samples from a dataset on iEEG.org. Times are offsets in usec from
+    the recording start, as taken by Dataset.get_data and used in the labels.
+    """
+
+    def __init__(self, username, password, dataset_name, path_labels = None,
+                 start_time_usec = None, end_time_usec = None):
+        from ieeg.auth import Session
+        self.session = Session(username, password)
+        self.dataset = self.session.open_dataset(dataset_name)
+        self.channel_labels = select_channels(self.dataset.ch_labels, path_labels)
+        self.channel_indices = self.dataset.get_channel_indices(self.channel_labels)
+        self.fs = self.dataset.get_time_series_details(self.channel_labels[0]).sample_rate
+        if start_time_usec is None:
+            start_time_usec = 0
+        if end_time_usec is None:
+            end_time_usec = self.dataset.end_time - self.dataset.start_time
+        self.start_time_usec = int(start_time_usec)
+        self.num_samples = int((end_time_usec - start_time_usec) * self.fs / 1e6)
+
+    def read(self, start, count):
+        start_usec = self.start_time_usec + int(round(start * 1e6 / self.fs))
+        data = self.dataset.get_data(start_usec, int(round(count * 1e6 / self.fs)),
+                                     self.channel_indices)
+        data = np.nan_to_num(data[: count])
+        # the portal may return a sample fewer than requested
+        if len(data) < count:
+            data = np.pad(data, ((0, count - len(data)), (0, 0)), mode = 'edge')
+        return data
+
+def open_source(config):
+    if config['pickle_path'] is not None:
+        return PickleSource(config['pickle_path'], config['path_labels'],
+                            config['start_time_usec'] or 0)
+    return IeegSource(config['username'], config['password'], config['dataset_name'],
+                      config['path_labels'], config['start_time_usec'],
+                      config['end_time_usec'])
+
+
+# ------------------
+# SHARDS
+# ------------------
+def window_grid(num_samples, sequence_len, step_size = STEP_SIZE):
+    """
+    Returns the decimated end index of every window of a recording with
+    num_samples raw samples, as in batch_inference.create_windows.
+    """
+    num_decimated = num_samples // DOWN_SAMPLE_FACTOR
+    return np.arange(sequence_len, num_decimated, step_size, dtype = np.int64)
+
+def split_shards(ends, num_shards):
+    return [shard for shard in np.array_split(ends, num_shards) if len(shard)]
+
+def block_windows(num_channels, memory_bytes, step_size = STEP_SIZE):
+    """
+    Returns how many windows of one shard are scored per fetched block.
+    """
+    window_bytes = step_size * DOWN_SAMPLE_FACTOR * num_channels * 8 * MEMORY_OVERHEAD
+    return max(1, int(memory_bytes // window_bytes))
+
+def shard_path(output_dir, index):
+    return os.path.join(output_dir, "shard-%05d.npz" % index)
+
+def score_block(source, predictor, ends, sequence_len):
+    """
+    Returns electrodes x windows probabilities for windows ending at the
+    consecutive decimated indices ends.
+    """
+    q = DOWN_SAMPLE_FACTOR
+    first = (ends[0] - sequence_len) * q
+    last = ends[-1] * q
+    fetch_start = max(0, first - PAD_SAMPLES)
+    fetch_end = min(source.num_samples, last + PAD_SAMPLES)
+    raw = source.read(fetch_start, fetch_end - fetch_start)
+    decimated = np.asarray(preprocess(pd.DataFrame(raw, columns = source.channel_labels)))
+    # decimation keeps every q-th sample from fetch_start, which is aligned
+    # to the window grid because PAD_SAMPLES is a multiple of q
+    offset = (first - fetch_start) // q
+    kept = decimated[offset : offset + ends[-1] - ends[0] + sequence_len + 1]
+    chunks = (create_windows(kept[:, channel], sequence_len, STEP_SIZE)[: len(ends)]
+              for channel in range(kept.shape[1]))
+    return np.stack([preds.ravel() for preds in predictor.predict_stream(chunks)])
+
+def scan_shard(config, index, ends):
+    """
+    Scores the windows of one shard block by block and saves them.
+    """
+    source = open_source(config)
+    predictor = load_predictor(config['path_model'],
+                               memory_bytes = config['worker_memory_bytes'] // 4)
+    sequence_len = predictor.input_shape[0]
+    size = block_windows(len(source.channel_labels), config['worker_memory_bytes'] * 3 // 4)
+    probs = [score_block(source, predictor, ends[start : start + size], sequence_len)
+             for start in range(0, len(ends), size)]
+    path = shard_path(config['output_dir'], index)
+    # write then rename, so a killed worker never leaves a partial shard
+    with open(path + ".tmp", 'wb') as f:
+        np.savez(f, ends = ends, probs = np.hstack(probs).astype(np.float16))
+    os.replace(path + ".tmp", path)
+    return index
+
+def _scan_shard(job):
+    config, index, ends = job
+    start = time.perf_counter()
+    scan_shard(config, index, ends)
+    return index, time.perf_counter() - start
+
+
+# ------------------
+# DETECTIONS
+# ------------------
+def candidate_seizures(detections, min_electrodes = MIN_ELECTRODES):
+    """
+    Returns the union of overlapping electrode intervals, with the number of
+    electrodes involved in each.
+    """
+    rows = []
+    detections = detections.sort_values('start')
+    current = None
+    for start, end, electrode in zip(detections['start'], detections['end'],
+                                     detections['electrode']):
+        if current is not None and start <= current[1]:
+            current[1] = max(current[1], end)
+            current[2].add(electrode)
+            continue
+        if current is not None:
+            rows.append(current)
+        current = [start, end, {electrode}]
+    if current is not None:
+        rows.append(current)
+    rows = [(start, end, len(electrodes)) for start, end, electrodes in rows
+            if len(electrodes) >= min_electrodes]
+    return pd.DataFrame(rows, columns = ['start', 'end', 'electrodes'])
+
+
+# ------------------
+# JOB
+# ------------------
+def check_manifest(config, num_samples):
+    """
+    Saves the scan settings on the first run and refuses to resume into an
+    output directory written with different settings.
+    """
+    path = os.path.join(config['output_dir'], "manifest.json")
+    manifest = {key: config[key] for key in ['pickle_path', 'dataset_name', 'path_model',
+                                             'path_labels', 'start_time_usec',
+                                             'num_shards']}
+    manifest['num_samples'] = num_samples
+    if os.path.exists(path):
+        with open(path) as f: saved = json.load(f)
+        if saved != manifest:
+            raise ValueError("Output directory " + config['output_dir'] +
+                             " holds a scan with different settings")
+    else:
+        with open(path, 'w') as f: json.dump(manifest, f, indent = 1)
+
+def run_scan(config):
+    os.makedirs(config['output_dir'], exist_ok = True)
+    source = open_source(config)
+    if source.fs != FS:
+        raise ValueError("Expected data sampled at " + str(FS) + " Hz, got " + str(source.fs))
+    check_manifest(config, source.num_samples)
+    sequence_len = model_sequence_len(config['path_model'])
+    shards = split_shards(window_grid(source.num_samples, sequence_len), config['num_shards'])
+    jobs = [(config, index, ends) for index, ends in enumerate(shards)
+            if not os.path.exists(shard_path(config['output_dir'], index))]
+    print("Shards: %d total, %d already done" % (len(shards), len(shards) - len(jobs)))
+
+    # spawn, so workers do not inherit TensorFlow or portal sessions
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes = config['workers']) as pool:
+        for index, seconds in pool.imap_unordered(_scan_shard, jobs):
+            print("Shard %d done in %.1fs" % (index, seconds))
+
+    ends = []
+    probs = []
+    for index in range(len(shards)):
+        with np.load(shard_path(config['output_dir'], index)) as shard:
+            ends.append(shard['ends'])
+            probs.append(shard['probs'].astype(np.float32))
+    ends = np.concatenate(ends)
+    times = source.start_time_usec + (ends * DOWN_SAMPLE_FACTOR * 1e6 / FS).astype(np.int64)
+    detections = detect_intervals(np.hstack(probs), times, source.channel_labels,
+                                  sequence_len, config['threshold'])
+    candidates = candidate_seizures(detections, config['min_electrodes'])
+    detections.to_csv(os.path.join(config['output_dir'], "detections.csv"), index = False)
+    candidates.to_csv(os.path.join(config['output_dir'], "candidates.csv"), index = False)
+    return detections, candidates
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-u", "--username", type = str, default = None,
+                help = "iEEG.org username.")
+    ap.add_argument("-w", "--password", type = str, default = None,
+                help = "iEEG.org password.")
+    ap.add_argument("-d", "--dataset_name", type = str, default = None,
+                help = "iEEG.org dataset to scan.")
+    ap.add_argument("-f", "--pickle_path", type = str, default = None,
+                help = "Scan a pickle saved by get_seizure_data.py instead of iEEG.org.")
+    ap.add_argument("-a", "--start_time_usec", type = int, default = None,
+                help = "Start of the scanned range in usec from the recording start (default: 0).")
+    ap.add_argument("-z", "--end_time_usec", type = int, default = None,
+                help = "End of the scanned range in usec from the recording start (default: end of the recording).")
+    ap.add_argument("-l", "--path_labels", type = str, default = None,
+                help = "Labels csv file whose electrodes are scanned (default: all).")
+    ap.add_argument("-m", "--model_name", type = str, default = 'eeg-model-cnn-wavenet',
+                help = "Model name.")
+    ap.add_argument("-n", "--num_shards", type = int, default = NUM_SHARDS,
+                help = "Number of time shards.")
+    ap.add_argument("-j", "--workers", type = int, default = NUM_WORKERS,
+                help = "Number of worker processes.")
+    ap.add_argument("-r", "--worker_memory_mb", type = int, default = WORKER_MEMORY_MB,
+                help = "Approximate memory per worker for blocks and batches.")
+    ap.add_argument("-t", "--threshold", type = float, default = THRESHOLD,
+                help = "Probability above which a window is seizing.")
+    ap.add_argument("-e", "--min_electrodes", type = int, default = MIN_ELECTRODES,
+                help = "Electrodes needed for a candidate seizure.")
+    ap.add_argument("-o", "--output_dir", type = str, default = "scans",
+                help = "Directory for shard checkpoints and detections.")
+    args = vars(ap.parse_args())
+
+    if args['pickle_path'] is None and args['dataset_name'] is None:
+        ap.error("either --dataset_name or --pickle_path is required")
+    config = dict(args)
+    config['path_model'] = "models/" + args['model_name'] + ".pkl"
+    config['worker_memory_bytes'] = args['worker_memory_mb'] * 1024 * 1024
+
+    start = time.perf_counter()
+    detections, candidates = run_scan(config)
+    print("Scan finished in %.1fs: %d electrode intervals, %d candidate seizures" %
+          (time.perf_counter() - start, len(detections), len(candidates)))
+    print(candidates.to_string(index = False))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:18:22 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Data loading and preprocessing shared by the scripts that build on
+# create_predictions.py. Paths follow the same layout:
+# Interictal data must be stored as: ../datasets/<id>-interictal.pickle
+# Ictal data must be stored as: ../datasets/<id>-ictal.pickle
+# Labels csv file must be stored as: labels/<id>-labels.csv
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import os
+import pickle
+import tempfile
+import pandas as pd
+import numpy as np
+from scipy import signal
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+FS = 1024
+DOWN_SAMPLE_FACTOR = 10
+STEP_SIZE = 256
+SEQUENCE_LEN = 1024
+CUTOFF_LOW = 0.16
+CUTOFF_HIGH = 200
+NOTCH = 60
+
+DATASETS_DIR = "../datasets/"
+LABELS_DIR = "labels/"
+CACHE_DIR = "cache/"
+
+# (start interictal, end interictal, start ictal, end ictal) in usec, as
+# used by create_model.py (hup138) and create_predictions.py (hup172)
+SEIZURES = {
+    'hup138': (407898590000, 407998350000, 416039606029, 416112464960),
+    'hup172': (356850680000, 356903099171, 402704260829, 402756680000)
+}
+
+
+# ------------------
+# LOAD DATA
+# ------------------
+def get_paths(dataset_id, datasets_dir = DATASETS_DIR):
+    path_interictal = datasets_dir + dataset_id + "-interictal.pickle"
+    path_ictal = datasets_dir + dataset_id + "-ictal.pickle"
+    path_labels = LABELS_DIR + dataset_id + "-labels.csv"
+    return path_interictal, path_ictal, path_labels
+
+def get_labels(path_labels):
+    return pd.read_csv(path_labels, header = None)
+
+def get_data(path, path_labels):
+    with open(path, 'rb') as f: data, fs = pickle.load(f)
+    labels_list = get_labels(path_labels)[0].tolist()
+    data = data[data.columns.intersection(labels_list)]
+    return data
+
+def iEEG_data_filter(data, fs, cutoff1, cutoff2, notch):
+    column_names = data.columns
+    data = np.array(data)
+
+    # Cut-off frequency of the filter, normalised to Nyquist
+    w = np.array([cutoff1, cutoff2]) / (fs / 2)
+    b, a = signal.butter(4, w, 'bandpass')
+    filtered = signal.filtfilt(b, a, data, axis = 0)
+    filtered = filtered + (data[0] - filtered[0])
+
+    b, a = signal.iirnotch(notch, 30, fs)
+    notched = signal.filtfilt(b, a, filtered, axis = 0)
+    return pd.DataFrame(notched, columns = column_names)
+
+def preprocess(data):
+    """
+    Applies the bandpass and notch filters and decimates, as in
+    create_predictions.py.
+    """
+    data_filtered = iEEG_data_filter(data, FS, CUTOFF_LOW, CUTOFF_HIGH, NOTCH)
+    data_decimated = signal.decimate(data_filtered, DOWN_SAMPLE_FACTOR, axis = 0)
+    return pd.DataFrame(data_decimated, columns = data_filtered.columns)
+
+def load_seizure(dataset_id, datasets_dir = DATASETS_DIR):
+    """
+    Returns (data, split_point): the preprocessed interictal and ictal data
+    concatenated row-wise, and the number of interictal rows.
+    """
+    path_interictal, path_ictal, path_labels = get_paths(dataset_id, datasets_dir)
+    data_interictal = preprocess(get_data(path_interictal, path_labels))
+    data_ictal = preprocess(get_data(path_ictal, path_labels))
+    data = pd.concat([data_interictal, data_ictal], ignore_index = True)
+    return data, data_interictal.shape[0]
+
+def write_atomic(path, write):
+    """
+    Calls write with a binary file open on a temporary file of this process,
+    next to path, then replaces path with it. Concurrent writers of the same
+    path never share a partial file, and readers see the old or the new one.
+    """
+    with tempfile.NamedTemporaryFile(dir = os.path.dirname(path) or ".",
+                                     prefix = os.path.basename(path) + ".",
+                                     suffix = ".tmp", delete = False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+def load_seizure_cached(dataset_id, cache_dir = CACHE_DIR, datasets_dir = DATASETS_DIR):
+    """
+    Returns load_seizure(dataset_id), reusing the preprocessed data saved in
+    cache_dir while the source pickles and labels are unchanged.
+    """
+    path_interictal, path_ictal, path_labels = get_paths(dataset_id, datasets_dir)
+    sources = np.array([os.path.getmtime(path) for path in
+                        (path_interictal, path_ictal, path_labels)])
+    path_cache = os.path.join(cache_dir, dataset_id + ".npz")
+    if os.path.exists(path_cache):
+        with np.load(path_cache, allow_pickle = False) as f:
+            if np.array_equal(f['sources'], sources):
+                data = pd.DataFrame(f['data'], columns = list(f['columns']))
+                return data, int(f['split_point'])
+    data, split_point = load_seizure(dataset_id, datasets_dir)
+    os.makedirs(cache_dir, exist_ok = True)
+    write_atomic(path_cache, lambda f: np.savez(
+        f, data = np.asarray(data), columns = np.asarray(data.columns, dtype = str),
+        split_point = split_point, sources = sources))
+    return data, split_point
+
+
+# ------------------
+# TARGETS
+# ------------------
+def get_seizure_times(labels, column, start_time_ictal):
+    """
+    Returns the labelled (start, end) seizure times of an electrode.
+    Electrodes labelled '-' never seize; they get an empty range just after
+    the ictal start, as in create_merge_dataset.
+    """
+    col_data = labels.loc[labels[0] == column]
+    col_start_time = col_data.iat[0, 1]
+    col_end_time = col_data.iat[0, 2]
+    if(col_start_time == '-' or col_end_time == '-'):
+        return int(start_time_ictal + 1), int(start_time_ictal + 1)
+    return int(col_start_time), int(col_end_time)
+
+def window_end_times(start_time, num_samples, sequence_len = SEQUENCE_LEN,
+                     step_size = STEP_SIZE):
+    """
+    Returns the end time of every window in a segment, as computed by
+    create_merge_dataset.
+    """
+    ends = np.arange(sequence_len, num_samples, step_size, dtype = np.int64)
+    return start_time + ends * FS * DOWN_SAMPLE_FACTOR
+
+def create_merge_targets(data, split_point, path_labels, start_time_interictal,
+                         start_time_ictal, sequence_len = SEQUENCE_LEN,
+                         step_size = STEP_SIZE):
+    """
+    Returns the targets create_merge_dataset would return, without building
+    the window sequences.
+    """
+    labels = get_labels(path_labels)
+    times_interictal = window_end_times(start_time_interictal, split_point,
+                                        sequence_len, step_size)
+    times_ictal = window_end_times(start_time_ictal, data.shape[0] - split_point,
+                                   sequence_len, step_size)
+    times = np.concatenate((times_interictal, times_ictal))
+    targets = []
+    for column in data:
+        col_start_time, col_end_time = get_seizure_times(labels, column,
+                                                         start_time_ictal)
+        targets.append((times >= col_start_time) & (times <= col_end_time))
+    return np.concatenate(targets).astype(np.int64)
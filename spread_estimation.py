@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 24 09:47:55 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Turns per-electrode window probabilities into seizure onset and offset
+# times, recruitment order and spread latency.
+#
+# Probabilities are smoothed either with a median filter followed by
+# hysteresis thresholds, or with a two-state HMM decoded by Viterbi. Both run
+# on a rows x windows array, one row per electrode of every seizure, so many
+# seizures are processed in one pass; shorter seizures are padded with each
+# row's last probability, which the median filter with mode 'nearest' already
+# assumes, and Viterbi traces each row back from its own last window.
+#
+# An electrode's onset is the end time of its first seizing window and its
+# offset the end time of its last one, following the window timing of
+# create_merge_dataset. Latencies are relative to the earliest electrode of
+# the same seizure. Non-seizing electrodes get NaN times and order -1.
+#
+# The report compares the estimates with labels/<id>-labels.csv. Datasets
+# and labels must be laid out as described in create_predictions.py.
+#
+# Sample execution:
+# python spread_estimation.py -i hup138 hup172 -s hysteresis
+# python spread_estimation.py -i hup172 -s viterbi -b 5000
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import time
+import argparse
+import numpy as np
+from scipy import ndimage, stats
+
+from seizure_data import SEIZURES, load_seizure, get_paths, get_labels
+from seizure_data import get_seizure_times, window_end_times
+from batch_inference import load_predictor, create_windows
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+MEDIAN_WINDOWS = 5
+HIGH_THRESHOLD = 0.7
+LOW_THRESHOLD = 0.3
+SWITCH_PROB = 0.01
+CHUNK_ROWS = 4096
+SMOOTHERS = ['hysteresis', 'viterbi']
+
+
+# ------------------
+# SMOOTHING
+# ------------------
+def hysteresis(probs, high = HIGH_THRESHOLD, low = LOW_THRESHOLD,
+               median_windows = MEDIAN_WINDOWS, chunk_rows = CHUNK_ROWS):
+    """
+    Returns a boolean rows x windows array of seizing windows.
+
+    A row turns on when its median-filtered probability rises above high and
+    stays on until it falls below low. The latest on and off events are
+    found with running maxima, so there is no loop over windows.
+    """
+    probs = np.asarray(probs, dtype = np.float32)
+    states = np.empty(probs.shape, dtype = bool)
+    index = np.arange(probs.shape[1], dtype = np.int32)
+    for first in range(0, len(probs), chunk_rows):
+        chunk = probs[first : first + chunk_rows]
+        if median_windows > 1:
+            chunk = ndimage.median_filter(chunk, size = (1, median_windows),
+                                          mode = 'nearest')
+        last_on = np.maximum.accumulate(np.where(chunk > high, index, -1), axis = 1)
+        last_off = np.maximum.accumulate(np.where(chunk < low, index, -1), axis = 1)
+        states[first : first + chunk_rows] = last_on > last_off
+    return states
+
+def viterbi(probs, lengths = None, switch_prob = SWITCH_PROB):
+    """
+    Returns the most likely boolean rows x windows state sequence of a
+    two-state HMM whose emission likelihoods are the window probabilities.
+    If lengths is given, each row's path ends at its window lengths - 1 and
+    the states after it are meaningless.
+
+    With symmetric transitions the Viterbi recursion only needs the score
+    difference d between the seizing and non-seizing paths:
+    d[t] = clip(d[t - 1], -c, c) + log-odds[t], with c = log(stay / switch).
+    The best path into a state switched at t exactly when d[t - 1] was
+    clipped on the other side. Each step updates every row at once.
+    """
+    eps = np.finfo(np.float64).tiny
+    # windows x rows, so each step reads contiguous memory
+    probs = np.asarray(probs, dtype = np.float64).T
+    log_odds = np.log(probs + eps) - np.log(1.0 - probs + eps)
+    c = np.log(1.0 - switch_prob) - np.log(switch_prob)
+    diff = np.empty_like(log_odds)
+    diff[0] = log_odds[0]
+    for t in range(1, len(diff)):
+        np.clip(diff[t - 1], -c, c, out = diff[t])
+        diff[t] += log_odds[t]
+    last = np.full(diff.shape[1], len(diff) - 1) if lengths is None else np.asarray(lengths) - 1
+    states = np.empty(diff.shape, dtype = bool)
+    states[-1] = diff[-1] > 0
+    for t in range(len(diff) - 1, 0, -1):
+        switched = np.where(states[t], diff[t - 1] < -c, diff[t - 1] > c)
+        # rows ending at t - 1 start their backtrack there
+        states[t - 1] = np.where(last == t - 1, diff[t - 1] > 0, states[t] ^ switched)
+    return states.T
+
+def smooth(probs, smoother, lengths = None, **kwargs):
+    if smoother == 'hysteresis':
+        # causal past the median filter, so the edge padding needs no lengths
+        return hysteresis(probs, **kwargs)
+    if smoother == 'viterbi':
+        return viterbi(probs, lengths, **kwargs)
+    raise ValueError("Unknown smoother " + str(smoother))
+
+
+# ------------------
+# ONSET AND SPREAD
+# ------------------
+def pad_seizures(probs_list, times_list):
+    """
+    Stacks seizures of different lengths into one padded array.
+
+    :param probs_list: list of electrodes x windows probability arrays.
+    :param times_list: list of 1D window end time arrays.
+    :return: (probs, times, seizure, lengths) where probs is rows x max
+             windows (padded with each row's last probability), times holds
+             each row's end times (padded with the last time), seizure gives
+             each row's index into probs_list and lengths each row's number
+             of windows.
+    """
+    num_rows = sum(len(probs) for probs in probs_list)
+    num_windows = max(len(times) for times in times_list)
+    probs = np.zeros((num_rows, num_windows), dtype = np.float32)
+    times = np.zeros((num_rows, num_windows), dtype = np.int64)
+    seizure = np.zeros(num_rows, dtype = np.int64)
+    lengths = np.zeros(num_rows, dtype = np.int64)
+    row = 0
+    for i, (seizure_probs, seizure_times) in enumerate(zip(probs_list, times_list)):
+        rows = slice(row, row + len(seizure_probs))
+        probs[rows, : len(seizure_times)] = seizure_probs
+        probs[rows, len(seizure_times) :] = seizure_probs[:, -1 :]
+        times[rows, : len(seizure_times)] = seizure_times
+        times[rows, len(seizure_times) :] = seizure_times[-1]
+        seizure[rows] = i
+        lengths[rows] = len(seizure_times)
+        row += len(seizure_probs)
+    return probs, times, seizure, lengths
+
+def onset_offset(states, times):
+    """
+    Returns float64 (onset, offset) times per row, NaN where a row never
+    seizes.
+    """
+    seizing = states.any(axis = 1)
+    rows = np.arange(len(states))
+    first = np.argmax(states, axis = 1)
+    last = states.shape[1] - 1 - np.argmax(states[:, ::-1], axis = 1)
+    onset = np.where(seizing, times[rows, first], np.nan)
+    offset = np.where(seizing, times[rows, last], np.nan)
+    return onset, offset
+
+def recruitment(onset, seizure):
+    """
+    Returns (order, latency) per row: the rank of each electrode's onset
+    within its seizure (0 for the earliest, -1 if never seizing) and its
+    onset minus the seizure's earliest onset.
+    """
+    num_seizures = seizure.max() + 1 if len(seizure) else 0
+    earliest = np.full(num_seizures, np.inf)
+    recruited = ~np.isnan(onset)
+    np.minimum.at(earliest, seizure[recruited], onset[recruited])
+    latency = onset - earliest[seizure]
+    # sort by seizure, then onset; NaN onsets sort last within a seizure
+    ordered = np.lexsort((np.where(recruited, onset, np.inf), seizure))
+    starts = np.searchsorted(seizure[ordered], np.arange(num_seizures))
+    order = np.empty(len(onset), dtype = np.int64)
+    order[ordered] = np.arange(len(onset)) - starts[seizure[ordered]]
+    order[~recruited] = -1
+    return order, latency
+
+def estimate_spread(probs_list, times_list, smoother = 'hysteresis', **kwargs):
+    """
+    Returns a dict of per-row arrays: seizure, onset, offset, order and
+    latency, for every electrode of every seizure.
+    """
+    probs, times, seizure, lengths = pad_seizures(probs_list, times_list)
+    states = smooth(probs, smoother, lengths, **kwargs)
+    # padding never counts as seizing
+    states &= np.arange(states.shape[1]) < lengths[:, np.newaxis]
+    onset, offset = onset_offset(states, times)
+    order, latency = recruitment(onset, seizure)
+    return {'seizure': seizure, 'onset': onset, 'offset': offset,
+            'order': order, 'latency': latency}
+
+
+# ------------------
+# EVALUATION
+# ------------------
+def label_times(path_labels, columns, start_time_ictal):
+    """
+    Returns float64 labelled (onset, offset) times for columns, NaN for
+    electrodes labelled '-'.
+    """
+    labels = get_labels(path_labels)
+    onset = np.full(len(columns), np.nan)
+    offset = np.full(len(columns), np.nan)
+    for i, column in enumerate(columns):
+        col_start_time, col_end_time = get_seizure_times(labels, column, start_time_ictal)
+        if col_end_time > col_start_time:
+            onset[i], offset[i] = col_start_time, col_end_time
+    return onset, offset
+
+def compare_labels(estimate, label_onset, label_offset):
+    """
+    Returns recruitment accuracy, onset and offset errors in seconds, and the
+    Spearman correlation of estimated and labelled onset order, for one
+    seizure.
+    """
+    recruited = ~np.isnan(estimate['onset'])
+    labelled = ~np.isnan(label_onset)
+    both = recruited & labelled
+    report = {'electrodes': len(recruited),
+              'labelled_recruited': int(np.sum(labelled)),
+              'estimated_recruited': int(np.sum(recruited)),
+              'recruitment_accuracy': np.mean(recruited == labelled)}
+    if np.any(both):
+        report['onset_mae_s'] = np.mean(np.abs(estimate['onset'][both] -
+                                               label_onset[both])) / 1e6
+        report['offset_mae_s'] = np.mean(np.abs(estimate['offset'][both] -
+                                                label_offset[both])) / 1e6
+    if np.sum(both) > 1:
+        report['order_spearman'] = stats.spearmanr(estimate['onset'][both],
+                                                   label_onset[both])[0]
+    return report
+
+def predict_ictal(predictor, data, split_point, start_time_ictal):
+    """
+    Returns (electrodes x windows probabilities, window end times) for the
+    ictal segment.
+    """
+    sequence_len = predictor.input_shape[0]
+    chunks = (create_windows(np.asarray(data[column], dtype = np.float32)[split_point :],
+                             sequence_len, STEP_SIZE) for column in data)
+    probs = np.stack([preds.ravel() for preds in predictor.predict_stream(chunks)])
+    times = window_end_times(start_time_ictal, data.shape[0] - split_point,
+                             sequence_len, STEP_SIZE)
+    return probs, times
+
+def benchmark(probs, times, num_seizures, smoother, rng):
+    """
+    Returns seconds taken to estimate spread for num_seizures copies of one
+    seizure with randomly jittered lengths.
+    """
+    probs_list = []
+    times_list = []
+    for _ in range(num_seizures):
+        length = rng.randint(len(times) // 2, len(times) + 1)
+        probs_list.append(probs[:, : length])
+        times_list.append(times[: length])
+    start = time.perf_counter()
+    estimate_spread(probs_list, times_list, smoother)
+    return time.perf_counter() - start
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--dataset_ids", type = str, nargs = '+',
+                default = ['hup138', 'hup172'],
+                help = "Datasets to evaluate.")
+    ap.add_argument("-m", "--model_name", type = str, default = 'eeg-model-cnn-wavenet',
+                help = "Model name.")
+    ap.add_argument("-s", "--smoother", type = str, default = 'hysteresis',
+                choices = SMOOTHERS,
+                help = "Smoothing applied to window probabilities.")
+    ap.add_argument("-b", "--benchmark_seizures", type = int, default = 0,
+                help = "If set, also times estimation on this many copies of each seizure.")
+    args = vars(ap.parse_args())
+
+    predictor = load_predictor("models/" + args['model_name'] + ".pkl")
+    probs_list = []
+    times_list = []
+    labels_list = []
+    for dataset_id in args['dataset_ids']:
+        start_ictal = SEIZURES[dataset_id][2]
+        data, split_point = load_seizure(dataset_id)
+        probs, times = predict_ictal(predictor, data, split_point, start_ictal)
+        probs_list.append(probs)
+        times_list.append(times)
+        labels_list.append((data.columns,
+                            label_times(get_paths(dataset_id)[2], data.columns, start_ictal)))
+
+    start = time.perf_counter()
+    estimate = estimate_spread(probs_list, times_list, args['smoother'])
+    elapsed = time.perf_counter() - start
+    print("Estimated spread for %d seizures in %.3fs" % (len(probs_list), elapsed))
+
+    for i, dataset_id in enumerate(args['dataset_ids']):
+        rows = estimate['seizure'] == i
+        seizure_estimate = {key: value[rows] for key, value in estimate.items()}
+        columns, (label_onset, label_offset) = labels_list[i]
+        report = compare_labels(seizure_estimate, label_onset, label_offset)
+        print("Dataset: " + dataset_id)
+        for key, value in report.items():
+            print("  " + key + ": " + str(value))
+        print("  electrode  order  latency_s  label_latency_s")
+        label_earliest = np.nanmin(label_onset) if np.any(~np.isnan(label_onset)) else np.nan
+        for j in np.argsort(np.where(seizure_estimate['order'] < 0, np.inf,
+                                     seizure_estimate['order']), kind = 'stable'):
+            print("  %9s  %5d  %9.2f  %15.2f" %
+                  (str(columns[j]).strip('\ufeff'), seizure_estimate['order'][j],
+                   seizure_estimate['latency'][j] / 1e6,
+                   (label_onset[j] - label_earliest) / 1e6))
+
+        if args['benchmark_seizures']:
+            seconds = benchmark(probs_list[i], times_list[i], args['benchmark_seizures'],
+                                args['smoother'], np.random.RandomState(0))
+            print("  %d seizures x %d electrodes: %.2fs" %
+                  (args['benchmark_seizures'], len(columns), seconds))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 09:47:55 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Streaming seizure detection. Samples arrive in chunks from a feed, are
+# bandpass/notch filtered and decimated incrementally, and every STEP_SIZE
+# decimated samples each electrode's last SEQUENCE_LEN samples are scored.
+#
+# The offline chain in create_predictions.py uses filtfilt and decimate,
+# which are zero-phase and need the whole recording. Here the same filters
+# run causally with their state carried between chunks, so outputs are
+# delayed by the filters' group delay but never wait for future samples.
+#
+# Feeds:
+#   SyntheticFeed  random noise, a local stand-in for a live recording
+#   PickleFeed     replays a pickle saved by get_seizure_data.py
+#   DatasetFeed    polls ieeg.dataset.Dataset.get_data at the live edge
+#
+# If scoring falls behind by more than --latency_budget_ms, intermediate
+# windows are skipped and only the newest window of each electrode is scored
+# until the pipeline catches up.
+#
+# Sample execution (benchmark on 128 synthetic channels):
+# python stream_detection.py --feed synthetic -n 128 -s 120
+#
+# Sample execution (live iEEG dataset, from its current end):
+# python stream_detection.py --feed dataset -u <username> -w <password> -d <dataset> -t -1
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import time
+import pickle
+import argparse
+import numpy as np
+from scipy import signal
+
+from keras.models import load_model
+
+from wavenet_inference import StreamingWaveNet
+from batch_inference import ResidentPredictor
+from ieeg.auth import Session
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+FS = 1024
+DOWN_SAMPLE_FACTOR = 10
+STEP_SIZE = 256
+SEQUENCE_LEN = 1024
+CUTOFF_LOW = 0.16
+CUTOFF_HIGH = 200
+NOTCH = 60
+
+CHUNK_SAMPLES = 1024
+LATENCY_BUDGET_MS = 1000.0
+POLL_INTERVAL = 1.0
+PATH_MODEL = "models/eeg-model-cnn-wavenet.pkl"
+
+
+# ------------------
+# FEEDS
+# ------------------
+class SyntheticFeed:
+    """
+    Yields (arrival time, samples x channels chunk) of Gaussian noise.
+    With realtime set, chunks arrive at the rate they would be recorded.
+    """
+
+    def __init__(self, num_channels, duration_sec, chunk_samples = CHUNK_SAMPLES,
+                 fs = FS, realtime = False, seed = 0):
+        self.num_channels = num_channels
+        self.num_chunks = int(duration_sec * fs / chunk_samples)
+        self.chunk_samples = chunk_samples
+        self.fs = fs
+        self.realtime = realtime
+        self.rng = np.random.RandomState(seed)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for index in range(self.num_chunks):
+            if self.realtime:
+                due = start + (index + 1) * self.chunk_samples / self.fs
+                time.sleep(max(0.0, due - time.perf_counter()))
+            chunk = 50.0 * self.rng.standard_normal((self.chunk_samples,
+                                                     self.num_channels))
+            yield time.perf_counter(), chunk
+
+
+class PickleFeed:
+    """
+    Replays the [DataFrame, fs] pickle written by get_seizure_data.py.
+    """
+
+    def __init__(self, path, chunk_samples = CHUNK_SAMPLES, realtime = False):
+        with open(path, 'rb') as f: data, fs = pickle.load(f)
+        self.channel_labels = list(data.columns)
+        self.data = np.array(data)
+        self.num_channels = self.data.shape[1]
+        self.fs = fs
+        self.chunk_samples = chunk_samples
+        self.realtime = realtime
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for index, offset in enumerate(range(0, len(self.data), self.chunk_samples)):
+            if self.realtime:
+                due = start + (index + 1) * self.chunk_samples / self.fs
+                time.sleep(max(0.0, due - time.perf_counter()))
+            yield time.perf_counter(), self.data[offset : offset + self.chunk_samples]
+
+
+class DatasetFeed:
+    """
+    Polls an ieeg.dataset.Dataset for new samples.
+
+    Times are offsets in usec from the recording start, as taken by
+    Dataset.get_data. get_end_time is called to find the live edge of the
+    recording as such an offset, and defaults to the recording's duration
+    when the dataset was opened. A chunk is only requested once it lies
+    entirely behind the edge.
+    """
+
+    def __init__(self, dataset, channel_labels, start_time_usec,
+                 chunk_samples = CHUNK_SAMPLES, fs = FS, get_end_time = None,
+                 poll_interval = POLL_INTERVAL, duration_usec = None):
+        self.dataset = dataset
+        self.channel_labels = channel_labels
+        self.channel_indices = dataset.get_channel_indices(channel_labels)
+        self.num_channels = len(channel_labels)
+        self.cursor = start_time_usec
+        self.chunk_usec = int(chunk_samples * 1e6 / fs)
+        self.get_end_time = get_end_time or (lambda: dataset.end_time - dataset.start_time)
+        self.poll_interval = poll_interval
+        self.stop_usec = None if duration_usec is None else start_time_usec + duration_usec
+
+    def __iter__(self):
+        while self.stop_usec is None or self.cursor < self.stop_usec:
+            if self.cursor + self.chunk_usec > self.get_end_time():
+                time.sleep(self.poll_interval)
+                continue
+            chunk = self.dataset.get_data(self.cursor, self.chunk_usec,
+                                          self.channel_indices)
+            self.cursor += self.chunk_usec
+            yield time.perf_counter(), np.nan_to_num(chunk)
+
+
+# ------------------
+# PREPROCESSING
+# ------------------
+class StreamingPreprocessor:
+    """
+    Causal version of the bandpass, notch and decimate chain in
+    create_predictions.py, with filter state carried between chunks.
+    """
+
+    def __init__(self, num_channels, fs = FS, cutoff1 = CUTOFF_LOW,
+                 cutoff2 = CUTOFF_HIGH, notch = NOTCH, q = DOWN_SAMPLE_FACTOR):
+        bandpass = signal.butter(4, [cutoff1, cutoff2], 'bandpass', fs = fs,
+                                 output = 'sos')
+        b, a = signal.iirnotch(notch, 30, fs)
+        # the same anti-aliasing filter scipy.signal.decimate uses
+        antialias = signal.cheby1(8, 0.05, 0.8 / q, output = 'sos')
+        self.sos = np.vstack((bandpass, signal.tf2sos(b, a), antialias))
+        self.zi = np.zeros((self.sos.shape[0], 2, num_channels))
+        self.q = q
+        self.samples_seen = 0
+        self.offset = None
+
+    def process(self, chunk):
+        """
+        Returns the decimated samples x channels produced by chunk.
+        """
+        chunk = np.asarray(chunk, dtype = np.float64)
+        if self.offset is None:
+            # create_predictions.py shifts the filtered signal to start at
+            # the first raw sample; keep that offset for the whole stream
+            self.offset = chunk[0].copy()
+        filtered, self.zi = signal.sosfilt(self.sos, chunk, axis = 0, zi = self.zi)
+        first = (-self.samples_seen) % self.q
+        self.samples_seen += len(chunk)
+        return filtered[first :: self.q] + self.offset
+
+
+# ------------------
+# DETECTION
+# ------------------
+class WindowDetector:
+    """
+    Keeps each electrode's last sequence_len decimated samples in a ring
+    buffer and scores all electrodes in one batch every step_size samples.
+    Works with any model in models/.
+    """
+
+    def __init__(self, predictor, num_channels, step_size = STEP_SIZE):
+        self.predictor = predictor
+        self.sequence_len = predictor.input_shape[0]
+        self.step_size = step_size
+        self.buffer = np.zeros((num_channels, self.sequence_len), dtype = np.float32)
+        self.num_samples = 0
+
+    def push(self, samples, latest_only = False):
+        """
+        Adds decimated samples x channels and returns a list of
+        (decimated sample count, probabilities) for every window that ended.
+        """
+        due = []
+        for row in samples:
+            self.buffer[:, self.num_samples % self.sequence_len] = row
+            self.num_samples += 1
+            if (self.num_samples >= self.sequence_len and
+                (self.num_samples - self.sequence_len) % self.step_size == 0):
+                order = (self.num_samples + np.arange(self.sequence_len)) % self.sequence_len
+                due.append((self.num_samples, self.buffer[:, order]))
+        if latest_only:
+            due = due[-1:]
+        if not due:
+            return []
+        windows = np.concatenate([w for _, w in due])[:, :, np.newaxis]
+        probs = self.predictor.predict_batches(windows).reshape(len(due), -1)
+        return [(end, p) for (end, _), p in zip(due, probs)]
+
+
+class StreamingWaveNetDetector:
+    """
+    Scores electrodes with StreamingWaveNet, which costs one step per layer
+    for each new sample instead of a full window every step_size samples.
+    """
+
+    def __init__(self, model, num_channels, step_size = STEP_SIZE, exact = False):
+        self.engine = StreamingWaveNet(model, num_channels = num_channels,
+                                       exact = exact)
+        self.step_size = step_size
+
+    def push(self, samples, latest_only = False):
+        emitted = self.engine.process(np.asarray(samples).T, self.step_size)
+        return emitted[-1:] if latest_only else emitted
+
+
+# ------------------
+# PIPELINE
+# ------------------
+def run_pipeline(feed, preprocessor, detector, latency_budget_ms = LATENCY_BUDGET_MS,
+                 on_emit = None):
+    """
+    Runs feed through preprocessor and detector. Calls on_emit(end, probs,
+    latency_sec) for every scored window and returns pipeline statistics.
+
+    Latency is measured from the arrival of the chunk that completed a window
+    to the emission of its probabilities.
+    """
+    budget = latency_budget_ms / 1000.0
+    latencies = []
+    chunk_times = []
+    skipped = 0
+    behind = False
+    raw_samples = 0
+    start = time.perf_counter()
+    for arrival, chunk in feed:
+        raw_samples += len(chunk)
+        decimated = preprocessor.process(chunk)
+        emitted = detector.push(decimated, latest_only = behind)
+        done = time.perf_counter()
+        latency = done - arrival
+        chunk_times.append(latency)
+        for end, probs in emitted:
+            latencies.append(latency)
+            if on_emit:
+                on_emit(end, probs, latency)
+        if behind and latency <= budget:
+            behind = False
+        elif latency > budget:
+            behind = True
+            skipped += 1
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000.0
+    chunk_times = np.array(chunk_times) * 1000.0
+    stats = {'chunks': len(chunk_times),
+             'windows_emitted': len(latencies),
+             'chunks_over_budget': skipped,
+             'signal_seconds': raw_samples / float(FS),
+             'wall_seconds': elapsed}
+    if len(chunk_times):
+        stats['chunk_p50_ms'] = float(np.percentile(chunk_times, 50))
+        stats['chunk_p99_ms'] = float(np.percentile(chunk_times, 99))
+        stats['realtime_factor'] = stats['signal_seconds'] / elapsed
+    if len(latencies):
+        stats['emit_p50_ms'] = float(np.percentile(latencies, 50))
+        stats['emit_p99_ms'] = float(np.percentile(latencies, 99))
+        stats['emit_max_ms'] = float(np.max(latencies))
+    return stats
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--feed", type = str, default = 'synthetic',
+                choices = ['synthetic', 'pickle', 'dataset'],
+                help = "Sample source.")
+    ap.add_argument("-p", "--path", type = str, default = None,
+                help = "Pickle to replay with --feed pickle.")
+    ap.add_argument("-n", "--num_channels", type = int, default = 128,
+                help = "Number of synthetic channels.")
+    ap.add_argument("-s", "--seconds", type = float, default = 120.0,
+                help = "Seconds of synthetic or dataset signal.")
+    ap.add_argument("-u", "--username", type = str, default = None,
+                help = "iEEG.org username for --feed dataset.")
+    ap.add_argument("-w", "--password", type = str, default = None,
+                help = "iEEG.org password for --feed dataset.")
+    ap.add_argument("-d", "--dataset_name", type = str, default = None,
+                help = "iEEG.org dataset polled with --feed dataset.")
+    ap.add_argument("-t", "--start_time", type = int, default = None,
+                help = "Start offset in usec from the recording start for --feed dataset, -1 for the live edge. Defaults to 0.")
+    ap.add_argument("-m", "--model_path", type = str, default = PATH_MODEL,
+                help = "Model used for scoring.")
+    ap.add_argument("-e", "--engine", type = str, default = 'streaming',
+                choices = ['streaming', 'window'],
+                help = "Incremental WaveNet or batched windows (any model).")
+    ap.add_argument("-b", "--latency_budget_ms", type = float, default = LATENCY_BUDGET_MS,
+                help = "Latency above which intermediate windows are skipped.")
+    ap.add_argument("-r", "--realtime", action = "store_true",
+                help = "Deliver chunks at the recording rate instead of as fast as possible.")
+    args = vars(ap.parse_args())
+
+    if args['feed'] == 'pickle':
+        feed = PickleFeed(args['path'], realtime = args['realtime'])
+    elif args['feed'] == 'dataset':
+        session = Session(args['username'], args['password'])
+        dataset = session.open_dataset(args['dataset_name'])
+        start_time = args['start_time']
+        get_end_time = None
+        if start_time is None:
+            start_time = 0
+        elif start_time < 0:
+            # reopen the dataset to see samples recorded since it was opened
+            start_time = dataset.end_time - dataset.start_time
+            def get_end_time():
+                reopened = session.open_dataset(args['dataset_name'])
+                return reopened.end_time - reopened.start_time
+        feed = DatasetFeed(dataset, dataset.ch_labels, start_time,
+                           get_end_time = get_end_time,
+                           duration_usec = int(args['seconds'] * 1e6))
+    else:
+        feed = SyntheticFeed(args['num_channels'], args['seconds'],
+                             realtime = args['realtime'])
+
+    model = load_model(args['model_path'])
+    if args['engine'] == 'streaming':
+        detector = StreamingWaveNetDetector(model, feed.num_channels)
+    else:
+        detector = WindowDetector(ResidentPredictor(model), feed.num_channels)
+    preprocessor = StreamingPreprocessor(feed.num_channels)
+
+    stats = run_pipeline(feed, preprocessor, detector, args['latency_budget_ms'])
+    print("Channels: " + str(feed.num_channels))
+    for key, value in stats.items():
+        print(key + ": " + (("%.2f" % value) if isinstance(value, float) else str(value)))
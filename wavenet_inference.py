@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:05 2026
+
+@author: jaisi8631
+"""
+
+# ------------------
+# NOTES
+# ------------------
+# Inference helpers for the WaveNet CNN built by create_wavenet_cnn_model in
+# create_model.py. The model is a valid Conv1D front end, a stack of causal
+# dilated Conv1D layers, a 1x1 Conv1D, GlobalAveragePooling1D and a sigmoid
+# Dense layer. Everything before the pooling is translation equivariant, so the
+# convolutional stack can be run once over a whole decimated channel and the
+# per-window outputs recovered from cumulative sums of its features.
+#
+# The only positions where a window differs from the whole-channel pass are
+# the first few of each window, where causal padding feeds zeros instead of
+# the preceding samples. Those positions are recomputed per window on a short
+# slice, which keeps the dense result equal to model.predict on the windows.
+#
+# StreamingWaveNet applies the same idea one decimated sample at a time. Each
+# Conv1D keeps a ring buffer of the inputs its dilated taps still need, so a
+# new sample costs one small matrix product per layer, and the pooled window
+# features are a running sum over a ring of the last window's features.
+
+
+# ------------------
+# REGULAR IMPORTS
+# ------------------
+import numpy as np
+
+from keras.models import Sequential
+from keras.models import load_model
+from keras.layers import InputLayer
+from keras.layers import Conv1D
+from keras.layers import GlobalAveragePooling1D
+from keras.layers import Dense
+
+
+# ------------------
+# CONSTANTS
+# ------------------
+STEP_SIZE = 256
+SEQUENCE_LEN = 1024
+PATH_MODEL = "models/eeg-model-cnn-wavenet.pkl"
+
+
+# ------------------
+# MODEL SPLITTING
+# ------------------
+def get_conv_layers(model):
+    """
+    Returns the layers of model that come before the global pooling layer.
+    """
+    layers = []
+    for layer in model.layers:
+        if isinstance(layer, GlobalAveragePooling1D):
+            return layers
+        layers.append(layer)
+    raise ValueError("Model has no GlobalAveragePooling1D layer")
+
+def get_dense_layer(model):
+    """
+    Returns the sigmoid Dense layer that follows the global pooling layer.
+    """
+    dense_layers = [layer for layer in model.layers if isinstance(layer, Dense)]
+    if len(dense_layers) != 1:
+        raise ValueError("Expected exactly one Dense layer, found " +
+                         str(len(dense_layers)))
+    return dense_layers[0]
+
+def get_receptive_field(conv_layers):
+    """
+    Returns (valid_trim, causal_context) for the convolutional stack.
+
+    valid_trim is the number of samples lost to 'valid' convolutions and
+    causal_context is the number of leading positions in each window that
+    are affected by causal zero padding.
+    """
+    valid_trim = 0
+    causal_context = 0
+    for layer in conv_layers:
+        if not isinstance(layer, Conv1D):
+            continue
+        span = (layer.kernel_size[0] - 1) * layer.dilation_rate[0]
+        if layer.padding == 'valid':
+            valid_trim += span
+        elif layer.padding == 'causal':
+            causal_context += span
+        else:
+            raise ValueError("Unsupported padding: " + layer.padding)
+    return valid_trim, causal_context
+
+def create_conv_stack(model):
+    """
+    Returns a copy of the layers of model before global pooling that accepts
+    sequences of any length.
+    """
+    stack = Sequential()
+    stack.add(InputLayer(input_shape = (None, 1)))
+    for layer in get_conv_layers(model):
+        config = layer.get_config()
+        config.pop('batch_input_shape', None)
+        stack.add(layer.__class__.from_config(config))
+    for src, dst in zip(get_conv_layers(model), stack.layers):
+        dst.set_weights(src.get_weights())
+    return stack
+
+
+# ------------------
+# DENSE INFERENCE
+# ------------------
+class DenseWaveNet:
+    """
+    Runs the WaveNet convolutional stack once per channel and returns the
+    probabilities model.predict would give for windows of sequence_len samples
+    taken every step_size samples.
+    """
+
+    def __init__(self, model, sequence_len = SEQUENCE_LEN, step_size = STEP_SIZE):
+        self.sequence_len = sequence_len
+        self.step_size = step_size
+        self.stack = create_conv_stack(model)
+        self.valid_trim, self.causal_context = get_receptive_field(
+            get_conv_layers(model))
+        self.positions = sequence_len - self.valid_trim
+        kernel, bias = get_dense_layer(model).get_weights()
+        self.kernel = kernel.astype(np.float64)
+        self.bias = bias.astype(np.float64)
+
+    @classmethod
+    def from_path(cls, path = PATH_MODEL, **kwargs):
+        return cls(load_model(path), **kwargs)
+
+    def window_ends(self, num_samples):
+        """
+        Returns the exclusive end index of every window, matching
+        range(SEQUENCE_LEN, num_samples, STEP_SIZE) in create_merge_dataset.
+        """
+        return np.arange(self.sequence_len, num_samples, self.step_size)
+
+    def predict_features(self, channels):
+        """
+        Returns the pooled (pre-Dense) features of every window.
+
+        :param channels: 2D array, rows = channels, columns = samples.
+        :return: 3D array, channels x windows x features.
+        """
+        channels = np.asarray(channels, dtype = np.float32)
+        num_channels, num_samples = channels.shape
+        starts = self.window_ends(num_samples) - self.sequence_len
+        if len(starts) == 0:
+            return np.zeros((num_channels, 0, self.kernel.shape[0]))
+
+        # whole-channel pass, with a leading zero row for the cumulative sum
+        features = self.stack.predict(channels[:, :, np.newaxis])
+        cumulative = np.zeros((num_channels, features.shape[1] + 1,
+                               features.shape[2]))
+        np.cumsum(features, axis = 1, dtype = np.float64, out = cumulative[:, 1:])
+        body = (cumulative[:, starts + self.positions] -
+                cumulative[:, starts + self.causal_context])
+
+        # recompute the positions where causal padding differs per window
+        head_len = self.causal_context + self.valid_trim
+        head_index = starts[:, np.newaxis] + np.arange(head_len)
+        heads = channels[:, head_index].reshape(-1, head_len, 1)
+        head = self.stack.predict(heads).sum(axis = 1, dtype = np.float64)
+        head = head.reshape(num_channels, len(starts), -1)
+
+        return (body + head) / self.positions
+
+    def predict(self, channels):
+        """
+        Returns the seizure probability of every window.
+
+        :param channels: 2D array, rows = channels, columns = samples.
+        :return: 2D array, channels x windows.
+        """
+        pooled = self.predict_features(channels)
+        logits = np.dot(pooled, self.kernel)[..., 0] + self.bias[0]
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def predict_classes(self, channels):
+        return (self.predict(channels) > 0.5).astype(np.int32)
+
+
+# ------------------
+# STREAMING INFERENCE
+# ------------------
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0.0),
+    'linear': lambda x: x
+}
+
+class StreamingConv1D:
+    """
+    A Conv1D layer evaluated one time step at a time for several channels.
+
+    Keeps a ring buffer of the last (kernel_size - 1) * dilation_rate + 1
+    inputs per channel. Causal layers start from zeros, like causal padding
+    at the start of a sequence. Valid layers return None until the buffer
+    has filled.
+    """
+
+    def __init__(self, kernel, bias, dilation_rate, padding, activation,
+                 num_channels):
+        if activation not in ACTIVATIONS:
+            raise ValueError("Unsupported activation: " + activation)
+        self.kernel = kernel.astype(np.float64)
+        self.bias = bias.astype(np.float64)
+        self.dilation_rate = dilation_rate
+        self.padding = padding
+        self.activation = ACTIVATIONS[activation]
+        kernel_size = kernel.shape[0]
+        self.span = (kernel_size - 1) * dilation_rate
+        self.buffer = np.zeros((num_channels, self.span + 1, kernel.shape[1]))
+        self.lags = (kernel_size - 1 - np.arange(kernel_size)) * dilation_rate
+        self.steps = 0
+
+    @classmethod
+    def from_layer(cls, layer, num_channels):
+        kernel, bias = layer.get_weights()
+        return cls(kernel, bias, layer.dilation_rate[0], layer.padding,
+                   layer.get_config()['activation'], num_channels)
+
+    def step(self, x):
+        """
+        Pushes one input per channel and returns the layer output at that step.
+
+        :param x: 2D array, channels x input features.
+        :return: 2D array, channels x output features, or None.
+        """
+        size = self.span + 1
+        self.buffer[:, self.steps % size] = x
+        self.steps += 1
+        if self.padding == 'valid' and self.steps < size:
+            return None
+        taps = self.buffer[:, (self.steps - 1 - self.lags) % size]
+        out = np.tensordot(taps, self.kernel, axes = ([1, 2], [0, 1]))
+        return self.activation(out + self.bias)
+
+    def apply(self, x):
+        """
+        Applies the layer to whole sequences.
+
+        :param x: 3D array, channels x time x input features.
+        :return: 3D array, channels x time x output features.
+        """
+        if self.padding == 'causal':
+            x = np.concatenate((np.zeros((x.shape[0], self.span, x.shape[2])), x),
+                               axis = 1)
+        length = x.shape[1] - self.span
+        out = np.zeros((x.shape[0], length, self.kernel.shape[2]))
+        for tap, lag in enumerate(self.lags):
+            start = self.span - lag
+            out += np.dot(x[:, start : start + length], self.kernel[tap])
+        return self.activation(out + self.bias)
+
+
+class StreamingWaveNet:
+    """
+    Incremental WaveNet inference over one or more channels of decimated iEEG.
+
+    Every call to update costs one step per Conv1D layer, independent of the
+    window length. probabilities returns the seizure probability of the last
+    sequence_len samples of each channel. With exact set, the leading window
+    positions affected by causal padding are recomputed so the result matches
+    model.predict on that window. Without it, those positions keep the context
+    of the preceding samples, which is cheaper and arguably better for a
+    continuous stream.
+    """
+
+    def __init__(self, model, num_channels = 1, sequence_len = SEQUENCE_LEN,
+                 exact = True):
+        conv_layers = [layer for layer in get_conv_layers(model)
+                       if isinstance(layer, Conv1D)]
+        self.layers = [StreamingConv1D.from_layer(layer, num_channels)
+                       for layer in conv_layers]
+        self.head_layers = [StreamingConv1D.from_layer(layer, 1)
+                            for layer in conv_layers]
+        self.valid_trim, self.causal_context = get_receptive_field(conv_layers)
+        self.sequence_len = sequence_len
+        self.positions = sequence_len - self.valid_trim
+        self.exact = exact
+        kernel, bias = get_dense_layer(model).get_weights()
+        self.kernel = kernel.astype(np.float64)
+        self.bias = bias.astype(np.float64)
+
+        self.num_channels = num_channels
+        self.samples = np.zeros((num_channels, sequence_len))
+        self.features = np.zeros((num_channels, self.positions, self.kernel.shape[0]))
+        self.feature_sum = np.zeros((num_channels, self.kernel.shape[0]))
+        self.num_samples = 0
+        self.num_features = 0
+
+    @classmethod
+    def from_path(cls, path = PATH_MODEL, **kwargs):
+        return cls(load_model(path), **kwargs)
+
+    def ready(self):
+        return self.num_samples >= self.sequence_len
+
+    def update(self, samples):
+        """
+        Pushes one new decimated sample per channel.
+
+        :param samples: 1D array with one value per channel.
+        """
+        samples = np.asarray(samples, dtype = np.float64)
+        self.samples[:, self.num_samples % self.sequence_len] = samples
+        self.num_samples += 1
+
+        x = samples[:, np.newaxis]
+        for layer in self.layers:
+            x = layer.step(x)
+            if x is None:
+                return
+
+        slot = self.num_features % self.positions
+        self.feature_sum += x - self.features[:, slot]
+        self.features[:, slot] = x
+        self.num_features += 1
+        # recompute the running sum once per lap to stop rounding drift
+        if slot == self.positions - 1:
+            self.feature_sum = self.features.sum(axis = 1)
+
+    def window(self):
+        """
+        Returns the last sequence_len samples of each channel, oldest first.
+        """
+        order = (self.num_samples + np.arange(self.sequence_len)) % self.sequence_len
+        return self.samples[:, order]
+
+    def pooled_features(self):
+        pooled = self.feature_sum
+        if self.exact:
+            oldest = (self.num_features + np.arange(self.causal_context)) % self.positions
+            head_len = self.causal_context + self.valid_trim
+            x = self.window()[:, : head_len, np.newaxis]
+            for layer in self.head_layers:
+                x = layer.apply(x)
+            pooled = pooled - self.features[:, oldest].sum(axis = 1) + x.sum(axis = 1)
+        return pooled / self.positions
+
+    def probabilities(self):
+        """
+        Returns the seizure probability of the current window of each channel,
+        or None if fewer than sequence_len samples have been seen.
+        """
+        if not self.ready():
+            return None
+        logits = np.dot(self.pooled_features(), self.kernel)[:, 0] + self.bias[0]
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def process(self, block, step_size = STEP_SIZE):
+        """
+        Pushes a block of samples and returns the probabilities of every window
+        whose end falls on the step_size grid, as in create_merge_dataset.
+
+        :param block: 2D array, rows = channels, columns = samples.
+        :return: list of (end index, probabilities) tuples.
+        """
+        emitted = []
+        for samples in np.asarray(block).T:
+            self.update(samples)
+            if (self.ready() and
+                (self.num_samples - self.sequence_len) % step_size == 0):
+                emitted.append((self.num_samples, self.probabilities()))
+        return emitted
+
+
+# ------------------
+# EQUIVALENCE CHECK
+# ------------------
+def create_windows(channel, sequence_len = SEQUENCE_LEN, step_size = STEP_SIZE):
+    ends = np.arange(sequence_len, len(channel), step_size)
+    index = ends[:, np.newaxis] - sequence_len + np.arange(sequence_len)
+    return channel[index][:, :, np.newaxis]
+
+def check_equivalence(model, channels, atol = 1e-5):
+    """
+    Compares DenseWaveNet against model.predict on explicit windows and
+    returns the largest absolute difference in probability.
+    """
+    dense = DenseWaveNet(model)
+    dense_preds = dense.predict(channels)
+    max_diff = 0.0
+    for channel, channel_preds in zip(channels, dense_preds):
+        windowed = model.predict(create_windows(channel))[:, 0]
+        max_diff = max(max_diff, float(np.max(np.abs(windowed - channel_preds))))
+    if max_diff > atol:
+        raise AssertionError("Dense inference differs from windowed inference by " +
+                             str(max_diff))
+    return max_diff
+
+def check_streaming_equivalence(model, channels, atol = 1e-5):
+    """
+    Compares StreamingWaveNet against DenseWaveNet and returns the largest
+    absolute difference in probability.
+    """
+    dense_preds = DenseWaveNet(model).predict(channels)
+    stream = StreamingWaveNet(model, num_channels = len(channels))
+    emitted = stream.process(channels)
+    # create_merge_dataset never emits the window ending at the last sample
+    stream_preds = np.array([probs for end, probs in emitted
+                             if end < channels.shape[1]]).T
+    max_diff = float(np.max(np.abs(stream_preds - dense_preds)))
+    if max_diff > atol:
+        raise AssertionError("Streaming inference differs from dense inference by " +
+                             str(max_diff))
+    return max_diff
+
+
+# ------------------
+# MAIN METHOD
+# ------------------
+if __name__=="__main__":
+
+    # random channels stand in for decimated iEEG; equivalence does not
+    # depend on the signal
+    model = load_model(PATH_MODEL)
+    rng = np.random.RandomState(0)
+    channels = rng.standard_normal((3, 20 * SEQUENCE_LEN + 123)).astype(np.float32)
+    max_diff = check_equivalence(model, channels)
+    print("Dense and windowed predictions agree. Maximum difference: ")
+    print("%.2e" % max_diff)
+    max_diff = check_streaming_equivalence(model, channels)
+    print("Streaming and dense predictions agree. Maximum difference: ")
+    print("%.2e" % max_diff)